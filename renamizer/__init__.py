@@ -0,0 +1 @@
+# Core of Renamizer: metadata lookup, SQLite cache and renaming, with no GUI dependencies
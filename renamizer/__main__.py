@@ -0,0 +1,3 @@
+from renamizer.cli import main
+
+raise SystemExit(main())
@@ -0,0 +1,115 @@
+import json
+import random
+import threading
+import time
+from urllib.parse import parse_qsl, urlencode, urlparse, urlsplit, urlunsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from renamizer.instrument import count, timer
+
+# Default HTTP settings
+CONNECT_TIMEOUT = 5
+READ_TIMEOUT = 20
+MAX_RETRIES = 4
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30
+POOL_SIZE = 16
+HOST_LIMITS = {
+    "api.tvmaze.com": 8,       # TVMaze allows ~20 calls every 10 seconds
+    "api.themoviedb.org": 16,
+}
+DEFAULT_HOST_LIMIT = 8
+RETRY_STATUS = {429, 500, 502, 503, 504}
+# Query parameters left out of ETag store keys so credentials are never written to disk
+CREDENTIAL_PARAMS = {"api_key"}
+
+def cache_key(url):
+    parts = urlsplit(url)
+    query = [(key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True) if key not in CREDENTIAL_PARAMS]
+    return urlunsplit(parts._replace(query=urlencode(query)))
+
+
+class ApiClient:
+    # Shared HTTP client for TVMaze and TMDB: pooled keep-alive connections,
+    # per-host concurrency limits, timeouts, retries and ETag revalidation
+    def __init__(self, tvmaze_url, tmdb_url, tmdb_api_key=None, tmdb_token=None, etag_store=None,
+                 timeout=(CONNECT_TIMEOUT, READ_TIMEOUT), max_retries=MAX_RETRIES, host_limits=None):
+        self.tvmaze_url = tvmaze_url
+        self.tmdb_url = tmdb_url
+        self.tmdb_api_key = tmdb_api_key
+        self.tmdb_token = tmdb_token
+        self.timeout = timeout
+        self.max_retries = max_retries
+        # etag_store maps url (see cache_key) -> (etag, body); any dict-like object works
+        self.etags = etag_store if etag_store is not None else {}
+        self.host_limits = dict(HOST_LIMITS, **(host_limits or {}))
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._semaphores = {}
+        self._lock = threading.Lock()
+
+    def _semaphore(self, url):
+        host = urlparse(url).hostname or ""
+        with self._lock:
+            if host not in self._semaphores:
+                limit = self.host_limits.get(host, DEFAULT_HOST_LIMIT)
+                self._semaphores[host] = threading.BoundedSemaphore(limit)
+            return self._semaphores[host]
+
+    def _retry_delay(self, response, attempt):
+        # None when the server asks to wait longer than BACKOFF_MAX: the request fails
+        # instead of holding a worker for that long
+        retry_after = response.headers.get("Retry-After", "") if response is not None else ""
+        if retry_after.isdigit():
+            return float(retry_after) if float(retry_after) <= BACKOFF_MAX else None
+        # Full jitter keeps parallel workers from retrying in lockstep
+        return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+    def get_json(self, url, params=None, headers=None, revalidate=True):
+        # revalidate=False skips the ETag store, for large one-off responses such as bulk pages
+        if params:
+            url = f"{url}{'&' if '?' in url else '?'}{urlencode(params)}"
+        key = cache_key(url)
+        cached = self.etags.get(key) if revalidate else None
+        request_headers = dict(headers or {})
+        if cached:
+            request_headers["If-None-Match"] = cached[0]
+        host = urlparse(url).hostname or ""
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                count("http.retries")
+            count(f"http.requests.{host}")
+            try:
+                with self._semaphore(url), timer("http"):
+                    response = self.session.get(url, headers=request_headers, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == self.max_retries:
+                    raise
+                time.sleep(self._retry_delay(None, attempt))
+                continue
+            if response.status_code in RETRY_STATUS and attempt < self.max_retries:
+                delay = self._retry_delay(response, attempt)
+                if delay is not None:
+                    time.sleep(delay)
+                    continue
+            if response.status_code == 304 and cached:
+                count("http.not_modified")
+                return json.loads(cached[1])
+            response.raise_for_status()
+            etag = response.headers.get("ETag")
+            if etag and revalidate:
+                self.etags[key] = (etag, response.text)
+            return response.json()
+
+    def tvmaze(self, path, **params):
+        return self.get_json(f"{self.tvmaze_url}{path}", params)
+
+    def tmdb(self, path, **params):
+        if self.tmdb_api_key:
+            params["api_key"] = self.tmdb_api_key
+        headers = {"Authorization": f"Bearer {self.tmdb_token}"} if self.tmdb_token else None
+        return self.get_json(f"{self.tmdb_url}{path}", params, headers)
@@ -0,0 +1,20 @@
+from renamizer.plan import build_plan, execute_plan
+from renamizer.scanner import scan
+
+def scan_videos(directory, extensions=None):
+    return sorted(file.path for file in scan(directory, extensions))
+
+def rename_batch(show_name, year, pairs, output_dir, include_title=True, cancelled=None, progress=None, template=None,
+                 batch=None, stats=None, placement=None):
+    # Renames (episode, file) pairs and returns one result dict per processed file.
+    # `episode` may also be a list of consecutive episodes for multi-episode files.
+    # `cancelled` is an optional threading.Event checked between files and
+    # `progress(done, total)` is called as files are moved. `template` is a preset name or
+    # pattern (config.NAMING_TEMPLATE by default); ffprobe only runs if it uses media tokens.
+    # The whole batch is planned and checked first (renamizer.plan); entries with problems
+    # (duplicate or existing targets, paths too long) are reported as errors and not moved.
+    # Files are moved by renamizer.mover under the journal `batch` (a new one by default);
+    # pass a MoveStats as `stats` to follow copy throughput. `placement` links or copies
+    # files instead of moving them (config.PLACEMENT by default, see renamizer.mover.PLACEMENTS).
+    plan = build_plan(show_name, year, pairs, output_dir, include_title, template)
+    return execute_plan(plan, cancelled, progress, batch, stats, placement)
@@ -0,0 +1,468 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from renamizer import config, instrument
+
+# Reproducible benchmark of the rename pipeline against a local stub of the TVMaze and
+# TMDB APIs and a generated tree of dummy video files:
+#   python -m renamizer.bench --output base.json
+#   python -m renamizer.bench --compare base.json
+# Cache lookups are also timed on a generated cache of thousands of shows.
+# Nothing outside a temporary folder is touched (cache.db included).
+
+BENCH_SHOWS = 40
+EPISODES_PER_SEASON = 25
+FILE_SIZE = 4096
+MEDIA_TEMPLATE = "{show}/Season {season:02d}/{show} - s{season:02d}e{episode:02d}[ {resolution}]"
+# Seasons of the TMDB shows timed one by one, by bench show index (show 0 has the seasons
+# the file tree needs): seasons come through append_to_response, 20 per request
+TMDB_SEASONS = {1: 1, 2: 10, 3: 30, 4: 45}
+# Shows in the generated cache used for lookup timings (see make_cache), and words their
+# names are made of so the full-text index has realistic vocabulary
+CACHE_SHOWS = 5000
+CACHE_WORDS = ("Doctor", "House", "Lost", "Office", "Crown", "Dark", "Wire", "Night", "Blue", "Bad",
+               "Good", "Place", "Star", "Time", "Fire", "Ice", "Dead", "Walking", "True", "Story")
+# Query matching the first 10 bench shows, whose akas are fetched one request per result
+AKAS_QUERY = "Bench Show"
+# Filenames and the episodes parse_filename must read from them, checked before timing:
+# numbers after a hyphen are only further episodes when they look like episode numbers
+PARSE_CASES = {
+    "Show - S01E03 - 720p WEB.mkv": [3],
+    "Show.S01E03-1080p.mkv": [3],
+    "Show - S01E03 - 480p.mkv": [3],
+    "Show S01E03 - 2 Broke Girls.mkv": [3],
+    "Show.S01E03-2.Broke.Girls.mkv": [3],
+    "Show.1x03-720p.mkv": [3],
+    "Show.S01E01-E40.mkv": [1],
+    "Show.S01E01E02.mkv": [1, 2],
+    "Show.S01E01-E03.mkv": [1, 2, 3],
+    "Show.S01E01-02.mkv": [1, 2],
+    "Show.1x01-1x02.mkv": [1, 2],
+}
+
+def show_name(index):
+    return f"Bench Show {index}"
+
+def stub_episodes(seasons):
+    return [{"season": s, "number": e, "name": f"Episode {s}x{e:02d}", "airdate": f"2010-{s % 12 + 1:02d}-{e % 28 + 1:02d}"}
+            for s in range(1, seasons + 1) for e in range(1, EPISODES_PER_SEASON + 1)]
+
+def stub_tmdb_season(season):
+    return {"season_number": season, "episodes": [
+        {"season_number": season, "episode_number": e, "name": f"Episodio {season}x{e:02d}",
+         "air_date": f"2010-{season % 12 + 1:02d}-{e % 28 + 1:02d}"}
+        for e in range(1, EPISODES_PER_SEASON + 1)
+    ]}
+
+class StubApi:
+    # TVMaze and TMDB endpoints used by the app, with the same data on every run and a
+    # fixed latency per request
+    def __init__(self, seasons, latency):
+        self.seasons = seasons
+        self.latency = latency
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    def tvmaze_show(self, index):
+        return {"id": index + 1, "name": show_name(index), "premiered": f"{2000 + index % 20}-01-01", "status": "Ended",
+                "updated": 1, "weight": 100 - index, "externals": {"thetvdb": 70000 + index, "imdb": f"tt{900000 + index}"}}
+
+    def tmdb_show(self, index):
+        return {"id": 5000 + index, "name": show_name(index), "original_name": show_name(index),
+                "first_air_date": f"{2000 + index % 20}-01-01", "popularity": 100 - index, "status": "Ended"}
+
+    def tmdb_seasons(self, index):
+        return self.seasons if index == 0 else TMDB_SEASONS.get(index, 1)
+
+    def tmdb_details(self, index, append):
+        # /tv/{id}: the show with its season list and every season/N asked for in
+        # append_to_response that exists
+        seasons = self.tmdb_seasons(index)
+        show = dict(self.tmdb_show(index), seasons=[{"season_number": n} for n in range(1, seasons + 1)])
+        for item in append.split(",") if append else []:
+            kind, _, number = item.partition("/")
+            if kind == "season" and number.isdigit() and 1 <= int(number) <= seasons:
+                show[item] = stub_tmdb_season(int(number))
+        return show
+
+    def matches(self, query):
+        return [index for index in range(BENCH_SHOWS) if query.lower() in show_name(index).lower()][:10]
+
+    def handle(self, path):
+        url = urlparse(path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        parts = url.path.strip("/").split("/")
+        if parts[0] == "tvmaze":
+            if parts[1:] == ["search", "shows"]:
+                return [{"score": 1, "show": self.tvmaze_show(index)} for index in self.matches(query.get("q", ""))]
+            if parts[1] == "shows" and parts[-1] == "akas":
+                return [{"name": f"Serie de prueba {parts[2]}", "country": {"code": "ES"}}]
+            if parts[1] == "shows" and parts[-1] == "episodes":
+                return stub_episodes(self.seasons if parts[2] == "1" else 1)
+            if parts[1] == "shows":
+                return self.tvmaze_show(int(parts[2]) - 1)
+        if parts[0] == "tmdb":
+            if parts[1:] == ["search", "tv"]:
+                return {"results": [self.tmdb_show(index) for index in self.matches(query.get("query", ""))]}
+            if parts[1] == "tv" and parts[-1] == "external_ids":
+                index = int(parts[2]) - 5000
+                return {"tvdb_id": 70000 + index, "imdb_id": f"tt{900000 + index}"}
+            if parts[1] == "tv":
+                return self.tmdb_details(int(parts[2]) - 5000, query.get("append_to_response", ""))
+        return None
+
+    def serve(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                with stub.lock:
+                    stub.requests += 1
+                time.sleep(stub.latency)
+                body = stub.handle(self.path)
+                data = json.dumps(body).encode()
+                self.send_response(200 if body is not None else 404)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+def cached_show_name(index):
+    words = len(CACHE_WORDS)
+    return f"{CACHE_WORDS[index % words]} {CACHE_WORDS[index // words % words]} {index}"
+
+def cache_show(index):
+    # TVMaze-like show (id index + 1) with one season of episodes, sized like real responses
+    summary = f"<p>{cached_show_name(index)} " + " ".join(CACHE_WORDS).lower() * 3 + ".</p>"
+    show = {"id": index + 1, "name": cached_show_name(index), "premiered": f"{1990 + index % 35}-01-01", "status": "Ended",
+            "updated": 1, "weight": index % 100, "akas": [], "language": "English", "genres": ["Drama", "Crime"],
+            "runtime": 60, "summary": summary, "url": f"https://www.tvmaze.com/shows/{index + 1}",
+            "schedule": {"time": "21:00", "days": ["Sunday"]}, "network": {"id": index % 50, "name": "Bench Network"},
+            "image": {"medium": f"https://static.tvmaze.com/{index}/medium.jpg", "original": f"https://static.tvmaze.com/{index}/original.jpg"},
+            "externals": {"thetvdb": 70000 + index, "imdb": f"tt{900000 + index}"}}
+    episodes = [dict(ep, id=index * 100 + ep["number"], runtime=60, summary=summary[:200],
+                     url=f"https://www.tvmaze.com/episodes/{index * 100 + ep['number']}") for ep in stub_episodes(1)]
+    return show, episodes
+
+def make_cache(shows):
+    # Fills the current cache.db (config.DB_FILE) with `shows` TVMaze shows (ids 1..shows)
+    # and a fresh season of episodes for each, through the same rows the app writes
+    from renamizer.cache import compress, get_connection
+    from renamizer.metadata import SHOW_COLUMNS, SHOW_PLACEHOLDERS, episode_row, show_row
+    now = datetime.now().isoformat()
+    conn = get_connection()
+    with conn:
+        for index in range(shows):
+            show, episodes = cache_show(index)
+            conn.execute(f"INSERT OR REPLACE INTO shows ({SHOW_COLUMNS}) VALUES ({SHOW_PLACEHOLDERS})", show_row("tvmaze", show, now))
+            conn.executemany(
+                "INSERT INTO episodes (show_id, source, season, episode, title, air_date, payload) VALUES (?, 'tvmaze', ?, ?, ?, ?, ?)",
+                [(show["id"], *row[:4], compress(json.dumps(row[4]))) for row in (episode_row("tvmaze", ep) for ep in episodes)]
+            )
+            conn.execute("INSERT INTO episode_lists (source, show_id, status, fetched_at) VALUES ('tvmaze', ?, 'Ended', ?)", (show["id"], now))
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+def make_legacy_cache(db_file, shows):
+    # The same shows in the layout before typed columns (schema version 8: every response
+    # stored as JSON text in a data column). Returns its connection.
+    from renamizer.cache import MIGRATIONS
+    now = datetime.now().isoformat()
+    conn = sqlite3.connect(db_file)
+    for statements in MIGRATIONS[:8]:
+        for statement in statements:
+            conn.execute(statement)
+    conn.execute("PRAGMA user_version = 8")
+    with conn:
+        for index in range(shows):
+            show, episodes = cache_show(index)
+            conn.execute("INSERT INTO shows (source, id, name, year, data, last_updated, popularity) VALUES ('tvmaze', ?, ?, ?, ?, ?, ?)",
+                         (show["id"], show["name"], show["premiered"][:4], json.dumps(show), now, show["weight"]))
+            conn.executemany(
+                "INSERT INTO episodes (source, show_id, season, episode, title, air_date, data) VALUES ('tvmaze', ?, ?, ?, ?, ?, ?)",
+                [(show["id"], ep["season"], ep["number"], ep["name"], ep["airdate"], json.dumps(ep)) for ep in episodes]
+            )
+            conn.execute("INSERT INTO episode_lists (source, show_id, status, fetched_at) VALUES ('tvmaze', ?, 'Ended', ?)", (show["id"], now))
+    return conn
+
+def legacy_search(conn, query):
+    # Cache hit as it was read before typed columns: every row's JSON decoded for its names
+    from renamizer.metadata import spanish_name
+    match = " ".join(f'"{word}"*' for word in query.split())
+    rows = conn.execute(
+        """SELECT s.id, s.source, s.name, s.year, s.data, s.last_updated
+           FROM shows_fts JOIN shows s ON s.rowid = shows_fts.rowid
+           WHERE shows_fts MATCH ? AND s.source = 'tvmaze'
+           ORDER BY lower(s.name) = lower(?) DESC, round(bm25(shows_fts), 1), s.popularity DESC
+           LIMIT ?""",
+        (match, query, config.CACHE_SEARCH_LIMIT)
+    ).fetchall()
+    return [(row[0], spanish_name(json.loads(row[4])), row[3], json.loads(row[4])) for row in rows]
+
+def legacy_episodes(conn, show_id):
+    rows = conn.execute("SELECT season, episode, title, air_date, data FROM episodes WHERE show_id = ? AND source = 'tvmaze'", (show_id,))
+    return [(row[0], row[1], row[2], row[3], json.loads(row[4])) for row in rows]
+
+def make_tree(root, files):
+    # files dummy videos of Bench Show 0, a season per folder, named like real releases
+    paths = []
+    for n in range(files):
+        season, episode = n // EPISODES_PER_SEASON + 1, n % EPISODES_PER_SEASON + 1
+        folder = os.path.join(root, show_name(0), f"Season {season}")
+        os.makedirs(folder, exist_ok=True)
+        path = os.path.join(folder, f"Bench.Show.0.S{season:02d}E{episode:02d}.720p.WEB.x264.mkv")
+        with open(path, "wb") as f:
+            f.write(b"\0" * FILE_SIZE)
+        paths.append(path)
+    return paths
+
+def check_parsing():
+    # Raises if any PARSE_CASES filename reads as other episodes
+    from renamizer.matcher import parse_filename
+    wrong = [name for name, episodes in PARSE_CASES.items() if parse_filename(name).get("episodes") != episodes]
+    if wrong:
+        raise RuntimeError("Episodios mal leídos de: " + ", ".join(wrong))
+
+class Runner:
+    def __init__(self, repeat):
+        self.repeat = repeat
+        self.results = {}
+
+    def measure(self, name, func, setup=None, loops=1):
+        # repeat runs of func (setup runs before each one and isn't timed). Operations far
+        # below a millisecond are called loops times per run and reported per call.
+        runs = []
+        for _ in range(self.repeat):
+            if setup:
+                setup()
+            runs.append(self.time(func, loops))
+        self.add(name, runs)
+
+    def time(self, func, loops=1):
+        started = time.perf_counter()
+        for _ in range(loops):
+            func()
+        return (time.perf_counter() - started) * 1000 / loops
+
+    def add(self, name, runs):
+        self.results[name] = {"median_ms": round(statistics.median(runs), 4), "min_ms": round(min(runs), 4), "runs": len(runs)}
+        print(f"  {name:<22} {self.results[name]['median_ms']:>10.3f} ms", file=sys.stderr)
+
+def run_benchmark(files, latency, repeat, cache_shows=CACHE_SHOWS):
+    # Returns the report dict: environment, scenario timings and instrumentation
+    from renamizer import metadata
+    from renamizer.batch import scan_videos
+    from renamizer.matcher import match_files
+    from renamizer.mover import rollback_batch
+    from renamizer.plan import build_plan, execute_plan
+
+    work = tempfile.mkdtemp(prefix="renamizer-bench-")
+    stub = StubApi(max(1, -(-files // EPISODES_PER_SEASON)), latency / 1000)
+    server = stub.serve()
+    saved = (config.DB_FILE, metadata.api.tvmaze_url, metadata.api.tmdb_url, metadata.api.tmdb_api_key, metadata.api.tmdb_token)
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    metadata.api.tvmaze_url, metadata.api.tmdb_url = f"{base_url}/tvmaze", f"{base_url}/tmdb"
+    metadata.api.tmdb_api_key, metadata.api.tmdb_token = "bench", None
+    runner = Runner(repeat)
+    databases = iter(range(10 ** 6))
+
+    def fresh_cache():
+        config.DB_FILE = os.path.join(work, f"cache-{next(databases)}.db")
+        metadata.search_memo.clear()
+        metadata.episodes_memo.clear()
+
+    try:
+        check_parsing()
+        instrument.reset()
+        source_dir = os.path.join(work, "in")
+        output_dir = os.path.join(work, "out")
+        make_tree(source_dir, files)
+        query = show_name(0)
+        print(f"Benchmark: {files} archivos, {latency:g} ms de latencia, {repeat} repeticiones", file=sys.stderr)
+
+        runner.measure("search_cold", lambda: metadata.search_shows(query), setup=fresh_cache)
+        runner.measure("search_cached", lambda: (metadata.search_memo.clear(), metadata.search_shows(query)), loops=50)
+        runner.measure("search_memo", lambda: metadata.search_shows(query), loops=5000)
+        # Cold TVMaze search whose akas are fetched by one worker, then by config.AKAS_WORKERS:
+        # with enough workers the akas cost about one round trip, not one per result
+        akas_workers = config.AKAS_WORKERS
+        try:
+            for name, workers in (("akas_serial", 1), ("akas_parallel", akas_workers)):
+                config.AKAS_WORKERS = workers
+                runner.measure(name, lambda: metadata.search_tvmaze(AKAS_QUERY), setup=fresh_cache)
+        finally:
+            config.AKAS_WORKERS = akas_workers
+        runner.measure("episodes_cold", lambda: metadata.get_episodes(1, "tvmaze"),
+                       setup=lambda: (metadata.episodes_memo.clear(), metadata.forget_show(1, "tvmaze")))
+        runner.measure("episodes_cached", lambda: (metadata.episodes_memo.clear(), metadata.get_episodes(1, "tvmaze")), loops=50)
+        runner.measure("episodes_memo", lambda: metadata.get_episodes(1, "tvmaze"), loops=5000)
+        runner.measure("episodes_tmdb_cold", lambda: metadata.get_episodes(5000, "tmdb"),
+                       setup=lambda: (metadata.episodes_memo.clear(), metadata.forget_show(5000, "tmdb")))
+        # Requests and latency of a cold TMDB episode list by number of seasons
+        tmdb_episodes = []
+        for index, seasons in TMDB_SEASONS.items():
+            runs, requests = [], []
+            for _ in range(repeat):
+                metadata.episodes_memo.clear()
+                metadata.forget_show(5000 + index, "tmdb")
+                before = stub.requests
+                runs.append(runner.time(lambda: metadata.get_episodes(5000 + index, "tmdb")))
+                requests.append(stub.requests - before)
+            name = f"episodes_tmdb_{seasons}s"
+            runner.add(name, runs)
+            tmdb_episodes.append({"seasons": seasons, "requests": max(requests), "median_ms": runner.results[name]["median_ms"]})
+        # Cache hits on a cache of thousands of shows: full-text search, a show by id and an
+        # episode list (the in-memory copies are cleared so SQLite is read every time)
+        bench_db = config.DB_FILE
+        config.DB_FILE = os.path.join(work, "large-cache.db")
+        make_cache(cache_shows)
+        wanted = cache_shows // 2
+        runner.measure("lookup_search", lambda: metadata.search_cache(cached_show_name(wanted), "tvmaze"), loops=200)
+        runner.measure("lookup_show", lambda: metadata.get_show(wanted + 1, "tvmaze"), loops=1000)
+        runner.measure("lookup_episodes", lambda: (metadata.episodes_memo.clear(), metadata.get_episodes(wanted + 1, "tvmaze")), loops=200)
+        # Search hits with their show data, episode lists (lookup_episodes above) and the
+        # database size in the current layout and in the one before typed columns
+        query_words = " ".join(cached_show_name(wanted).split()[:2])
+        legacy = make_legacy_cache(os.path.join(work, "legacy-cache.db"), cache_shows)
+        runner.measure("hit_search", lambda: [
+            metadata.cached_show_data("tvmaze", row[0], row[2], row[4], row[5], row[6])
+            for row in metadata.search_cache(query_words, "tvmaze")
+        ], loops=200)
+        runner.measure("hit_search_legacy", lambda: legacy_search(legacy, query_words), loops=200)
+        runner.measure("lookup_episodes_legacy", lambda: legacy_episodes(legacy, wanted + 1), loops=200)
+        legacy.close()
+        cache_size = {"bytes": os.path.getsize(config.DB_FILE), "legacy_bytes": os.path.getsize(os.path.join(work, "legacy-cache.db")),
+                      "search_results": len(metadata.search_cache(query_words, "tvmaze"))}
+        metadata.episodes_memo.clear()
+        config.DB_FILE = bench_db
+        episodes = metadata.get_episodes(1, "tvmaze")
+
+        def forget_scan_index():
+            with sqlite3.connect(config.DB_FILE) as conn:
+                conn.execute("DELETE FROM scan_dirs")
+                conn.execute("DELETE FROM scan_files")
+
+        runner.measure("scan_cold", lambda: scan_videos(source_dir), setup=forget_scan_index)
+        runner.measure("scan_indexed", lambda: scan_videos(source_dir), loops=10)
+        videos = scan_videos(source_dir)
+        matched = {}
+        runner.measure("match", lambda: matched.update(result=match_files(videos, episodes)))
+        pairs = [(match["episodes"], match["file"]) for match in matched["result"][0]]
+        runner.measure("plan", lambda: build_plan(query, 2000, pairs, output_dir))
+        if shutil.which(config.FFPROBE_PATH) or os.path.exists(config.FFPROBE_PATH):
+            runner.measure("plan_media", lambda: build_plan(query, 2000, pairs, output_dir, template=MEDIA_TEMPLATE),
+                           setup=lambda: sqlite3.connect(config.DB_FILE).execute("DELETE FROM probes").connection.commit())
+        plan = build_plan(query, 2000, pairs, output_dir)
+        # Every run places the whole batch and then undoes it: moves are put back, links and
+        # copies removed
+        for placement, suffix in (("move", ""), ("hardlink", "_hardlink"), ("copy", "_copy")):
+            execute_runs, rollback_runs = [], []
+            for run in range(repeat):
+                batch = f"bench-{placement}-{run}"
+                results = []
+                execute_runs.append(runner.time(
+                    lambda: results.extend(execute_plan([dict(entry) for entry in plan], batch=batch, placement=placement))
+                ))
+                moved = {}
+                rollback_runs.append(runner.time(lambda: moved.update(rollback_batch(batch))))
+                if any(result["status"] != "renamed" for result in results) or any(result["status"] != "done" for result in moved.values()):
+                    raise RuntimeError("El benchmark no pudo mover todos los archivos")
+            runner.add("execute" + suffix, execute_runs)
+            runner.add("rollback" + suffix, rollback_runs)
+        return {
+            "environment": {
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "sqlite": sqlite3.sqlite_version,
+                "files": files,
+                "matched": len(pairs),
+                "latency_ms": latency,
+                "repeat": repeat,
+                "stub_requests": stub.requests,
+                "cache_shows": cache_shows,
+            },
+            "scenarios": runner.results,
+            "akas": {
+                "results": len(stub.matches(AKAS_QUERY)),
+                "workers": config.AKAS_WORKERS,
+                "speedup": round(runner.results["akas_serial"]["min_ms"] / runner.results["akas_parallel"]["min_ms"], 2),
+            },
+            "tmdb_episodes": tmdb_episodes,
+            "cache_size": cache_size,
+            "instrumentation": instrument.snapshot(),
+            "memo": metadata.memo_stats(),
+        }
+    finally:
+        server.shutdown()
+        config.DB_FILE, metadata.api.tvmaze_url, metadata.api.tmdb_url, metadata.api.tmdb_api_key, metadata.api.tmdb_token = saved
+        shutil.rmtree(work, ignore_errors=True)
+
+def compare(report, baseline, tolerance, min_delta):
+    # Prints each scenario against the baseline and returns the names slower than
+    # baseline * (1 + tolerance) by at least min_delta milliseconds. The fastest run of each scenario is compared: it is the
+    # value least affected by other load on the machine.
+    regressions = []
+    print(f"{'escenario':<22} {'base ms':>10} {'ahora ms':>10} {'ratio':>7}")
+    for name, result in report["scenarios"].items():
+        before = baseline.get("scenarios", {}).get(name)
+        if not before:
+            print(f"{name:<22} {'-':>10} {result['min_ms']:>10.3f}")
+            continue
+        ratio = result["min_ms"] / before["min_ms"] if before["min_ms"] else 1.0
+        slower = ratio > 1 + tolerance and result["min_ms"] - before["min_ms"] >= min_delta
+        if slower:
+            regressions.append(name)
+        print(f"{name:<22} {before['min_ms']:>10.3f} {result['min_ms']:>10.3f} {ratio:>6.2f}x{'  <- más lento' if slower else ''}")
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m renamizer.bench",
+        description="Mide el rendimiento de búsqueda, episodios, exploración, emparejado, plan y movimiento con una API local simulada."
+    )
+    parser.add_argument("--files", type=int, default=500, help="archivos de vídeo de prueba (por defecto: 500)")
+    parser.add_argument("--latency", type=float, default=20, help="latencia simulada de la API en ms (por defecto: 20)")
+    parser.add_argument("--cache-shows", type=int, default=CACHE_SHOWS,
+                        help=f"series de la caché generada para medir las consultas (por defecto: {CACHE_SHOWS})")
+    parser.add_argument("--repeat", type=int, default=5, help="repeticiones por escenario; se guardan la mediana y el mínimo (por defecto: 5)")
+    parser.add_argument("--output", metavar="FICHERO", help="guarda el informe JSON")
+    parser.add_argument("--compare", metavar="FICHERO", help="compara con un informe anterior y termina con 1 si algo es más lento")
+    parser.add_argument("--tolerance", type=float, default=0.5, help="margen relativo antes de considerar un escenario más lento (por defecto: 0.5)")
+    parser.add_argument("--min-delta", type=float, default=1.0, help="diferencia mínima en ms para contar como regresión (por defecto: 1.0)")
+    parser.add_argument("--profile", metavar="FICHERO", help="guarda un perfil de cProfile del benchmark")
+    args = parser.parse_args(argv)
+    with instrument.profile(args.profile):
+        report = run_benchmark(args.files, args.latency, args.repeat, args.cache_shows)
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+    if not args.compare:
+        if not args.output:
+            sys.stdout.write(output + "\n")
+        return 0
+    with open(args.compare, encoding="utf-8") as f:
+        regressions = compare(report, json.load(f), args.tolerance, args.min_delta)
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,472 @@
+import atexit
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+from renamizer import config
+
+# Text indexed for a show: display name, original name and every aka name
+FTS_NAMES_SQL = """{row}.name || ' ' || coalesce({row}.original_name, '')
+    || ' ' || coalesce((SELECT group_concat(json_extract(value, '$.name'), ' ') FROM json_each({row}.akas)), '')"""
+# Same text while shows still kept the whole API response in a data column (migrations 3 and 8)
+FTS_NAMES_JSON_SQL = """{row}.name || ' ' || coalesce(json_extract({row}.data, '$.name'), '')
+    || ' ' || coalesce(json_extract({row}.data, '$.original_name'), '')
+    || ' ' || coalesce((SELECT group_concat(json_extract(value, '$.name'), ' ') FROM json_each({row}.data, '$.akas')), '')"""
+
+# Schema migrations, applied in order and tracked with PRAGMA user_version.
+# Each entry is the list of statements that upgrades the schema by one version.
+MIGRATIONS = [
+    # 1: original schema
+    [
+        """CREATE TABLE IF NOT EXISTS shows (
+            id INTEGER PRIMARY KEY,
+            source TEXT,
+            name TEXT,
+            year INTEGER,
+            data TEXT,
+            last_updated TEXT
+        )""",
+        """CREATE TABLE IF NOT EXISTS episodes (
+            show_id INTEGER,
+            source TEXT,
+            season INTEGER,
+            episode INTEGER,
+            title TEXT,
+            air_date TEXT,
+            data TEXT
+        )""",
+        """CREATE TABLE IF NOT EXISTS http_cache (
+            url TEXT PRIMARY KEY,
+            etag TEXT,
+            body TEXT
+        )""",
+    ],
+    # 2: composite keys per source, deduplicating existing rows (latest row wins)
+    [
+        """CREATE TABLE shows_new (
+            source TEXT NOT NULL,
+            id INTEGER NOT NULL,
+            name TEXT,
+            year INTEGER,
+            data TEXT,
+            last_updated TEXT,
+            PRIMARY KEY (source, id)
+        )""",
+        """INSERT OR REPLACE INTO shows_new (source, id, name, year, data, last_updated)
+            SELECT source, id, name, year, data, last_updated FROM shows
+            WHERE source IS NOT NULL AND id IS NOT NULL ORDER BY rowid""",
+        "DROP TABLE shows",
+        "ALTER TABLE shows_new RENAME TO shows",
+        "CREATE INDEX shows_source_name ON shows (source, name)",
+        """CREATE TABLE episodes_new (
+            source TEXT NOT NULL,
+            show_id INTEGER NOT NULL,
+            season INTEGER NOT NULL,
+            episode INTEGER NOT NULL,
+            title TEXT,
+            air_date TEXT,
+            data TEXT,
+            PRIMARY KEY (source, show_id, season, episode)
+        ) WITHOUT ROWID""",
+        """INSERT OR REPLACE INTO episodes_new (source, show_id, season, episode, title, air_date, data)
+            SELECT source, show_id, season, episode, title, air_date, data FROM episodes
+            WHERE source IS NOT NULL AND show_id IS NOT NULL AND season IS NOT NULL AND episode IS NOT NULL
+            ORDER BY rowid""",
+        "DROP TABLE episodes",
+        "ALTER TABLE episodes_new RENAME TO episodes",
+    ],
+    # 3: full-text index over names, original names and akas, plus popularity for ranking
+    [
+        "ALTER TABLE shows ADD COLUMN popularity REAL NOT NULL DEFAULT 0",
+        "UPDATE shows SET popularity = coalesce(json_extract(data, '$.weight'), json_extract(data, '$.popularity'), 0)",
+        "CREATE VIRTUAL TABLE shows_fts USING fts5(names, tokenize = 'unicode61 remove_diacritics 2')",
+        f"INSERT INTO shows_fts (rowid, names) SELECT rowid, {FTS_NAMES_JSON_SQL.format(row='shows')} FROM shows",
+        f"""CREATE TRIGGER shows_fts_insert AFTER INSERT ON shows BEGIN
+            INSERT INTO shows_fts (rowid, names) VALUES (new.rowid, {FTS_NAMES_JSON_SQL.format(row='new')});
+        END""",
+        """CREATE TRIGGER shows_fts_delete AFTER DELETE ON shows BEGIN
+            DELETE FROM shows_fts WHERE rowid = old.rowid;
+        END""",
+        f"""CREATE TRIGGER shows_fts_update AFTER UPDATE ON shows BEGIN
+            DELETE FROM shows_fts WHERE rowid = old.rowid;
+            INSERT INTO shows_fts (rowid, names) VALUES (new.rowid, {FTS_NAMES_JSON_SQL.format(row='new')});
+        END""",
+    ],
+    # 4: fetch time and show status per cached episode list
+    [
+        """CREATE TABLE episode_lists (
+            source TEXT NOT NULL,
+            show_id INTEGER NOT NULL,
+            status TEXT,
+            fetched_at TEXT NOT NULL,
+            PRIMARY KEY (source, show_id)
+        )""",
+    ],
+    # 5: persistent directory scan index
+    [
+        """CREATE TABLE scan_dirs (
+            path TEXT PRIMARY KEY,
+            mtime_ns INTEGER NOT NULL,
+            subdirs TEXT NOT NULL
+        )""",
+        """CREATE TABLE scan_files (
+            path TEXT PRIMARY KEY,
+            dir TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            inode INTEGER
+        )""",
+        "CREATE INDEX scan_files_dir ON scan_files (dir)",
+    ],
+    # 6: ffprobe results, valid while the file's size and mtime are unchanged
+    [
+        """CREATE TABLE probes (
+            path TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            info TEXT NOT NULL
+        )""",
+    ],
+    # 7: journal of file moves, so interrupted batches can be resumed or rolled back
+    [
+        """CREATE TABLE move_journal (
+            batch TEXT NOT NULL,
+            seq INTEGER NOT NULL,
+            source TEXT NOT NULL,
+            target TEXT NOT NULL,
+            status TEXT NOT NULL,
+            method TEXT,
+            bytes INTEGER,
+            error TEXT,
+            PRIMARY KEY (batch, source)
+        )""",
+        "CREATE INDEX move_journal_status ON move_journal (status)",
+    ],
+    # 8: bulk sync state per source; the FTS index is only rebuilt when names or data change,
+    # so refreshing last_updated on every synced show doesn't reindex them
+    [
+        """CREATE TABLE sync_state (
+            source TEXT PRIMARY KEY,
+            synced_at TEXT NOT NULL
+        )""",
+        "DROP TRIGGER shows_fts_update",
+        f"""CREATE TRIGGER shows_fts_update AFTER UPDATE OF name, data ON shows BEGIN
+            DELETE FROM shows_fts WHERE rowid = old.rowid;
+            INSERT INTO shows_fts (rowid, names) VALUES (new.rowid, {FTS_NAMES_JSON_SQL.format(row='new')});
+        END""",
+    ],
+    # 9: typed columns for the fields the app reads and the raw API payload compressed
+    # (see compress/decompress), decoded only when something asks for it
+    [
+        "DROP TRIGGER shows_fts_insert",
+        "DROP TRIGGER shows_fts_delete",
+        "DROP TRIGGER shows_fts_update",
+        "DROP TABLE shows_fts",
+        """CREATE TABLE shows_new (
+            source TEXT NOT NULL,
+            id INTEGER NOT NULL,
+            name TEXT,
+            original_name TEXT,
+            year INTEGER,
+            status TEXT,
+            updated INTEGER,
+            akas TEXT,
+            popularity REAL NOT NULL DEFAULT 0,
+            last_updated TEXT,
+            payload BLOB,
+            PRIMARY KEY (source, id)
+        )""",
+        """INSERT INTO shows_new (source, id, name, original_name, year, status, updated, akas, popularity, last_updated, payload)
+            SELECT source, id, name,
+                CASE source WHEN 'tmdb' THEN json_extract(data, '$.original_name') ELSE json_extract(data, '$.name') END,
+                year, json_extract(data, '$.status'), json_extract(data, '$.updated'),
+                CASE WHEN json_type(data, '$.akas') = 'array' THEN json_extract(data, '$.akas') END,
+                popularity, last_updated, CASE WHEN last_updated IS NOT NULL THEN compress(data) END
+            FROM shows ORDER BY rowid""",
+        "DROP TABLE shows",
+        "ALTER TABLE shows_new RENAME TO shows",
+        "CREATE INDEX shows_source_name ON shows (source, name)",
+        "CREATE VIRTUAL TABLE shows_fts USING fts5(names, tokenize = 'unicode61 remove_diacritics 2')",
+        f"INSERT INTO shows_fts (rowid, names) SELECT rowid, {FTS_NAMES_SQL.format(row='shows')} FROM shows",
+        f"""CREATE TRIGGER shows_fts_insert AFTER INSERT ON shows BEGIN
+            INSERT INTO shows_fts (rowid, names) VALUES (new.rowid, {FTS_NAMES_SQL.format(row='new')});
+        END""",
+        """CREATE TRIGGER shows_fts_delete AFTER DELETE ON shows BEGIN
+            DELETE FROM shows_fts WHERE rowid = old.rowid;
+        END""",
+        f"""CREATE TRIGGER shows_fts_update AFTER UPDATE OF name, original_name, akas ON shows BEGIN
+            DELETE FROM shows_fts WHERE rowid = old.rowid;
+            INSERT INTO shows_fts (rowid, names) VALUES (new.rowid, {FTS_NAMES_SQL.format(row='new')});
+        END""",
+        """CREATE TABLE episodes_new (
+            source TEXT NOT NULL,
+            show_id INTEGER NOT NULL,
+            season INTEGER NOT NULL,
+            episode INTEGER NOT NULL,
+            title TEXT,
+            air_date TEXT,
+            payload BLOB,
+            PRIMARY KEY (source, show_id, season, episode)
+        ) WITHOUT ROWID""",
+        """INSERT INTO episodes_new (source, show_id, season, episode, title, air_date, payload)
+            SELECT source, show_id, season, episode, title, air_date, compress(data) FROM episodes""",
+        "DROP TABLE episodes",
+        "ALTER TABLE episodes_new RENAME TO episodes",
+    ],
+    # 10: TheTVDB/IMDb ids linking the TVMaze and TMDB rows of the same show
+    [
+        "ALTER TABLE shows ADD COLUMN tvdb_id INTEGER",
+        "ALTER TABLE shows ADD COLUMN imdb_id TEXT",
+        """UPDATE shows SET tvdb_id = json_extract(payload_text(payload), '$.externals.thetvdb'),
+                imdb_id = nullif(json_extract(payload_text(payload), '$.externals.imdb'), '')
+            WHERE source = 'tvmaze' AND payload IS NOT NULL""",
+        "CREATE INDEX shows_tvdb ON shows (tvdb_id) WHERE tvdb_id IS NOT NULL",
+        "CREATE INDEX shows_imdb ON shows (imdb_id) WHERE imdb_id IS NOT NULL",
+    ],
+    # 11: video files in output libraries with the episode their name says and a partial
+    # content fingerprint, computed when first needed (see renamizer.library)
+    [
+        """CREATE TABLE library_files (
+            path TEXT PRIMARY KEY,
+            root TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            fingerprint TEXT,
+            show TEXT,
+            season INTEGER,
+            episode INTEGER
+        )""",
+        "CREATE INDEX library_files_root ON library_files (root)",
+    ],
+    # 12: placement of each journaled batch (NULL for moves), see renamizer.mover.PLACEMENTS
+    [
+        "ALTER TABLE move_journal ADD COLUMN placement TEXT",
+    ],
+    # 13: ETag cache keyed by URLs without credentials, with compressed bodies and a store
+    # time to prune the oldest entries beyond config.HTTP_CACHE_MAX_ENTRIES. Old entries
+    # (plain bodies, TMDB urls with the api_key) are dropped.
+    [
+        "DROP TABLE http_cache",
+        """CREATE TABLE http_cache (
+            url TEXT PRIMARY KEY,
+            etag TEXT NOT NULL,
+            body BLOB NOT NULL,
+            stored_at REAL NOT NULL
+        )""",
+        "CREATE INDEX http_cache_stored ON http_cache (stored_at)",
+    ],
+    # 14: year of the show a library file belongs to, so a remake's episodes aren't taken for
+    # the original's. Existing rows are dropped to be parsed again (fingerprints included).
+    [
+        "ALTER TABLE library_files ADD COLUMN year INTEGER",
+        "DELETE FROM library_files",
+    ],
+]
+
+def compress(text):
+    # zlib-compressed UTF-8 for API payloads (zstd isn't in the standard library)
+    return zlib.compress(text.encode("utf-8")) if text is not None else None
+
+def decompress(blob):
+    # Decoded API payload, or None
+    return json.loads(zlib.decompress(blob)) if blob is not None else None
+
+def payload_text(blob):
+    # JSON text of a compressed payload, for SQL (json_extract over payloads)
+    return zlib.decompress(blob).decode("utf-8") if blob is not None else None
+
+def migrate_db(conn):
+    while conn.execute("PRAGMA user_version").fetchone()[0] < len(MIGRATIONS):
+        # The write lock is taken before reading the version again so two processes
+        # opening an old database don't both apply the same migration
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            if version < len(MIGRATIONS):
+                for statement in MIGRATIONS[version]:
+                    conn.execute(statement)
+                conn.execute(f"PRAGMA user_version = {version + 1}")
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+
+def connect(db_file=None):
+    # WAL lets readers run while another thread or process writes; writers wait up to
+    # DB_BUSY_TIMEOUT for each other instead of failing with "database is locked"
+    db_file = db_file or config.DB_FILE
+    os.makedirs(os.path.dirname(os.path.abspath(db_file)), exist_ok=True)
+    conn = sqlite3.connect(db_file, timeout=config.DB_BUSY_TIMEOUT, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode = WAL")
+    # In WAL mode NORMAL only risks the last transactions on power loss, never corruption
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute(f"PRAGMA mmap_size = {int(config.DB_MMAP_SIZE)}")
+    conn.execute(f"PRAGMA cache_size = -{int(config.DB_CACHE_KIB)}")
+    conn.create_function("compress", 1, compress, deterministic=True)
+    conn.create_function("payload_text", 1, payload_text, deterministic=True)
+    migrate_db(conn)
+    return conn
+
+# Each thread gets its own connection, opened and migrated on first use and closed when
+# the thread ends; sqlite3 connections must not run statements from two threads at once
+_local = threading.local()
+
+def get_connection(db_file=None):
+    db_file = db_file or config.DB_FILE
+    conns = _local.__dict__.setdefault("conns", {})
+    if db_file not in conns:
+        conns[db_file] = connect(db_file)
+    return conns[db_file]
+
+class BatchWriter:
+    # Buffers small writes from any thread and runs them in a single transaction once
+    # WRITE_BATCH_ROWS are pending or WRITE_BATCH_SECONDS have passed, so frequent updates
+    # don't hold the write lock between them. Call flush() when done.
+    def __init__(self, db_file=None, max_rows=None, max_seconds=None):
+        self.db_file = db_file
+        self.max_rows = max_rows or config.WRITE_BATCH_ROWS
+        self.max_seconds = max_seconds if max_seconds is not None else config.WRITE_BATCH_SECONDS
+        self.pending = []
+        self.last_flush = time.monotonic()
+        self.lock = threading.Lock()
+
+    def add(self, sql, params):
+        with self.lock:
+            self.pending.append((sql, params))
+            if len(self.pending) >= self.max_rows or time.monotonic() - self.last_flush >= self.max_seconds:
+                self._flush()
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def _flush(self):
+        self.last_flush = time.monotonic()
+        if not self.pending:
+            return
+        pending, self.pending = self.pending, []
+        conn = get_connection(self.db_file)
+        with conn:
+            # Consecutive writes with the same statement go through one executemany
+            start = 0
+            for end in range(1, len(pending) + 1):
+                if end == len(pending) or pending[end][0] != pending[start][0]:
+                    conn.executemany(pending[start][0], [params for _, params in pending[start:end]])
+                    start = end
+
+class EtagStore:
+    # ETag/body pairs persisted in cache.db so expired entries revalidate with a 304.
+    # Bodies are stored compressed and only the newest config.HTTP_CACHE_MAX_ENTRIES
+    # are kept. New pairs are written in batches (pending ones are still returned by get)
+    # and flushed at exit.
+    def __init__(self, db_file=None, max_entries=None):
+        self.db_file = db_file
+        self.max_entries = max_entries or config.HTTP_CACHE_MAX_ENTRIES
+        self.writer = BatchWriter(db_file)
+        self.pending = {}
+        self.stored = False
+        self.lock = threading.Lock()
+        atexit.register(self.flush)
+
+    def get(self, url):
+        with self.lock:
+            if url in self.pending:
+                return self.pending[url]
+        row = get_connection(self.db_file).execute("SELECT etag, body FROM http_cache WHERE url = ?", (url,)).fetchone()
+        return (row[0], payload_text(row[1])) if row else None
+
+    def __setitem__(self, url, value):
+        etag, body = value
+        with self.lock:
+            self.pending[url] = value
+            self.writer.add(
+                "INSERT OR REPLACE INTO http_cache (url, etag, body, stored_at) VALUES (?, ?, ?, ?)",
+                (url, etag, compress(body), time.time())
+            )
+            self.stored = True
+            if not self.writer.pending:
+                self.pending.clear()
+                self._prune()
+
+    def _prune(self):
+        if not self.stored:
+            return
+        self.stored = False
+        with get_connection(self.db_file) as conn:
+            conn.execute(
+                "DELETE FROM http_cache WHERE url IN (SELECT url FROM http_cache ORDER BY stored_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+
+    def flush(self):
+        with self.lock:
+            self.writer.flush()
+            self.pending.clear()
+            self._prune()
+
+def approx_size(value):
+    # Rough memory footprint of nested tuples, lists, dicts and scalars
+    if isinstance(value, (tuple, list)):
+        return sys.getsizeof(value) + sum(approx_size(item) for item in value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(approx_size(k) + approx_size(v) for k, v in value.items())
+    return sys.getsizeof(value)
+
+class MemoCache:
+    # Thread-safe LRU of recent results in front of the database. Entries expire after
+    # ttl seconds; the least recently used ones are dropped beyond max_entries or max_bytes.
+    def __init__(self, max_entries=None, max_bytes=None, ttl=None):
+        self.max_entries = max_entries or config.MEMO_MAX_ENTRIES
+        self.max_bytes = max_bytes or config.MEMO_MAX_BYTES
+        self.ttl = ttl or config.MEMO_TTL_SECONDS
+        self.entries = OrderedDict()  # key: (expires, size, value)
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    self._drop(key)
+                self.misses += 1
+                return default
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    def put(self, key, value):
+        size = approx_size(value)
+        with self.lock:
+            if key in self.entries:
+                self._drop(key)
+            if size > self.max_bytes:
+                return
+            self.entries[key] = (time.monotonic() + self.ttl, size, value)
+            self.bytes += size
+            while len(self.entries) > self.max_entries or self.bytes > self.max_bytes:
+                self._drop(next(iter(self.entries)))
+
+    def _drop(self, key):
+        self.bytes -= self.entries.pop(key)[1]
+
+    def discard(self, key):
+        with self.lock:
+            if key in self.entries:
+                self._drop(key)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self.lock:
+            return {"entries": len(self.entries), "bytes": self.bytes, "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,202 @@
+import argparse
+import json
+import sys
+
+import requests
+
+from renamizer import config
+from renamizer import instrument
+from renamizer.batch import scan_videos
+from renamizer.matcher import match_files
+from renamizer.metadata import get_episodes, get_show, memo_stats, search_shows
+from renamizer.mover import PLACEMENTS, MoveStats, interrupted_batches, new_batch_id, resume_batch, rollback_batch
+from renamizer.naming import get_template
+from renamizer.plan import build_plan, describe_problem, execute_plan, read_plan, write_plan
+from renamizer.sync import sync
+from renamizer.watch import WatchDaemon
+
+# Exit codes
+EXIT_OK = 0
+EXIT_FILE_ERRORS = 1
+EXIT_FAILED = 2
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="renamizer",
+        description="Renombra episodios de series de TV sin interfaz gráfica y genera un informe JSON."
+    )
+    show = parser.add_mutually_exclusive_group()
+    show.add_argument("--query", help="nombre de la serie a buscar (se usa el primer resultado)")
+    show.add_argument("--show-id", type=int, help="id de la serie en la fuente elegida")
+    parser.add_argument("--source", choices=("tvmaze", "tmdb"), default="tvmaze", help="fuente de metadatos (por defecto: tvmaze)")
+    parser.add_argument("--input", help="directorio con los archivos a renombrar")
+    parser.add_argument("--output", help="directorio raíz de salida")
+    parser.add_argument("--no-title", action="store_true", help="no incluir el título del episodio en el nombre")
+    parser.add_argument("--template", help="plantilla de nombres: renamizer, plex, jellyfin, kodi o un patrón propio")
+    parser.add_argument("--placement", choices=tuple(PLACEMENTS),
+                        help="cómo llegan los archivos a la salida: move (por defecto, PLACEMENT), o dejando el original "
+                             "con hardlink, reflink, symlink o copy; si no se puede, se usa el siguiente método que funcione")
+    parser.add_argument("--dry-run", action="store_true", help="solo calcula y comprueba el plan, sin mover ningún archivo")
+    parser.add_argument("--plan", help="guarda el plan en un fichero JSON o CSV (.csv) para revisarlo")
+    parser.add_argument("--report", help="fichero donde guardar el informe JSON (por defecto: salida estándar)")
+    parser.add_argument("--db", help="ruta de la caché SQLite")
+    parser.add_argument("--stats", metavar="FICHERO",
+                        help="guarda en JSON los tiempos por etapa, peticiones HTTP y aciertos de caché de la ejecución")
+    parser.add_argument("--profile", metavar="FICHERO", help="guarda un perfil de cProfile de la ejecución (formato pstats)")
+    actions = parser.add_mutually_exclusive_group()
+    actions.add_argument("--sync", action="store_true",
+                         help="carga o actualiza en bloque la caché de series de TVMaze y TMDB (pensado para ejecutarse cada noche)")
+    actions.add_argument("--apply-plan", metavar="FICHERO", help="aplica un plan guardado con --plan")
+    actions.add_argument("--resume", metavar="LOTE", help="termina los movimientos pendientes de un lote interrumpido")
+    actions.add_argument("--rollback", metavar="LOTE", help="devuelve los archivos de un lote a su ubicación original")
+    actions.add_argument("--interrupted", action="store_true", help="lista los lotes interrumpidos")
+    actions.add_argument("--watch", nargs="*", metavar="DIRECTORIO",
+                         help="vigila las carpetas de descargas (por defecto WATCH_DIRS) y mueve cada episodio nuevo a --output "
+                              "en cuanto deja de crecer; escribe una línea JSON por archivo hasta que se interrumpe")
+    parser.add_argument("--poll", action="store_true", help="con --watch, revisa las carpetas periódicamente en lugar de usar inotify")
+    parser.add_argument("--full", action="store_true", help="con --sync, vuelve a cargar los índices completos")
+    parser.add_argument("--tmdb-export", metavar="FICHERO", help="con --sync, exportación de ids de TMDB (.json.gz) ya descargada")
+    return parser
+
+def resolve_show(args):
+    if args.show_id is not None:
+        return get_show(args.show_id, args.source)
+    errors = []
+    # Results are merged across providers; a show found in both is used from args.source
+    shows = [show for show in search_shows(args.query, errors) if args.source in show[3]["sources"]]
+    if not shows:
+        raise LookupError("; ".join(errors) or f"No se encontró ninguna serie para '{args.query}' en {args.source}")
+    show = shows[0]
+    return (show[3]["sources"][args.source], show[1], show[2], show[3], args.source)
+
+def has_action(args):
+    return bool(args.sync or args.apply_plan or args.resume or args.rollback or args.interrupted or args.watch is not None)
+
+def summarize(report):
+    summary = {"renamed": 0, "error": 0, "unmatched": 0, "ambiguous": 0}
+    for result in report["files"]:
+        summary[result["status"]] = summary.get(result["status"], 0) + 1
+    report["summary"] = summary
+    return report, EXIT_FILE_ERRORS if summary["error"] or summary.get("conflict") else EXIT_OK
+
+def run_action(args):
+    # --sync, --apply-plan, --interrupted, --resume, --rollback and --watch need no show lookup
+    if args.watch is not None:
+        return run_watch(args)
+    if args.sync:
+        report = {"sync": sync(full=args.full, tmdb_export=args.tmdb_export)}
+        return report, EXIT_FAILED if any("error" in result for result in report["sync"].values()) else EXIT_OK
+    if args.apply_plan:
+        report = {"plan": args.apply_plan, "batch": new_batch_id()}
+        stats = MoveStats()
+        try:
+            plan = read_plan(args.apply_plan)
+        except (OSError, ValueError, KeyError) as e:
+            report["error"] = f"No se pudo leer el plan: {e}"
+            return report, EXIT_FAILED
+        report["files"] = execute_plan(plan, batch=report["batch"], stats=stats, placement=args.placement)
+        report["moves"] = {"bytes_copied": stats.bytes_copied, "mb_per_s": round(stats.rate() / 1e6, 1)}
+        return summarize(report)
+    if args.interrupted:
+        return {"interrupted": [{"batch": batch, "pending": pending} for batch, pending in interrupted_batches()]}, EXIT_OK
+    batch = args.resume or args.rollback
+    stats = MoveStats()
+    moved = (resume_batch if args.resume else rollback_batch)(batch, stats=stats)
+    report = {"batch": batch, "action": "resume" if args.resume else "rollback", "files": [
+        {"source": source, "target": result["target"], "status": "renamed" if result["status"] == "done" else "error",
+         **({"error": result["error"]} if result.get("error") else {})}
+        for source, result in moved.items() if result["status"] != "cancelled"
+    ]}
+    report["moves"] = {"bytes_copied": stats.bytes_copied, "mb_per_s": round(stats.rate() / 1e6, 1)}
+    return summarize(report)
+
+def run_watch(args):
+    roots = args.watch or config.WATCH_DIRS
+    output = args.output or config.WATCH_OUTPUT
+    report = {"watch": roots, "output": output}
+    if not roots or not output:
+        report["error"] = "--watch necesita carpetas (o WATCH_DIRS) y --output (o WATCH_OUTPUT)"
+        return report, EXIT_FAILED
+
+    def emit(result):
+        sys.stdout.write(json.dumps(result, ensure_ascii=False) + "\n")
+        sys.stdout.flush()
+
+    try:
+        daemon = WatchDaemon(roots, output, args.source, args.template, not args.no_title, args.poll, on_result=emit,
+                             placement=args.placement)
+    except ValueError as e:
+        report["error"] = str(e)
+        return report, EXIT_FAILED
+    report["summary"] = daemon.run()
+    return report, EXIT_OK
+
+def run(args):
+    if args.db:
+        config.DB_FILE = args.db
+    if has_action(args):
+        return run_action(args)
+    report = {"input": args.input, "output": args.output, "show": None, "files": []}
+    try:
+        show = resolve_show(args)
+        report["show"] = {"id": show[0], "name": show[1], "year": show[2], "source": show[4]}
+        episodes = get_episodes(show[0], show[4])
+    except (requests.RequestException, LookupError) as e:
+        report["error"] = str(e)
+        return report, EXIT_FAILED
+
+    matches, unmatched, ambiguous = match_files(scan_videos(args.input), episodes)
+    pairs = [(match["episodes"], match["file"]) for match in matches]
+    try:
+        template = get_template(args.template)
+    except ValueError as e:
+        report["error"] = str(e)
+        return report, EXIT_FAILED
+    plan = build_plan(show[1], show[2], pairs, args.output, not args.no_title, template)
+    if args.plan:
+        try:
+            write_plan(plan, args.plan)
+        except OSError as e:
+            report["error"] = f"No se pudo guardar el plan: {e}"
+            return report, EXIT_FAILED
+    if args.dry_run:
+        # Same entries as a real run, with status "planned" or "conflict"
+        for entry in plan:
+            result = {key: value for key, value in entry.items() if key != "problem"}
+            result["status"] = {None: "planned", "in_library": "skipped"}.get(entry["problem"], "conflict")
+            if entry["problem"]:
+                result["error"] = describe_problem(entry)
+            report["files"].append(result)
+    else:
+        report["batch"] = new_batch_id()
+        stats = MoveStats()
+        report["files"] = execute_plan(plan, batch=report["batch"], stats=stats, placement=args.placement)
+        report["moves"] = {"bytes_copied": stats.bytes_copied, "mb_per_s": round(stats.rate() / 1e6, 1)}
+    report["files"].extend({"source": file, "status": "unmatched"} for file in unmatched)
+    report["files"].extend({
+        "source": entry["file"],
+        "status": "ambiguous",
+        "reason": entry["reason"],
+        "candidates": [{"season": ep[0], "episode": ep[1], "title": ep[2]} for ep in entry["candidates"]],
+    } for entry in ambiguous)
+    return summarize(report)
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if not has_action(args):
+        if args.query is None and args.show_id is None:
+            parser.error("se necesita --query o --show-id")
+        if not args.input or not args.output:
+            parser.error("se necesitan --input y --output")
+    with instrument.profile(args.profile):
+        report, code = run(args)
+    if args.stats:
+        instrument.write_json(args.stats, {"memo": memo_stats()})
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            f.write(output)
+    else:
+        sys.stdout.write(output + "\n")
+    return code
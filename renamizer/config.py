@@ -0,0 +1,131 @@
+import os
+import platform
+
+from dotenv import load_dotenv
+
+# Load environment variables from .env file
+load_dotenv()
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# API setup
+TMDB_API_KEY = os.getenv("TMDB_API_KEY")
+TMDB_TOKEN = os.getenv("TMDB_TOKEN")
+TVMAZE_API_URL = "https://api.tvmaze.com"
+TMDB_API_URL = "https://api.themoviedb.org/3"
+
+# Concurrency settings for API requests
+AKAS_WORKERS = 8
+# Cached TVMaze search results (e.g. from a bulk sync) whose akas are fetched on a search hit
+# when missing, as many as a TVMaze search returns
+AKAS_LAZY_LIMIT = 10
+SEASON_WORKERS = 4
+TMDB_APPEND_LIMIT = 20  # max items per append_to_response
+
+# Cache lifetime in hours by show status, overridable from .env
+CACHE_TTL_HOURS = {
+    "ended": float(os.getenv("CACHE_TTL_ENDED_HOURS", 24 * 90)),
+    "running": float(os.getenv("CACHE_TTL_RUNNING_HOURS", 6)),
+    "default": float(os.getenv("CACHE_TTL_DEFAULT_HOURS", 24 * 7)),
+}
+# TVMaze and TMDB status values mapped to a CACHE_TTL_HOURS entry
+STATUS_TTL = {
+    "Ended": "ended",
+    "Canceled": "ended",
+    "Running": "running",
+    "Returning Series": "running",
+    "In Production": "running",
+}
+
+# Bulk cache sync: daily TMDB id export (gzipped JSON lines) and concurrent show refreshes
+TMDB_EXPORT_URL = "https://files.tmdb.org/p/exports/tv_series_ids_{date:%m_%d_%Y}.json.gz"
+SYNC_WORKERS = 8
+
+# Maximum number of shows returned by a local cache search
+CACHE_SEARCH_LIMIT = 50
+# Seconds a search waits for TVMaze and TMDB (queried at the same time); a provider that
+# hasn't answered by then is reported and left out
+SEARCH_BUDGET_SECONDS = float(os.getenv("SEARCH_BUDGET_SECONDS", 8))
+# Provider whose episode list the app loads for a show found on both ("tvmaze", or "tmdb"
+# for Spanish episode titles); shows found on one provider use that one
+EPISODE_SOURCE = os.getenv("EPISODE_SOURCE", "tvmaze")
+
+# In-memory copies of search results and episode lists kept in front of the SQLite cache,
+# bounded by entry count and approximate size
+MEMO_MAX_ENTRIES = 256
+MEMO_MAX_BYTES = 32 * 1024 * 1024
+MEMO_TTL_SECONDS = 600
+
+# SQLite tuning for cache.db, shared by worker threads and concurrent CLI processes:
+# seconds a writer waits for the lock, memory-mapped bytes and page cache per connection
+DB_BUSY_TIMEOUT = 30
+DB_MMAP_SIZE = 256 * 1024 * 1024
+DB_CACHE_KIB = 8 * 1024
+# Buffered small writes (move journal, ETags) go to the database in one transaction per
+# this many rows or seconds
+WRITE_BATCH_ROWS = 200
+WRITE_BATCH_SECONDS = 1.0
+# ETag/body pairs kept for revalidation (the oldest are dropped beyond this)
+HTTP_CACHE_MAX_ENTRIES = 2000
+
+def default_db_file():
+    # %LOCALAPPDATA% on Windows, the XDG cache directory elsewhere
+    if os.getenv("RENAMIZER_DB"):
+        return os.getenv("RENAMIZER_DB")
+    base = os.getenv("LOCALAPPDATA") or os.getenv("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "TVSeriesRenamer", "cache.db")
+
+# SQLite cache location; the connection is opened on first use, so this can be changed before that
+DB_FILE = default_db_file()
+
+def default_ffprobe_path():
+    # ffprobe.exe dropped next to the program on Windows, otherwise ffprobe from PATH
+    if os.getenv("FFPROBE_PATH"):
+        return os.getenv("FFPROBE_PATH")
+    bundled = os.path.join(APP_DIR, "ffprobe.exe")
+    if platform.system() == "Windows" or os.path.exists(bundled):
+        return bundled
+    return "ffprobe"
+
+# FFprobe path
+FFPROBE_PATH = default_ffprobe_path()
+# Concurrent ffprobe processes
+PROBE_WORKERS = int(os.getenv("PROBE_WORKERS", os.cpu_count() or 4))
+# Seconds an ffprobe run may take before it is killed and counted as failed
+PROBE_TIMEOUT = float(os.getenv("PROBE_TIMEOUT", 30))
+
+# Naming template: a preset (renamizer, plex, jellyfin, kodi) or a pattern, see renamizer.naming
+NAMING_TEMPLATE = os.getenv("NAMING_TEMPLATE", "renamizer")
+
+# File moves: copy buffer, concurrent copies per destination device, how copies are
+# verified before the source is deleted ("size" or "hash") and journaled batches kept
+MOVE_BUFFER_SIZE = 8 * 1024 * 1024
+MOVE_WORKERS_PER_DEVICE = int(os.getenv("MOVE_WORKERS_PER_DEVICE", 2))
+MOVE_VERIFY = os.getenv("MOVE_VERIFY", "size")
+MOVE_JOURNAL_KEEP = 20
+# How files reach the library: "move", or keeping the source where it is (e.g. still seeding)
+# with "hardlink", "reflink" (copy-on-write clone), "symlink" or "copy". Each falls back per
+# file to the next method that works (see renamizer.mover.PLACEMENTS).
+PLACEMENT = os.getenv("PLACEMENT", "move")
+
+# Episodes already in the output library: "quality" skips incoming files unless they have a
+# higher resolution than every copy there, "skip" always skips them and "off" doesn't check.
+# Identical files (same size and fingerprint: hashed chunks at the start, middle and end) are
+# skipped unless "off".
+LIBRARY_DUPLICATES = os.getenv("LIBRARY_DUPLICATES", "quality")
+FINGERPRINT_CHUNK = 1024 * 1024
+# Seconds a process reuses its index of an output library before walking it again; files
+# it places itself are added right away, files added by others are seen after this
+LIBRARY_REFRESH_SECONDS = float(os.getenv("LIBRARY_REFRESH_SECONDS", 300))
+
+# Watch mode (python -m renamizer --watch): download folders (separated by os.pathsep) and
+# library root, seconds a file must stop changing before it is moved, polling interval when
+# inotify isn't available and how long files that couldn't be renamed wait to be retried
+WATCH_DIRS = [path for path in os.getenv("WATCH_DIRS", "").split(os.pathsep) if path]
+WATCH_OUTPUT = os.getenv("WATCH_OUTPUT")
+WATCH_SETTLE_SECONDS = float(os.getenv("WATCH_SETTLE_SECONDS", 5))
+WATCH_POLL_SECONDS = float(os.getenv("WATCH_POLL_SECONDS", 2))
+WATCH_RETRY_SECONDS = float(os.getenv("WATCH_RETRY_SECONDS", 15 * 60))
+
+# Video file extensions picked up when scanning directories, e.g. VIDEO_EXTENSIONS=".mp4 .mkv .avi .m4v" in .env
+VIDEO_EXTENSIONS = tuple(ext.lower() for ext in os.getenv("VIDEO_EXTENSIONS", ".mp4 .mkv .avi").split())
@@ -0,0 +1,87 @@
+import functools
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+# Process-wide timings and counters of the rename pipeline, cheap enough to stay always on.
+# Stages are {name: [calls, seconds, max seconds]}; counters are plain {name: count}.
+_lock = threading.Lock()
+_stages = {}
+_counters = {}
+
+def record(stage, seconds):
+    with _lock:
+        entry = _stages.setdefault(stage, [0, 0.0, 0.0])
+        entry[0] += 1
+        entry[1] += seconds
+        entry[2] = max(entry[2], seconds)
+
+def count(name, amount=1):
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + amount
+
+@contextmanager
+def timer(stage):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, time.perf_counter() - started)
+
+def timed(stage):
+    # Decorator form of timer()
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                record(stage, time.perf_counter() - started)
+        return wrapper
+    return decorate
+
+def reset():
+    with _lock:
+        _stages.clear()
+        _counters.clear()
+
+def ratio(hits, misses):
+    return round(hits / (hits + misses), 3) if hits + misses else None
+
+def snapshot():
+    # JSON-ready copy: per-stage calls, total/mean/max milliseconds, counters and the
+    # hit ratio of every "<name>.hit"/"<name>.miss" counter pair
+    with _lock:
+        stages = {
+            name: {"calls": calls, "total_ms": round(total * 1000, 3), "mean_ms": round(total * 1000 / calls, 3),
+                   "max_ms": round(longest * 1000, 3)}
+            for name, (calls, total, longest) in sorted(_stages.items())
+        }
+        counters = dict(sorted(_counters.items()))
+    hit_ratios = {
+        name[:-4]: ratio(counters[name], counters.get(name[:-4] + ".miss", 0))
+        for name in counters if name.endswith(".hit")
+    }
+    return {"stages": stages, "counters": counters, "hit_ratios": hit_ratios}
+
+def write_json(path, extra=None):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(dict(snapshot(), **(extra or {})), f, ensure_ascii=False, indent=2)
+
+@contextmanager
+def profile(path=None):
+    # cProfile of the enclosed code, dumped to path (pstats format) when given.
+    # Only the calling thread is profiled; worker threads show up as waits.
+    if not path:
+        yield None
+        return
+    import cProfile
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path)
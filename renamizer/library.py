@@ -0,0 +1,221 @@
+import hashlib
+import os
+import re
+import threading
+import time
+from collections import defaultdict
+
+from renamizer import config
+from renamizer.cache import get_connection
+from renamizer.instrument import count, timed
+from renamizer.matcher import normalize, parse_filename, show_hints
+from renamizer.media import probe_files
+from renamizer.scanner import scan
+
+# Resolution tag in a filename: 720p, 1080i, 2160p
+RESOLUTION_TAG = re.compile(r"(?<![0-9])(\d{3,4})[pi](?![a-z0-9])", re.I)
+
+def fingerprint(path, size=None):
+    # "size:hash" of the first, middle and last FINGERPRINT_CHUNK bytes (the whole file when
+    # it is smaller than three chunks), so telling two episodes apart reads a few MB at most
+    chunk = config.FINGERPRINT_CHUNK
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb", buffering=chunk) as f:
+        size = os.fstat(f.fileno()).st_size if size is None else size
+        if size <= 3 * chunk:
+            digest.update(f.read())
+        else:
+            for offset in (0, (size - chunk) // 2, size - chunk):
+                f.seek(offset)
+                digest.update(f.read(chunk))
+    count("library.fingerprints")
+    return f"{size}:{digest.hexdigest()}"
+
+def episode_key(path):
+    # (normalized show, year, season, episode) a library file's path says, or None. The
+    # year (None when unknown) comes from the filename or the show folder, as in
+    # "Doctor Who (2005)/Season 01/Doctor Who - s01e01.mkv".
+    parsed = parse_filename(path)
+    hints = show_hints(path)
+    if parsed["kind"] != "number" or not hints:
+        return None
+    show = hints[0][0]
+    year = next((year for name, year in hints if name == show and year), None)
+    return show, year, parsed["season"], parsed["episodes"][0]
+
+def resolutions(paths):
+    # {path: lines of resolution or None}: a "1080p" tag in the name, else ffprobe (cached).
+    # Widescreen crops count by width, so a 1920x800 file is 1080 like its "1080p" release.
+    heights = {}
+    untagged = []
+    for path in paths:
+        found = RESOLUTION_TAG.search(os.path.basename(path))
+        if found:
+            heights[path] = int(found.group(1))
+        else:
+            untagged.append(path)
+    for path, info in (probe_files(untagged) if untagged else {}).items():
+        width, _, height = info.get("resolution", "").partition("x")
+        heights[path] = max(int(height), int(width) * 9 // 16) if height else None
+    return heights
+
+class LibraryIndex:
+    # Video files under a library root by size and by (show, season, episode), refreshed
+    # through the scan index (only changed folders are listed) and library_files (names are
+    # parsed once per file version). Lookups are dict hits; fingerprints are only computed
+    # for library files with the same size as an incoming one, and stored. Hold `lock`
+    # while using an index shared between threads (see library_index).
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        self.lock = threading.Lock()
+        self.computed = []
+        self.refresh()
+
+    @timed("library.refresh")
+    def refresh(self):
+        self.by_size = defaultdict(list)
+        self.by_episode = defaultdict(list)
+        self.years = {}
+        self.fingerprints = {}
+        self.refreshed_at = time.monotonic()
+        conn = get_connection()
+        known = {row[0]: row[1:] for row in conn.execute(
+            "SELECT path, size, mtime_ns, fingerprint, show, year, season, episode FROM library_files WHERE root = ?", (self.root,)
+        )}
+        changed = []
+        for file in scan(self.root):
+            row = known.pop(file.path, None)
+            if row is None or row[:2] != (file.size, file.mtime_ns):
+                row = (file.size, file.mtime_ns, None, *(episode_key(file.path) or (None, None, None, None)))
+                changed.append((file.path, self.root, *row))
+            self.by_size[file.size].append(file.path)
+            if row[3] is not None:
+                self.by_episode[(row[3], *row[5:7])].append(file.path)
+                self.years[file.path] = row[4]
+            if row[2]:
+                self.fingerprints[file.path] = row[2]
+        if changed or known:
+            with conn:
+                conn.executemany(
+                    """INSERT OR REPLACE INTO library_files (path, root, size, mtime_ns, fingerprint, show, year, season, episode)
+                       VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                    changed
+                )
+                conn.executemany("DELETE FROM library_files WHERE path = ?", [(path,) for path in known])
+
+    def add(self, paths):
+        # Files just placed under the root, indexed without walking the library again
+        for path in paths:
+            try:
+                size = os.path.getsize(path)
+            except OSError:
+                continue
+            self.fingerprints.pop(path, None)
+            self.by_size[size].append(path)
+            key = episode_key(path)
+            if key:
+                self.by_episode[(key[0], *key[2:])].append(path)
+                self.years[path] = key[1]
+
+    def same_content(self, path):
+        # Library file identical to path (same size and fingerprint), or None. Empty files
+        # are all alike and never count as copies.
+        if not self.by_size:
+            return None
+        try:
+            size = os.path.getsize(path)
+            others = [other for other in self.by_size.get(size, []) if other != path] if size else []
+            wanted = fingerprint(path, size) if others else None
+        except OSError:
+            return None
+        for other in others:
+            if other not in self.fingerprints:
+                try:
+                    self.fingerprints[other] = fingerprint(other, size)
+                except OSError:
+                    continue
+                self.computed.append((self.fingerprints[other], other))
+            if self.fingerprints[other] == wanted and os.path.exists(other):
+                return other
+        return None
+
+    def same_episode(self, show, year, season, episode):
+        # Library files of that episode; show as normalized by matcher.normalize. Files of a
+        # show with the same name but another year (a remake) don't count; a year missing
+        # on either side matches any.
+        year = int(year) if year else None
+        return [path for path in self.by_episode.get((show, season, episode), [])
+                if year is None or self.years.get(path) is None or self.years[path] == year]
+
+    def save(self):
+        if self.computed:
+            with get_connection() as conn:
+                conn.executemany("UPDATE library_files SET fingerprint = ? WHERE path = ?", self.computed)
+            self.computed = []
+
+# Indexes kept between batches by library root (the watch daemon and the app plan many
+# batches against the same library): walked again at most every config.LIBRARY_REFRESH_SECONDS
+# and told about the files this process places (note_placed) in between
+_libraries = {}
+_libraries_lock = threading.Lock()
+
+def library_index(root):
+    root = os.path.abspath(root)
+    with _libraries_lock:
+        library = _libraries.get(root)
+        if library is None:
+            library = _libraries[root] = LibraryIndex(root)
+        elif time.monotonic() - library.refreshed_at > config.LIBRARY_REFRESH_SECONDS:
+            with library.lock:
+                library.refresh()
+        return library
+
+def note_placed(paths):
+    # Adds files just moved or linked into a library to the kept index of its root
+    with _libraries_lock:
+        libraries = list(_libraries.values())
+    for library in libraries:
+        inside = [path for path in paths if os.path.abspath(path).startswith(library.root + os.sep)]
+        if inside:
+            with library.lock:
+                library.add(inside)
+
+@timed("check_library")
+def check_library(plan, show_name, year, output_dir, mode=None):
+    # Marks plan entries whose file is already in the library under output_dir: an identical
+    # file anywhere there, or the same episode of show_name first aired in year (any name or
+    # quality; see LibraryIndex.same_episode), goes in
+    # entry["duplicate_of"] and check_plan turns it into an "in_library" problem. With mode
+    # "quality" (config.LIBRARY_DUPLICATES) an entry with a higher resolution than every copy
+    # gets entry["upgrade_of"] instead and is moved if its target is free; the old copy stays.
+    mode = mode or config.LIBRARY_DUPLICATES
+    if mode == "off" or not plan:
+        return plan
+    library = library_index(output_dir)
+    show = normalize(show_name)
+    copies = {}
+    with library.lock:
+        for entry in plan:
+            entry.pop("duplicate_of", None)
+            entry.pop("upgrade_of", None)
+            same = library.same_content(entry["source"])
+            if same:
+                entry["duplicate_of"] = same
+                continue
+            # The kept index may list files removed since its last refresh
+            found = [path for path in library.same_episode(show, year, entry["season"], entry["episode"])
+                     if path != entry["source"] and os.path.exists(path)]
+            if found:
+                copies[entry["source"]] = found
+        library.save()
+    heights = resolutions({path for source, found in copies.items() for path in (source, *found)}) if mode == "quality" and copies else {}
+    for entry in plan:
+        found = copies.get(entry["source"])
+        if not found:
+            continue
+        new, old = heights.get(entry["source"]), [heights.get(path) for path in found]
+        if new and all(old) and new > max(old):
+            entry["upgrade_of"] = found[old.index(max(old))]
+        else:
+            entry["duplicate_of"] = found[0]
+    return plan
@@ -0,0 +1,182 @@
+import difflib
+import os
+import re
+import unicodedata
+from collections import defaultdict
+
+from renamizer.instrument import timed
+
+# Filename patterns, tried in order. Multi-episode forms: S01E01E02, S01E01-E02, S01E01-02, 1x01-1x02.
+# A continuation without an e/x marker must follow the hyphen directly and not be a
+# resolution ("S01E03-1080p", "S01E03 - 720p" and "S01E03 - 2 Broke Girls" are one episode).
+SXXEYY = re.compile(r"(?<![a-z0-9])s(\d{1,2})[ ._-]?e(\d{1,4})((?:[ ._]?-?[ ._]?e\d{1,4}|-\d{1,4}(?![0-9pi]))*)(?![0-9])", re.I)
+NXNN = re.compile(r"(?<![a-z0-9])(\d{1,2})x(\d{2,3})((?:-\d{1,2}x\d{2,3}|-\d{2,3}(?![0-9pi]))*)(?![0-9])", re.I)
+EPISODE_WORD = re.compile(r"(?<![a-z])(?:episode|episodio|capitulo|cap|ep)[ ._-]*(\d{1,4})(?![0-9])", re.I)
+DATE = re.compile(r"(?<![0-9])((?:19|20)\d{2})[ ._-](\d{2})[ ._-](\d{2})(?![0-9])")
+SEASON_DIR = re.compile(r"^(?:season|temporada|series|s)[ ._-]*(\d{1,2})$", re.I)
+# Tokens that look like numbers but aren't episode numbers
+NOISE = re.compile(r"\d{3,4}[pi]\b|[xh][ .]?26[45]|\b(?:10|8)bit\b|\[[0-9a-f]{8}\]|\((?:19|20)\d{2}\)|\b(?:19|20)\d{2}\b|\bdd?p?[257]\.1\b|\b[257]\.1\b|\bmp4\b", re.I)
+ABSOLUTE = re.compile(r"(?<![0-9.])(\d{1,4})(?![0-9.])")
+EXTRA_NUMBERS = re.compile(r"\d{1,4}")
+# Release group tags ("[Group] Show - 01") and a trailing year in a show name ("Show (2008)", "Show.2008")
+TAGS = re.compile(r"\[[^\]]*\]|\{[^}]*\}")
+TRAILING_YEAR = re.compile(r"[ ._(\[-]+((?:19|20)\d{2})[)\]]?[ ._-]*$")
+
+# Minimum similarity for the fuzzy title fallback
+TITLE_CUTOFF = 0.85
+# Most episodes a multi-episode range may cover; longer ranges fall back to the first episode
+MULTI_EPISODE_MAX = 4
+
+def normalize(text):
+    text = unicodedata.normalize("NFKD", text)
+    text = "".join(c for c in text if not unicodedata.combining(c)).lower()
+    return " ".join(re.sub(r"[^a-z0-9]+", " ", text).split())
+
+class EpisodeIndex:
+    # O(1) lookups over an episode list (rows of season, episode, title, air_date)
+    def __init__(self, episodes):
+        self.by_number = {}
+        self.by_date = defaultdict(list)
+        self.by_title = defaultdict(list)
+        for ep in episodes:
+            self.by_number[(int(ep[0]), int(ep[1]))] = ep
+            if ep[3]:
+                self.by_date[ep[3][:10]].append(ep)
+            if ep[2]:
+                self.by_title[normalize(ep[2])].append(ep)
+        # Absolute numbering counts regular episodes in order, skipping specials (season 0)
+        self.absolute = [ep for key, ep in sorted(self.by_number.items()) if key[0] > 0]
+        self.seasons = {key[0] for key in self.by_number if key[0] > 0}
+        self.titles = [title for title in self.by_title if len(title) >= 4]
+
+    def number(self, season, episode):
+        return self.by_number.get((season, episode))
+
+    def absolute_number(self, number):
+        return self.absolute[number - 1] if 0 < number <= len(self.absolute) else None
+
+def episode_range(first, tail):
+    # "E02E03", "-E03", "-03" or "-1x03" after the first episode number. Numbers that don't
+    # increase or span more than MULTI_EPISODE_MAX episodes leave only the first one.
+    numbers = [first] + [int(value) for value in EXTRA_NUMBERS.findall(re.sub(r"\d{1,2}x", "", tail))]
+    if any(b <= a for a, b in zip(numbers, numbers[1:])) or numbers[-1] - first >= MULTI_EPISODE_MAX:
+        return [first]
+    if len(numbers) == 2:
+        return list(range(first, numbers[1] + 1))
+    return numbers
+
+def season_hint(path):
+    # "Season 2" / "Temporada 02" / "S02" in the parent directory
+    found = SEASON_DIR.match(os.path.basename(os.path.dirname(path)).strip())
+    return int(found.group(1)) if found else None
+
+def parse_filename(path):
+    # What the filename says about the episode, without looking at the episode list
+    stem = os.path.splitext(os.path.basename(path))[0]
+    found = DATE.search(stem)
+    if found:
+        return {"kind": "date", "date": "-".join(found.groups())}
+    found = SXXEYY.search(stem)
+    if found:
+        return {"kind": "number", "season": int(found.group(1)), "episodes": episode_range(int(found.group(2)), found.group(3))}
+    found = NXNN.search(stem)
+    if found:
+        return {"kind": "number", "season": int(found.group(1)), "episodes": episode_range(int(found.group(2)), found.group(3))}
+    found = EPISODE_WORD.search(stem)
+    if found:
+        return {"kind": "episode", "season": season_hint(path), "episode": int(found.group(1))}
+    numbers = ABSOLUTE.findall(NOISE.sub(" ", stem))
+    if len(numbers) == 1:
+        return {"kind": "absolute", "season": season_hint(path), "episode": int(numbers[0])}
+    return {"kind": "title"}
+
+def split_year(text):
+    found = TRAILING_YEAR.search(text)
+    return (text[:found.start()], int(found.group(1))) if found else (text, None)
+
+def show_hints(path):
+    # [(normalized show name, year or None)] suggested by a path, best first: the part of
+    # the filename before the episode marker, then the folder (the one above a season folder)
+    stem = TAGS.sub(" ", os.path.splitext(os.path.basename(path))[0])
+    starts = [found.start() for found in (pattern.search(stem) for pattern in (DATE, SXXEYY, NXNN, EPISODE_WORD)) if found]
+    if not starts:
+        numbers = list(ABSOLUTE.finditer(NOISE.sub(lambda m: " " * len(m.group()), stem)))
+        starts = [numbers[0].start()] if len(numbers) == 1 else []
+    folder = os.path.dirname(path)
+    if SEASON_DIR.match(os.path.basename(folder).strip()):
+        folder = os.path.dirname(folder)
+    hints = []
+    for text in (stem[:min(starts)] if starts else "", TAGS.sub(" ", os.path.basename(folder))):
+        name, year = split_year(text)
+        hint = (normalize(name), year)
+        if hint[0] and hint not in hints:
+            hints.append(hint)
+    return hints
+
+def title_candidates(path, index):
+    # Episode titles contained in the filename, falling back to close matches
+    text = normalize(os.path.splitext(os.path.basename(path))[0])
+    contained = [title for title in index.titles if f" {title} " in f" {text} "]
+    if contained:
+        longest = max(len(title) for title in contained)
+        return [ep for title in contained if len(title) == longest for ep in index.by_title[title]]
+    close = difflib.get_close_matches(text, index.titles, n=2, cutoff=TITLE_CUTOFF)
+    return [ep for title in close for ep in index.by_title[title]]
+
+def resolve(path, index):
+    # Returns (episodes, method, candidates); episodes is empty when unmatched or ambiguous
+    parsed = parse_filename(path)
+    kind = parsed["kind"]
+    if kind == "date":
+        candidates = index.by_date.get(parsed["date"], [])
+        return (candidates, "date", []) if len(candidates) == 1 else ([], "date", candidates)
+    if kind == "number":
+        episodes = [index.number(parsed["season"], n) for n in parsed["episodes"]]
+        if all(episodes):
+            return episodes, "number", []
+        return [], "number", [ep for ep in episodes if ep]
+    if kind in ("episode", "absolute"):
+        number = parsed["episode"]
+        season = parsed["season"]
+        if season is None and len(index.seasons) == 1:
+            season = next(iter(index.seasons))
+        if season is not None:
+            episode = index.number(season, number)
+            if episode:
+                return [episode], kind, []
+        if kind == "episode" and season is not None:
+            return [], kind, []
+        episode = index.absolute_number(number)
+        if episode:
+            return [episode], "absolute", []
+    candidates = title_candidates(path, index)
+    if len(candidates) == 1:
+        return candidates, "title", []
+    return [], "title", candidates
+
+@timed("match_files")
+def match_files(files, episodes):
+    # Resolves every file against the episode list. Returns (matches, unmatched, ambiguous):
+    # matches are {"file", "episodes", "method"}, ambiguous entries carry the candidate
+    # episodes and a reason. Two files resolving to the same episode are both ambiguous.
+    index = EpisodeIndex(episodes)
+    resolved, unmatched, ambiguous = [], [], []
+    claims = defaultdict(list)
+    for file in files:
+        found, method, candidates = resolve(file, index)
+        if found:
+            resolved.append({"file": file, "episodes": found, "method": method})
+            for ep in found:
+                claims[(int(ep[0]), int(ep[1]))].append(file)
+        elif candidates:
+            ambiguous.append({"file": file, "candidates": candidates, "reason": method})
+        else:
+            unmatched.append(file)
+    duplicated = {file for claimants in claims.values() if len(claimants) > 1 for file in claimants}
+    matches = []
+    for match in resolved:
+        if match["file"] in duplicated:
+            ambiguous.append({"file": match["file"], "candidates": match["episodes"], "reason": "duplicate"})
+        else:
+            matches.append(match)
+    return matches, unmatched, ambiguous
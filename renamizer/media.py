@@ -0,0 +1,72 @@
+import json
+import os
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+from renamizer import config
+from renamizer.cache import get_connection
+from renamizer.instrument import count, timed
+
+# Only the stream fields the naming code uses. -select_streams takes a single
+# stream type, so the first video and audio streams are picked from this list.
+FFPROBE_ARGS = ["-v", "error", "-show_entries", "stream=codec_type,codec_name,width,height,channels", "-print_format", "json"]
+
+@timed("ffprobe")
+def run_ffprobe(file_path):
+    # Returns (info, ok); ok is False when ffprobe couldn't run or took longer than
+    # config.PROBE_TIMEOUT (e.g. a stalled network share) so the result isn't cached
+    try:
+        result = subprocess.run([config.FFPROBE_PATH, *FFPROBE_ARGS, file_path], capture_output=True, text=True,
+                                timeout=config.PROBE_TIMEOUT)
+        data = json.loads(result.stdout)
+        video_stream = next((s for s in data["streams"] if s["codec_type"] == "video"), None)
+        audio_stream = next((s for s in data["streams"] if s["codec_type"] == "audio"), None)
+        return {
+            "resolution": f"{video_stream['width']}x{video_stream['height']}" if video_stream else "",
+            "video_codec": video_stream["codec_name"].upper() if video_stream else "",
+            "audio_codec": audio_stream["codec_name"].upper() if audio_stream else "",
+            "audio_channels": audio_stream.get("channels", "") if audio_stream else ""
+        }, True
+    except (ValueError, KeyError):
+        return {}, True
+    except subprocess.TimeoutExpired:
+        count("ffprobe.timeouts")
+        return {}, False
+    except (OSError, subprocess.SubprocessError):
+        return {}, False
+
+@timed("probe_files")
+def probe_files(file_paths, workers=None):
+    # Media info for many files: cached entries come from cache.db, the rest are probed
+    # on a pool of concurrent ffprobe processes. Returns {path: info}.
+    conn = get_connection()
+    infos, stats, missing = {}, {}, []
+    for path in dict.fromkeys(file_paths):
+        try:
+            st = os.stat(path)
+        except OSError:
+            infos[path] = {}
+            continue
+        stats[path] = (st.st_size, st.st_mtime_ns)
+        row = conn.execute("SELECT size, mtime_ns, info FROM probes WHERE path = ?", (path,)).fetchone()
+        if row and (row[0], row[1]) == stats[path]:
+            infos[path] = json.loads(row[2])
+        else:
+            missing.append(path)
+    count("probe_cache.hit", len(stats) - len(missing))
+    count("probe_cache.miss", len(missing))
+    if missing:
+        workers = min(workers or config.PROBE_WORKERS, len(missing))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            probed = list(zip(missing, executor.map(run_ffprobe, missing)))
+        rows = []
+        for path, (info, ok) in probed:
+            infos[path] = info
+            if ok:
+                rows.append((path, *stats[path], json.dumps(info)))
+        with conn:
+            conn.executemany("INSERT OR REPLACE INTO probes (path, size, mtime_ns, info) VALUES (?, ?, ?, ?)", rows)
+    return infos
+
+def get_media_info(file_path):
+    return probe_files([file_path])[file_path]
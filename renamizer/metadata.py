@@ -0,0 +1,415 @@
+import json
+import re
+import sqlite3
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import requests
+
+from renamizer import config
+from renamizer.api_client import ApiClient
+from renamizer.instrument import count, timed
+from renamizer.cache import EtagStore, MemoCache, compress, connect, decompress, get_connection
+
+api = ApiClient(config.TVMAZE_API_URL, config.TMDB_API_URL, config.TMDB_API_KEY, config.TMDB_TOKEN, etag_store=EtagStore())
+
+# Recent search results (by normalized query) and episode lists (by (source, show_id)), so
+# going back to a show just looked at needs neither SQLite nor JSON parsing
+search_memo = MemoCache()
+episodes_memo = MemoCache()
+
+def memo_stats():
+    return {"search": search_memo.stats(), "episodes": episodes_memo.stats()}
+
+def is_cache_expired(last_updated, status=None):
+    if not last_updated:
+        return True
+    try:
+        last_updated_dt = datetime.fromisoformat(last_updated)
+    except ValueError:
+        return True
+    ttl = config.CACHE_TTL_HOURS[config.STATUS_TTL.get(status, "default")]
+    return (datetime.now() - last_updated_dt) > timedelta(hours=ttl)
+
+def fetch_tvmaze_akas(show_id):
+    try:
+        return api.tvmaze(f"/shows/{show_id}/akas")
+    except requests.RequestException:
+        return None
+
+def spanish_name(show_data):
+    display_name = show_data.get("name", "")
+    for aka in show_data.get("akas") or []:
+        if (aka.get("country") or {}).get("code") == "ES":
+            return aka.get("name", display_name)
+    return display_name
+
+# Columns written by save_shows, in show_row order
+SHOW_COLUMNS = "id, source, name, original_name, year, status, updated, akas, popularity, last_updated, payload, tvdb_id, imdb_id"
+SHOW_PLACEHOLDERS = ", ".join("?" * len(SHOW_COLUMNS.split(", ")))
+
+def external_ids(source, show_data):
+    # (TheTVDB id, IMDb id) of a show; TMDB only has them with append_to_response=external_ids
+    if source == "tvmaze":
+        externals = show_data.get("externals") or {}
+        return externals.get("thetvdb"), externals.get("imdb") or None
+    externals = show_data.get("external_ids") or {}
+    return externals.get("tvdb_id"), externals.get("imdb_id") or None
+
+def show_row(source, show_data, now):
+    # shows table row (SHOW_COLUMNS) for a TVMaze or TMDB show: the fields the app reads
+    # as columns and the whole response compressed
+    akas = show_data.get("akas")
+    if source == "tvmaze":
+        name, original_name, date, popularity = spanish_name(show_data), show_data.get("name"), show_data.get("premiered"), show_data.get("weight")
+    else:
+        name, original_name, date, popularity = show_data.get("name", ""), show_data.get("original_name"), show_data.get("first_air_date"), show_data.get("popularity")
+    return (show_data["id"], source, name, original_name, date[:4] if date else None, show_data.get("status"),
+            show_data.get("updated"), json.dumps(akas) if isinstance(akas, list) else None, popularity or 0, now,
+            compress(json.dumps(show_data)), *external_ids(source, show_data))
+
+def cached_show_data(source, show_id, name, original_name, status, akas):
+    # The part of a show's data the app uses, built from typed columns without decoding the payload
+    show_data = {"id": show_id, "name": original_name if source == "tvmaze" else name, "original_name": original_name, "status": status}
+    if akas:
+        show_data["akas"] = json.loads(akas)
+    return show_data
+
+def show_payload(show_id, source):
+    # Full API response stored for a show, decoded on demand
+    row = get_connection().execute("SELECT payload FROM shows WHERE source = ? AND id = ?", (source, show_id)).fetchone()
+    return decompress(row[0]) if row else None
+
+def episode_payload(show_id, source, season, episode):
+    row = get_connection().execute(
+        "SELECT payload FROM episodes WHERE source = ? AND show_id = ? AND season = ? AND episode = ?",
+        (source, show_id, season, episode)
+    ).fetchone()
+    return decompress(row[0]) if row else None
+
+def fetch_tmdb_episodes(show_id):
+    # Seasons are pulled through append_to_response (up to 20 per request) so a
+    # typical show needs a single request instead of one per season
+    def fetch_batch(numbers):
+        append = ",".join(f"season/{n}" for n in numbers)
+        return api.tmdb(f"/tv/{show_id}", language="es-ES", append_to_response=append)
+
+    # Guess the first seasons in the initial request, then fetch whatever is left
+    show = fetch_batch(range(config.TMDB_APPEND_LIMIT))
+    season_numbers = [s["season_number"] for s in show.get("seasons", []) if s.get("season_number") is not None]
+    seasons = {n: show[f"season/{n}"] for n in season_numbers if f"season/{n}" in show}
+    pending = [n for n in season_numbers if n not in seasons]
+    batches = [pending[i:i + config.TMDB_APPEND_LIMIT] for i in range(0, len(pending), config.TMDB_APPEND_LIMIT)]
+    if batches:
+        with ThreadPoolExecutor(max_workers=min(config.SEASON_WORKERS, len(batches))) as executor:
+            for numbers, data in zip(batches, executor.map(fetch_batch, batches)):
+                for n in numbers:
+                    if f"season/{n}" not in data:
+                        raise requests.HTTPError(f"TMDB no devolvió la temporada {n} de {show_id}")
+                    seasons[n] = data[f"season/{n}"]
+    episodes = []
+    for n in season_numbers:
+        episodes.extend(seasons[n].get("episodes", []))
+    return episodes, show.get("status")
+
+def search_cache(query, source):
+    # Prefix match on every word of the query, ranked by match quality then popularity
+    words = re.findall(r"\w+", query)
+    if not words:
+        return []
+    match = " ".join(f'"{word}"*' for word in words)
+    return get_connection().execute(
+        """SELECT s.id, s.source, s.name, s.year, s.original_name, s.status, s.akas, s.last_updated, s.tvdb_id, s.imdb_id
+           FROM shows_fts JOIN shows s ON s.rowid = shows_fts.rowid
+           WHERE shows_fts MATCH ? AND s.source = ?
+           ORDER BY lower(s.name) = lower(?) DESC, round(bm25(shows_fts), 1), s.popularity DESC
+           LIMIT ?""",
+        (match, source, query.strip(), config.CACHE_SEARCH_LIMIT)
+    ).fetchall()
+
+def save_shows(rows):
+    # Upsert keeps each show's rowid stable so the FTS triggers see an UPDATE, not a REPLACE.
+    # External ids already known are kept when the new data lacks them (TMDB searches).
+    with get_connection() as conn:
+        conn.executemany(
+            f"""INSERT INTO shows ({SHOW_COLUMNS}) VALUES ({SHOW_PLACEHOLDERS})
+               ON CONFLICT (source, id) DO UPDATE SET name = excluded.name, original_name = excluded.original_name,
+                   year = excluded.year, status = excluded.status, updated = excluded.updated, akas = excluded.akas,
+                   popularity = excluded.popularity, last_updated = excluded.last_updated, payload = excluded.payload,
+                   tvdb_id = coalesce(excluded.tvdb_id, shows.tvdb_id), imdb_id = coalesce(excluded.imdb_id, shows.imdb_id)""",
+            rows
+        )
+    # New shows may match earlier queries
+    search_memo.clear()
+
+def fill_tvmaze_akas(rows):
+    # search_cache rows of TVMaze shows with the akas fetched for the first
+    # config.AKAS_LAZY_LIMIT rows that have none yet (shows imported by a bulk sync) and
+    # their Spanish names stored. Rows whose akas can't be fetched are left as they are.
+    missing = [row for row in rows[:config.AKAS_LAZY_LIMIT] if row[6] is None]
+    if not missing:
+        return rows
+    count("akas.lazy", len(missing))
+    with ThreadPoolExecutor(max_workers=min(config.AKAS_WORKERS, len(missing))) as executor:
+        fetched = {row[0]: akas for row, akas in zip(missing, executor.map(lambda row: fetch_tvmaze_akas(row[0]), missing))
+                   if akas is not None}
+    if not fetched:
+        return rows
+    filled = []
+    for row in rows:
+        if row[0] in fetched:
+            akas = fetched[row[0]]
+            row = (row[0], row[1], spanish_name({"name": row[4], "akas": akas}), *row[3:6], json.dumps(akas), *row[7:])
+        filled.append(row)
+    with get_connection() as conn:
+        conn.executemany(
+            "UPDATE shows SET name = ?, akas = ? WHERE source = 'tvmaze' AND id = ?",
+            [(row[2], row[6], row[0]) for row in filled if row[0] in fetched]
+        )
+    return filled
+
+@timed("search.tvmaze")
+def search_tvmaze(query):
+    # [(entry, (tvdb_id, imdb_id))] from the cache, or from TVMaze when expired
+    cached = search_cache(query, "tvmaze")
+    if cached and not is_cache_expired(cached[0][7]):
+        count("search_cache.hit")
+        cached = fill_tvmaze_akas(cached)
+        return [((row[0], row[2], row[3], cached_show_data("tvmaze", row[0], row[2], row[4], row[5], row[6]), "tvmaze"),
+                 (row[8], row[9])) for row in cached]
+    count("search_cache.miss")
+    shows = [show["show"] for show in api.tvmaze("/search/shows", q=query)]
+    # Fetch missing akas concurrently instead of one blocking request per result
+    missing = [show_data for show_data in shows if "akas" not in show_data]
+    if missing:
+        with ThreadPoolExecutor(max_workers=min(config.AKAS_WORKERS, len(missing))) as executor:
+            for show_data, akas in zip(missing, executor.map(lambda s: fetch_tvmaze_akas(s["id"]), missing)):
+                if akas is not None:
+                    show_data["akas"] = akas
+    now = datetime.now().isoformat()
+    rows = [show_row("tvmaze", show_data, now) for show_data in shows]
+    save_shows(rows)
+    return [((row[0], row[2], row[4], show_data, "tvmaze"), row[11:13]) for row, show_data in zip(rows, shows)]
+
+@timed("search.tmdb")
+def search_tmdb(query):
+    # Same as search_tvmaze; TMDB search results carry no external ids, only cached rows may
+    cached = search_cache(query, "tmdb")
+    if cached and not is_cache_expired(cached[0][7]):
+        count("search_cache.hit")
+        return [((row[0], row[2], row[3], cached_show_data("tmdb", row[0], row[2], row[4], row[5], row[6]), "tmdb"),
+                 (row[8], row[9])) for row in cached]
+    count("search_cache.miss")
+    shows = api.tmdb("/search/tv", query=query).get("results", [])
+    now = datetime.now().isoformat()
+    rows = [show_row("tmdb", show, now) for show in shows]
+    save_shows(rows)
+    # Ids stored earlier (get_show, sync) survive the upsert
+    with_ids = {}
+    if rows:
+        with_ids = {row[0]: row[1:] for row in get_connection().execute(
+            f"SELECT id, tvdb_id, imdb_id FROM shows WHERE source = 'tmdb' AND id IN ({', '.join('?' * len(rows))})",
+            [row[0] for row in rows]
+        )}
+    return [((row[0], row[2], row[4], show, "tmdb"), with_ids.get(row[0], (None, None))) for row, show in zip(rows, shows)]
+
+def call_within(calls, timeout):
+    # Runs {name: function} on daemon threads, so a call that is late doesn't hold up the
+    # program, and returns {name: (result, exception)} for those finished within timeout
+    outcomes = {}
+    finished = threading.Condition()
+
+    def run(name, func):
+        try:
+            outcome = (func(), None)
+        except Exception as e:
+            outcome = (None, e)
+        with finished:
+            outcomes[name] = outcome
+            finished.notify_all()
+
+    for name, func in calls.items():
+        threading.Thread(target=run, args=(name, func), daemon=True).start()
+    with finished:
+        finished.wait_for(lambda: len(outcomes) == len(calls), timeout=max(timeout, 0))
+        return dict(outcomes)
+
+def link_tmdb_results(tvmaze_results, tmdb_results, timeout):
+    # Fetches and stores the external ids of TMDB results that may be the same show as a
+    # TVMaze result (same first year) but have none yet, within timeout seconds.
+    # Returns tmdb_results with the ids filled in.
+    years = {str(entry[2]) for entry, ids in tvmaze_results if any(ids)}
+    candidates = [entry[0] for entry, ids in tmdb_results if not any(ids) and str(entry[2]) in years]
+    if not candidates or timeout <= 0:
+        return tmdb_results
+    # Requests are still limited per host by the API client
+    outcomes = call_within({show_id: lambda show_id=show_id: api.tmdb(f"/tv/{show_id}/external_ids") for show_id in candidates}, timeout)
+    found = {show_id: external_ids("tmdb", {"external_ids": data}) for show_id, (data, error) in outcomes.items() if data}
+    if found:
+        with get_connection() as conn:
+            conn.executemany(
+                "UPDATE shows SET tvdb_id = ?, imdb_id = ? WHERE source = 'tmdb' AND id = ?",
+                [(*ids, show_id) for show_id, ids in found.items()]
+            )
+    return [(entry, found.get(entry[0], ids)) for entry, ids in tmdb_results]
+
+def merge_results(results):
+    # One entry per show: entries sharing a TheTVDB or IMDb id with an earlier entry from
+    # the other provider are folded into it. show_data["sources"] maps each provider of an
+    # entry to its id there.
+    merged = []
+    by_id = {}
+    for entry, ids in results:
+        keys = [key for key in zip(("tvdb", "imdb"), ids) if key[1]]
+        target = next((by_id[key] for key in keys if key in by_id), None)
+        if target is not None and entry[4] not in target[3]["sources"]:
+            target[3]["sources"][entry[4]] = entry[0]
+        else:
+            entry[3]["sources"] = {entry[4]: entry[0]}
+            merged.append(entry)
+            target = entry
+        for key in keys:
+            by_id.setdefault(key, target)
+    return merged
+
+@timed("search_shows")
+def search_shows(query, errors=None):
+    # Queries TVMaze and TMDB (or their cached results) at the same time and returns one
+    # entry per show. A provider that fails or doesn't answer within
+    # config.SEARCH_BUDGET_SECONDS is reported in errors (when given) and the other's
+    # results still come back; a late provider still stores its results for next time.
+    errors = errors if errors is not None else []
+    key = " ".join(query.lower().split())
+    memoized = search_memo.get(key)
+    if memoized is not None:
+        return list(memoized)
+    failed = len(errors)
+    deadline = time.monotonic() + config.SEARCH_BUDGET_SECONDS
+    outcomes = call_within({"TVmaze": lambda: search_tvmaze(query), "TMDB": lambda: search_tmdb(query)}, config.SEARCH_BUDGET_SECONDS)
+    results = {}
+    for name in ("TVmaze", "TMDB"):
+        if name not in outcomes:
+            errors.append(f"{name} no respondió a tiempo ({config.SEARCH_BUDGET_SECONDS:g} s)")
+            continue
+        result, error = outcomes[name]
+        if isinstance(error, requests.RequestException):
+            errors.append(f"La búsqueda en {name} falló: {error}")
+        elif error:
+            raise error
+        else:
+            results[name] = result
+    tvmaze_results = results.get("TVmaze", [])
+    tmdb_results = link_tmdb_results(tvmaze_results, results.get("TMDB", []), deadline - time.monotonic())
+    shows = merge_results(tvmaze_results + tmdb_results)
+    # Partial results aren't kept so the failed provider is asked again next time
+    if len(errors) == failed:
+        search_memo.put(key, tuple(shows))
+    return shows
+
+@timed("get_show")
+def get_show(show_id, source):
+    # Show entry (id, name, year, data, source) by id, from the cache or the API.
+    # Rows without last_updated are stubs from a TMDB id export and are fetched again.
+    row = get_connection().execute(
+        "SELECT id, name, year, original_name, status, akas FROM shows WHERE source = ? AND id = ? AND last_updated IS NOT NULL",
+        (source, show_id)
+    ).fetchone()
+    if row:
+        return (row[0], row[1], row[2], cached_show_data(source, row[0], row[1], row[3], row[4], row[5]), source)
+    if source == "tvmaze":
+        show_data = api.tvmaze(f"/shows/{show_id}")
+        akas = fetch_tvmaze_akas(show_id)
+        if akas is not None:
+            show_data["akas"] = akas
+    else:  # tmdb
+        show_data = api.tmdb(f"/tv/{show_id}", language="es-ES", append_to_response="external_ids")
+    row = show_row(source, show_data, datetime.now().isoformat())
+    save_shows([row])
+    return (row[0], row[2], row[4], show_data, source)
+
+def episode_row(source, ep):
+    if source == "tvmaze":
+        return (ep["season"], ep["number"], ep["name"], ep.get("airdate") or "", ep)
+    return (ep["season_number"], ep["episode_number"], ep["name"], ep.get("air_date") or "", ep)
+
+@timed("download_episodes")
+def download_episodes(db, show_id, source):
+    # Fetch the full episode list and replace the cached copy in one transaction
+    if source == "tvmaze":
+        episodes = api.tvmaze(f"/shows/{show_id}/episodes")
+        show = db.execute("SELECT status FROM shows WHERE source = ? AND id = ?", (source, show_id)).fetchone()
+        status = show[0] if show else None
+    else:  # tmdb
+        episodes, status = fetch_tmdb_episodes(show_id)
+    # Specials without a season/episode number can't be renamed, so they aren't kept
+    rows = [row for row in (episode_row(source, ep) for ep in episodes) if row[0] is not None and row[1] is not None]
+    with db:
+        db.execute("DELETE FROM episodes WHERE source = ? AND show_id = ?", (source, show_id))
+        db.executemany(
+            "INSERT OR REPLACE INTO episodes (show_id, source, season, episode, title, air_date, payload) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [(show_id, source, row[0], row[1], row[2], row[3], compress(json.dumps(row[4]))) for row in rows]
+        )
+        db.execute(
+            "INSERT OR REPLACE INTO episode_lists (source, show_id, status, fetched_at) VALUES (?, ?, ?, ?)",
+            (source, show_id, status, datetime.now().isoformat())
+        )
+    episodes = [row[:4] for row in rows]
+    episodes_memo.put((source, show_id), tuple(episodes))
+    return episodes
+
+refreshing = set()
+refreshing_lock = threading.Lock()
+
+def refresh_episodes_async(show_id, source):
+    # Stale lists are served from cache while this updates them in the background
+    key = (source, show_id)
+    with refreshing_lock:
+        if key in refreshing:
+            return
+        refreshing.add(key)
+
+    def worker():
+        db = connect()
+        try:
+            download_episodes(db, show_id, source)
+        except (requests.RequestException, sqlite3.Error) as e:
+            # stdout carries the CLI and watch mode JSON output
+            print(f"No se pudo actualizar la caché de episodios ({source} {show_id}): {e}", file=sys.stderr)
+        finally:
+            db.close()
+            with refreshing_lock:
+                refreshing.discard(key)
+
+    threading.Thread(target=worker, daemon=True).start()
+
+@timed("get_episodes")
+def get_episodes(show_id, source):
+    # Raises requests.RequestException when the list isn't cached and can't be downloaded
+    memoized = episodes_memo.get((source, show_id))
+    if memoized is not None:
+        return list(memoized)
+    conn = get_connection()
+    cache_info = conn.execute("SELECT status, fetched_at FROM episode_lists WHERE source = ? AND show_id = ?", (source, show_id)).fetchone()
+    count("episodes_cache.hit" if cache_info else "episodes_cache.miss")
+    if cache_info:
+        # The payload column isn't read: episode rows are (season, episode, title, air_date)
+        cached = conn.execute(
+            "SELECT season, episode, title, air_date FROM episodes WHERE show_id = ? AND source = ?", (show_id, source)
+        ).fetchall()
+        # Memoized before the refresh starts so the refreshed list replaces this one
+        episodes_memo.put((source, show_id), tuple(cached))
+        if is_cache_expired(cache_info[1], cache_info[0]):
+            refresh_episodes_async(show_id, source)
+        return cached
+    return download_episodes(conn, show_id, source)
+
+def forget_show(show_id, source):
+    with get_connection() as conn:
+        conn.execute("DELETE FROM shows WHERE id = ? AND source = ?", (show_id, source))
+        conn.execute("DELETE FROM episodes WHERE show_id = ? AND source = ?", (show_id, source))
+        conn.execute("DELETE FROM episode_lists WHERE show_id = ? AND source = ?", (show_id, source))
+    episodes_memo.discard((source, show_id))
+    search_memo.clear()
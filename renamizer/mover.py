@@ -0,0 +1,447 @@
+import errno
+import hashlib
+import os
+import shutil
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import suppress
+
+from renamizer import config
+from renamizer.cache import BatchWriter, get_connection
+from renamizer.instrument import count, timed, timer
+
+# Partial copy written next to the target and renamed over it once verified
+PART_SUFFIX = ".renamizer-part"
+# Journal updates written per transaction; resume and rollback check the disk anyway
+COMMIT_EVERY = 50
+# Longest a finished move waits before its journal update is written
+JOURNAL_FLUSH_SECONDS = 2.0
+# Minimum seconds between progress calls while a copy is running
+PROGRESS_INTERVAL = 0.5
+# Errors meaning the kernel can't copy between these two files (try the next method)
+KERNEL_COPY_UNSUPPORTED = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EBADF, errno.EOPNOTSUPP, errno.ENOTSUP}
+# Methods tried in order for each placement (config.PLACEMENT): the first that works for a
+# file is used, and the last one is a verified copy. Only "move" removes the source.
+PLACEMENTS = {
+    "move": ("rename", "copy"),
+    "hardlink": ("hardlink", "reflink", "copy"),
+    "reflink": ("reflink", "copy"),
+    "symlink": ("symlink", "hardlink", "copy"),
+    "copy": ("reflink", "copy"),
+}
+# Errors meaning a link or clone can't be made between these two files: another device,
+# a filesystem without links or clones, no permission to link or too many links
+LINK_UNSUPPORTED = KERNEL_COPY_UNSUPPORTED | {errno.ENOTTY, errno.EPERM, errno.EACCES, errno.EMLINK}
+# Linux ioctl that clones a file's blocks into another file
+FICLONE = 0x40049409
+
+class Cancelled(Exception):
+    pass
+
+class MoveStats:
+    # Progress of a batch, readable from any thread: files and bytes done and copy throughput
+    def __init__(self):
+        self.files_done = 0
+        self.files_total = 0
+        self.bytes_copied = 0
+        self.started = time.monotonic()
+        self.lock = threading.Lock()
+
+    def add_bytes(self, count):
+        with self.lock:
+            self.bytes_copied += count
+
+    def rate(self):
+        # Copied bytes per second since the batch started
+        elapsed = time.monotonic() - self.started
+        return self.bytes_copied / elapsed if elapsed > 0 else 0.0
+
+    def describe(self):
+        if not self.bytes_copied:
+            return ""
+        return f"{self.bytes_copied / 1e6:.0f} MB copiados, {self.rate() / 1e6:.1f} MB/s"
+
+def new_batch_id():
+    # Sortable by start time
+    return time.strftime("%Y%m%d-%H%M%S-") + uuid.uuid4().hex[:6]
+
+def _copy_file_range(src_fd, dst_fd, offset, count):
+    return os.copy_file_range(src_fd, dst_fd, count, offset, offset)
+
+def _sendfile(src_fd, dst_fd, offset, count):
+    return os.sendfile(dst_fd, src_fd, offset, count)
+
+# In-kernel copies, tried in order; file-to-file sendfile only works on Linux
+KERNEL_COPIES = []
+if hasattr(os, "copy_file_range"):
+    KERNEL_COPIES.append(_copy_file_range)
+if sys.platform.startswith("linux"):
+    KERNEL_COPIES.append(_sendfile)
+
+def _copy_data(src, dst, size, on_bytes):
+    # Copies size bytes between two unbuffered files. Kernel-side copies when available,
+    # a large reusable buffer otherwise (Windows, macOS, filesystems that refuse them).
+    offset = 0
+    for kernel_copy in KERNEL_COPIES:
+        try:
+            while offset < size:
+                count = kernel_copy(src.fileno(), dst.fileno(), offset, min(config.MOVE_BUFFER_SIZE, size - offset))
+                if not count:
+                    break
+                offset += count
+                on_bytes(count)
+            return offset
+        except OSError as e:
+            if offset or e.errno not in KERNEL_COPY_UNSUPPORTED:
+                raise
+    view = memoryview(bytearray(config.MOVE_BUFFER_SIZE))
+    while True:
+        count = src.readinto(view)
+        if not count:
+            return offset
+        written = 0
+        while written < count:
+            written += dst.write(view[written:count])
+        offset += count
+        on_bytes(count)
+
+def _digest(path):
+    digest = hashlib.blake2b()
+    view = memoryview(bytearray(config.MOVE_BUFFER_SIZE))
+    with open(path, "rb", buffering=0) as f:
+        while count := f.readinto(view):
+            digest.update(view[:count])
+    return digest.digest()
+
+@timed("move.copy")
+def copy_verified(source, target, on_bytes=None, keep_source=False):
+    # Copies to a partial file, checks it against the source and only then puts it in
+    # place and deletes the source (unless keep_source). Returns the number of bytes copied.
+    if os.path.exists(target):
+        raise FileExistsError(errno.EEXIST, "El destino ya existe", target)
+    part = target + PART_SUFFIX
+    try:
+        with open(source, "rb", buffering=0) as src, open(part, "wb", buffering=0) as dst:
+            size = os.fstat(src.fileno()).st_size
+            copied = _copy_data(src, dst, size, on_bytes or (lambda count: None))
+            os.fsync(dst.fileno())
+        if copied != size or os.path.getsize(part) != size:
+            raise OSError(errno.EIO, "La copia no coincide con el original", source)
+        if config.MOVE_VERIFY == "hash" and _digest(source) != _digest(part):
+            raise OSError(errno.EIO, "La copia no coincide con el original", source)
+        # Keep timestamps; some network shares refuse the permission bits
+        with suppress(OSError):
+            shutil.copystat(source, part)
+        os.replace(part, target)
+    except BaseException:
+        with suppress(OSError):
+            os.remove(part)
+        raise
+    if not keep_source:
+        os.remove(source)
+    return size
+
+def _case_only(source, target):
+    # Same folder and a name differing only in case: the same file on case-insensitive filesystems
+    source, target = os.path.abspath(source), os.path.abspath(target)
+    return os.path.dirname(source) == os.path.dirname(target) and os.path.basename(source).lower() == os.path.basename(target).lower()
+
+def rename_noreplace(source, target):
+    # Rename that fails with FileExistsError instead of replacing an existing target, as
+    # os.rename does on POSIX. There the file is hard linked at the target (which fails if
+    # anything is there) and the old name removed; Windows renames never replace. Where
+    # links aren't possible the target is checked right before the rename.
+    if os.name == "nt":
+        os.rename(source, target)
+        return
+    try:
+        os.link(source, target, follow_symlinks=False)
+    except FileExistsError:
+        if not _case_only(source, target):
+            raise FileExistsError(errno.EEXIST, "El destino ya existe", target)
+        os.rename(source, target)
+        return
+    except (OSError, NotImplementedError) as e:
+        if isinstance(e, OSError) and e.errno not in LINK_UNSUPPORTED - {errno.EXDEV}:
+            raise
+        if os.path.lexists(target) and not _case_only(source, target):
+            raise FileExistsError(errno.EEXIST, "El destino ya existe", target)
+        os.rename(source, target)
+        return
+    try:
+        os.remove(source)
+    except OSError:
+        with suppress(OSError):
+            os.remove(target)
+        raise
+
+def move_file(source, target, on_bytes=None):
+    # Atomic rename on the same device; across devices (EXDEV) a verified copy. An
+    # existing target is never replaced (FileExistsError).
+    # Returns (method, bytes copied). The target folder must exist.
+    try:
+        with timer("move.rename"):
+            rename_noreplace(source, target)
+        return "rename", 0
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+    copied = copy_verified(source, target, on_bytes)
+    count("move.bytes_copied", copied)
+    return "copy", copied
+
+def reflink(source, target):
+    # Copy-on-write clone with the Linux FICLONE ioctl (Btrfs, XFS, bcachefs...): no data is
+    # copied until one of the files is written. Cloned into a partial file, then put in place.
+    if os.path.lexists(target):
+        raise FileExistsError(errno.EEXIST, "El destino ya existe", target)
+    try:
+        import fcntl
+    except ImportError:
+        raise OSError(errno.EOPNOTSUPP, "Este sistema no permite clonar archivos", source)
+    part = target + PART_SUFFIX
+    try:
+        with open(source, "rb") as src, open(part, "wb") as dst:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        with suppress(OSError):
+            shutil.copystat(source, part)
+        os.replace(part, target)
+    except BaseException:
+        with suppress(OSError):
+            os.remove(part)
+        raise
+
+def hardlink(source, target):
+    os.link(source, target)
+
+def symlink(source, target):
+    os.symlink(os.path.abspath(source), target)
+
+# Ways to put a file in place without copying its data
+LINKS = {"hardlink": hardlink, "reflink": reflink, "symlink": symlink}
+
+def keeps_source(placement):
+    # Journal rows from before placements existed have none: they were moves
+    return placement not in (None, "move")
+
+def place_file(source, target, on_bytes=None, placement="move"):
+    # Puts source at target with the first method of PLACEMENTS[placement] that works for
+    # this pair of files; every placement but "move" leaves the source where it is.
+    # Returns (method, bytes copied). The target folder must exist.
+    if placement == "move":
+        return move_file(source, target, on_bytes)
+    for method in PLACEMENTS[placement][:-1]:
+        try:
+            with timer(f"move.{method}"):
+                LINKS[method](source, target)
+            return method, 0
+        except OSError as e:
+            if e.errno not in LINK_UNSUPPORTED:
+                raise
+    copied = copy_verified(source, target, on_bytes, keep_source=True)
+    count("move.bytes_copied", copied)
+    return "copy", copied
+
+def _device(path):
+    # Device of the nearest existing ancestor of path
+    path = os.path.abspath(path)
+    while True:
+        try:
+            return os.stat(path).st_dev
+        except OSError:
+            parent = os.path.dirname(path)
+            if parent == path:
+                return None
+            path = parent
+
+class _Journal:
+    # Batched status updates for one batch in move_journal. Updates are buffered by a
+    # BatchWriter (written from whichever worker thread fills it) so the database write
+    # lock is only held briefly and other threads or processes can use cache.db meanwhile.
+    def __init__(self, batch, placement=None):
+        self.batch = batch
+        self.placement = placement
+        self.writer = BatchWriter(max_rows=COMMIT_EVERY, max_seconds=JOURNAL_FLUSH_SECONDS) if batch else None
+
+    def start(self, moves):
+        if not self.batch:
+            return
+        with get_connection() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO move_journal (batch, seq, source, target, status, placement) VALUES (?, ?, ?, ?, 'pending', ?)",
+                [(self.batch, seq, source, target, self.placement) for seq, (source, target) in enumerate(moves)]
+            )
+
+    def update(self, source, result):
+        if not self.batch:
+            return
+        self.writer.add(
+            "UPDATE move_journal SET status = ?, method = ?, bytes = ?, error = ? WHERE batch = ? AND source = ?",
+            (result["status"], result.get("method"), result.get("bytes"), result.get("error"), self.batch, source)
+        )
+
+    def finish(self):
+        if not self.batch:
+            return
+        self.writer.flush()
+        with get_connection() as conn:
+            # Keep the latest batches for rollback, plus any that still have pending moves
+            conn.execute(
+                """DELETE FROM move_journal WHERE batch NOT IN (
+                    SELECT DISTINCT batch FROM move_journal ORDER BY batch DESC LIMIT ?
+                ) AND batch NOT IN (SELECT batch FROM move_journal WHERE status = 'pending')""",
+                (config.MOVE_JOURNAL_KEEP,)
+            )
+
+def move_files(moves, cancelled=None, progress=None, batch=None, stats=None, placement=None):
+    # Moves (source, target) pairs, or links or copies them with another placement
+    # (config.PLACEMENT by default, see PLACEMENTS), and returns {source: result} with
+    # target, status ("done", "error" or "cancelled"), method ("rename", "hardlink",
+    # "reflink", "symlink" or "copy"), bytes, seconds and error.
+    # Same-device files are placed inline; cross-device ones run on a pool with at most
+    # config.MOVE_WORKERS_PER_DEVICE copies per destination device. With a batch id
+    # every move is journaled first (see resume_batch and rollback_batch).
+    # progress(done, total) runs after each file and every PROGRESS_INTERVAL while copying.
+    placement = placement or config.PLACEMENT
+    if placement not in PLACEMENTS:
+        raise ValueError(f"Modo de colocación desconocido: {placement}")
+    moves = list(moves)
+    stats = stats or MoveStats()
+    stats.files_total += len(moves)
+    journal = _Journal(batch, placement)
+    journal.start(moves)
+    results = {}
+    lock = threading.Lock()
+    last_report = [0.0]
+
+    def report(force=False):
+        if progress and (force or time.monotonic() - last_report[0] >= PROGRESS_INTERVAL):
+            last_report[0] = time.monotonic()
+            progress(stats.files_done, stats.files_total)
+
+    def on_bytes(count):
+        if cancelled is not None and cancelled.is_set():
+            raise Cancelled()
+        stats.add_bytes(count)
+        report()
+
+    def run(source, target):
+        started = time.monotonic()
+        try:
+            method, copied = place_file(source, target, on_bytes, placement)
+            result = {"status": "done", "method": method, "bytes": copied}
+        except Cancelled:
+            result = {"status": "cancelled"}
+        except OSError as e:
+            result = {"status": "error", "error": str(e)}
+        result["target"] = target
+        result["seconds"] = round(time.monotonic() - started, 3)
+        with lock:
+            results[source] = result
+            journal.update(source, result)
+            if result["status"] != "cancelled":
+                stats.files_done += 1
+        report(force=True)
+
+    # Each target folder is created once
+    for directory in {os.path.dirname(os.path.abspath(target)) for _, target in moves}:
+        with suppress(OSError):
+            os.makedirs(directory, exist_ok=True)
+    copies = {}
+    try:
+        for source, target in moves:
+            if cancelled is not None and cancelled.is_set():
+                break
+            device = _device(os.path.dirname(target))
+            if device is not None and device == _device(source):
+                run(source, target)
+            else:
+                copies.setdefault(device, []).append((source, target))
+        if copies and not (cancelled is not None and cancelled.is_set()):
+            limits = {device: threading.BoundedSemaphore(config.MOVE_WORKERS_PER_DEVICE) for device in copies}
+
+            def run_limited(device, source, target):
+                if cancelled is not None and cancelled.is_set():
+                    return
+                with limits[device]:
+                    run(source, target)
+
+            with ThreadPoolExecutor(max_workers=len(copies) * config.MOVE_WORKERS_PER_DEVICE) as executor:
+                for device, group in copies.items():
+                    for source, target in group:
+                        executor.submit(run_limited, device, source, target)
+    finally:
+        for source, target in moves:
+            if source not in results:
+                results[source] = {"status": "cancelled", "target": target}
+                journal.update(source, results[source])
+        journal.finish()
+    return results
+
+def _reconcile(conn, batch):
+    # Pending rows after a crash: a finished move is marked done, leftover partial copies removed
+    rows = conn.execute(
+        "SELECT source, target, placement FROM move_journal WHERE batch = ? AND status = 'pending' ORDER BY seq", (batch,)
+    ).fetchall()
+    pending = []
+    for source, target, placement in rows:
+        with suppress(OSError):
+            os.remove(target + PART_SUFFIX)
+        # Links and copies are only in place once complete
+        if os.path.lexists(target) and (keeps_source(placement) or not os.path.exists(source)):
+            conn.execute("UPDATE move_journal SET status = 'done' WHERE batch = ? AND source = ?", (batch, source))
+        else:
+            pending.append((source, target))
+    conn.commit()
+    return pending
+
+def interrupted_batches():
+    # [(batch, pending moves)] for batches that stopped halfway, oldest first
+    return get_connection().execute(
+        "SELECT batch, count(*) FROM move_journal WHERE status = 'pending' GROUP BY batch ORDER BY batch"
+    ).fetchall()
+
+def resume_batch(batch, cancelled=None, progress=None, stats=None):
+    # Finishes the pending moves of an interrupted batch, with the placement it started with.
+    # Moves whose target is now taken by another file are reported as errors.
+    conn = get_connection()
+    pending = _reconcile(conn, batch)
+    row = conn.execute("SELECT placement FROM move_journal WHERE batch = ? LIMIT 1", (batch,)).fetchone()
+    return move_files(pending, cancelled, progress, batch, stats, row[0] if row and row[0] else "move")
+
+def rollback_batch(batch, cancelled=None, progress=None, stats=None):
+    # Moves every finished file of a batch back to where it came from, newest first. Links
+    # and copies whose source is still there are just removed. A file now at the original
+    # path is never replaced: that entry is reported as an error and stays "done".
+    conn = get_connection()
+    _reconcile(conn, batch)
+    with conn:
+        conn.execute("UPDATE move_journal SET status = 'cancelled' WHERE batch = ? AND status = 'pending'", (batch,))
+        rows = conn.execute(
+            "SELECT source, target, placement FROM move_journal WHERE batch = ? AND status = 'done' ORDER BY seq DESC", (batch,)
+        ).fetchall()
+    done = [(source, target) for source, target, _ in rows]
+    removals = {(source, target) for source, target, placement in rows if keeps_source(placement) and os.path.lexists(source)}
+    returns = [(target, source) for source, target in done if (source, target) not in removals]
+    results = move_files(returns, cancelled, progress, stats=stats, placement="move")
+    for source, target in done:
+        if (source, target) not in removals:
+            continue
+        if cancelled is not None and cancelled.is_set():
+            results[target] = {"status": "cancelled", "target": source}
+            continue
+        try:
+            with suppress(FileNotFoundError):
+                os.remove(target)
+            results[target] = {"status": "done", "method": "remove", "target": source}
+        except OSError as e:
+            results[target] = {"status": "error", "error": str(e), "target": source}
+    with conn:
+        conn.executemany(
+            "UPDATE move_journal SET status = 'rolled_back' WHERE batch = ? AND source = ?",
+            [(batch, source) for source, target in done if results[target]["status"] == "done"]
+        )
+    return results
@@ -0,0 +1,102 @@
+import os
+import re
+import string
+
+from renamizer import config
+from renamizer.instrument import timed
+
+# Special characters replacement for Windows (Plex-compatible)
+SPECIAL_CHARS = {
+    '<': '', '>': '', ':': '', '"': '', '/': '', '\\': '', '|': '', '?': '', '*': ''
+}
+SPECIAL_CHARS_TABLE = str.maketrans(SPECIAL_CHARS)
+
+# Naming templates: "/" separates folders, "{token}" takes a value (format specs such as
+# {season:02d} are allowed) and "[...]" is an optional part, dropped when any token in it is
+# empty (optional parts can't be nested). Media info example: "{show} - {season}x{episode:02d}[ {resolution}][ {vcodec}]"
+PRESETS = {
+    "renamizer": "Series de TV/{show}[ ({year})]/Temporada {season:02d}/{show} - s{season:02d}e{episode:02d}[-e{last_episode:02d}][ - {title}]",
+    "plex": "TV Shows/{show}[ ({year})]/Season {season:02d}/{show}[ ({year})] - s{season:02d}e{episode:02d}[-e{last_episode:02d}][ - {title}]",
+    "jellyfin": "Shows/{show}[ ({year})]/Season {season:02d}/{show} S{season:02d}E{episode:02d}[-E{last_episode:02d}][ - {title}]",
+    "kodi": "TV Shows/{show}[ ({year})]/Season {season}/{show} S{season:02d}E{episode:02d}[E{last_episode:02d}][ - {title}]",
+}
+
+TOKENS = {"show", "year", "season", "episode", "last_episode", "title", "resolution", "vcodec", "acodec", "channels"}
+# Tokens that need ffprobe; batches whose template uses none of them skip probing
+MEDIA_TOKENS = {"resolution", "vcodec", "acodec", "channels"}
+
+OPTIONAL = re.compile(r"\[([^\[\]]*)\]")
+
+class NamingTemplate:
+    # A template parsed once into (optional, [(literal, token, spec), ...]) segments
+    def __init__(self, template):
+        self.template = PRESETS.get(template, template)
+        self.segments = []
+        position = 0
+        for found in OPTIONAL.finditer(self.template):
+            self._add(self.template[position:found.start()], False)
+            self._add(found.group(1), True)
+            position = found.end()
+        self._add(self.template[position:], False)
+        self.tokens = {token for _, parts in self.segments for _, token, _ in parts if token}
+        self.uses_media = bool(self.tokens & MEDIA_TOKENS)
+
+    def _add(self, text, optional):
+        if not text:
+            return
+        parts = []
+        for literal, token, spec, _ in string.Formatter().parse(text):
+            if token is not None and token not in TOKENS:
+                raise ValueError(f"Token desconocido en la plantilla: {{{token}}}")
+            parts.append((literal, token, spec))
+        self.segments.append((optional, parts))
+
+    def render(self, values):
+        # values maps tokens to raw values; empty ones drop their optional segment
+        out = []
+        for optional, parts in self.segments:
+            rendered = []
+            for literal, token, spec in parts:
+                rendered.append(literal)
+                if not token:
+                    continue
+                value = values.get(token)
+                if value is None or value == "":
+                    if optional:
+                        rendered = None
+                        break
+                    continue
+                rendered.append(format(value, spec).translate(SPECIAL_CHARS_TABLE) if spec else str(value).translate(SPECIAL_CHARS_TABLE))
+            if rendered is not None:
+                out.append("".join(rendered))
+        return os.path.join(*"".join(out).split("/"))
+
+def get_template(template=None):
+    # Compiled template from a preset name or pattern, config.NAMING_TEMPLATE by default
+    if isinstance(template, NamingTemplate):
+        return template
+    return NamingTemplate(template or config.NAMING_TEMPLATE)
+
+def media_values(media_info):
+    # ffprobe results as template values: 1080p, H264, AAC, 6
+    values = {"vcodec": media_info.get("video_codec", ""), "acodec": media_info.get("audio_codec", ""),
+              "channels": media_info.get("audio_channels", "")}
+    resolution = media_info.get("resolution", "")
+    values["resolution"] = f"{resolution.split('x')[-1]}p" if resolution else ""
+    return values
+
+@timed("rename_file")
+def rename_file(filename, show_name, season, episode, title, year, media_info, output_dir, include_title, last_episode=None, template=None):
+    values = {
+        "show": show_name,
+        "year": int(year) if year else None,
+        "season": season,
+        "episode": episode,
+        # Multi-episode file, Plex style: s01e01-e02
+        "last_episode": last_episode if last_episode and last_episode != episode else None,
+        "title": title if include_title else None,
+    }
+    values.update(media_values(media_info or {}))
+    ext = os.path.splitext(filename)[1] or ".mp4"
+    # Only computes the path; folders are created when the batch is moved
+    return os.path.join(output_dir, get_template(template).render(values) + ext)
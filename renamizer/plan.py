@@ -0,0 +1,153 @@
+import csv
+import json
+import os
+
+from renamizer.instrument import timed
+from renamizer.library import check_library, note_placed
+from renamizer.media import probe_files
+from renamizer.mover import move_files, new_batch_id
+from renamizer.naming import get_template, rename_file
+
+# Longest path Windows accepts without the \\?\ prefix (MAX_PATH minus the terminating NUL)
+WINDOWS_MAX_PATH = 259
+# Longest file or folder name on common filesystems
+MAX_NAME = 255
+
+# Problems that keep a plan entry from being applied
+PROBLEMS = {
+    "duplicate": "Otro archivo del lote tiene el mismo destino",
+    "in_library": "El episodio ya está en la biblioteca",
+    "exists": "El destino ya existe",
+    "too_long": "La ruta de destino es demasiado larga para Windows",
+    "name_too_long": "Un nombre de la ruta de destino es demasiado largo",
+}
+
+CSV_FIELDS = ("source", "target", "season", "episode", "last_episode", "title", "problem", "duplicate_of", "upgrade_of")
+
+@timed("build_plan")
+def build_plan(show_name, year, pairs, output_dir, include_title=True, template=None, windows_paths=None):
+    # Computes the target of every (episode, file) pair in memory, looks for the episodes
+    # already in the library under output_dir (check_library) and checks the whole batch
+    # with check_plan. Nothing is created or moved. `episode` may be a list of
+    # consecutive episodes for multi-episode files. Returns a list of plan entries.
+    template = get_template(template)
+    media_infos = probe_files([file for _, file in pairs]) if template.uses_media else {}
+    plan = []
+    for episode, file in pairs:
+        episodes = episode if isinstance(episode, list) else [episode]
+        episode = episodes[0]
+        last_episode = int(episodes[-1][1])
+        entry = {"source": file, "season": int(episode[0]), "episode": int(episode[1]), "title": episode[2]}
+        if len(episodes) > 1:
+            entry["last_episode"] = last_episode
+        entry["target"] = rename_file(
+            os.path.basename(file),
+            show_name,
+            int(episode[0]),
+            int(episode[1]),
+            episode[2],
+            year,
+            media_infos.get(file),
+            output_dir,
+            include_title,
+            last_episode,
+            template
+        )
+        plan.append(entry)
+    check_library(plan, show_name, year, output_dir)
+    return check_plan(plan, windows_paths)
+
+@timed("check_plan")
+def check_plan(plan, windows_paths=None):
+    # Sets entry["problem"] (a PROBLEMS key or None) for every entry: two sources with the
+    # same target, episodes still in the library (entry["duplicate_of"], see check_library),
+    # targets that already exist and paths too long for Windows (checked by default only
+    # when running on Windows). Each target folder is listed once.
+    if windows_paths is None:
+        windows_paths = os.name == "nt"
+    claimed = {}
+    listings = {}
+    for entry in plan:
+        entry["problem"] = None
+        target = os.path.abspath(entry["target"])
+        key = os.path.normcase(target)
+        directory, name = os.path.split(key)
+        if directory not in listings:
+            try:
+                listings[directory] = {os.path.normcase(existing) for existing in os.listdir(directory)}
+            except OSError:
+                listings[directory] = set()
+        if key in claimed:
+            entry["problem"] = claimed[key]["problem"] = "duplicate"
+        elif entry.get("duplicate_of") and os.path.exists(entry["duplicate_of"]):
+            entry["problem"] = "in_library"
+        elif name in listings[directory] and key != os.path.normcase(os.path.abspath(entry["source"])):
+            entry["problem"] = "exists"
+        elif windows_paths and len(target) > WINDOWS_MAX_PATH:
+            entry["problem"] = "too_long"
+        elif any(len(part) > MAX_NAME for part in target.split(os.sep)):
+            entry["problem"] = "name_too_long"
+        claimed.setdefault(key, entry)
+    return plan
+
+def plan_problems(plan):
+    return [entry for entry in plan if entry.get("problem")]
+
+def describe_problem(entry):
+    return f"{PROBLEMS[entry['problem']]}: {entry['duplicate_of' if entry['problem'] == 'in_library' else 'target']}"
+
+def write_plan(plan, path):
+    # JSON, or CSV when the file name ends in .csv
+    if path.lower().endswith(".csv"):
+        with open(path, "w", encoding="utf-8", newline="") as f:
+            writer = csv.DictWriter(f, CSV_FIELDS, extrasaction="ignore")
+            writer.writeheader()
+            writer.writerows(plan)
+    else:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(plan, f, ensure_ascii=False, indent=2)
+
+def read_plan(path):
+    if not path.lower().endswith(".csv"):
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    plan = []
+    with open(path, encoding="utf-8", newline="") as f:
+        for row in csv.DictReader(f):
+            entry = {"source": row["source"], "target": row["target"], "season": int(row["season"]),
+                     "episode": int(row["episode"]), "title": row["title"], "problem": row["problem"] or None}
+            if row.get("last_episode"):
+                entry["last_episode"] = int(row["last_episode"])
+            for key in ("duplicate_of", "upgrade_of"):
+                if row.get(key):
+                    entry[key] = row[key]
+            plan.append(entry)
+    return plan
+
+@timed("execute_plan")
+def execute_plan(plan, cancelled=None, progress=None, batch=None, stats=None, placement=None):
+    # Checks the plan again (the disk may have changed since it was built), moves the
+    # entries without problems and returns one result dict per processed entry:
+    # status "renamed", "skipped" (already in the library) or "error", with the move
+    # method or the error message. placement is how files get to the library
+    # (config.PLACEMENT by default: move, hardlink, reflink, symlink or copy).
+    check_plan(plan)
+    moves = [(entry["source"], entry["target"]) for entry in plan if not entry["problem"]]
+    moved = move_files(moves, cancelled, progress, batch or new_batch_id(), stats, placement)
+    note_placed([outcome["target"] for outcome in moved.values() if outcome["status"] == "done"])
+    results = []
+    for entry in plan:
+        result = {key: value for key, value in entry.items() if key != "problem"}
+        if entry["problem"]:
+            result["status"] = "skipped" if entry["problem"] == "in_library" else "error"
+            result["error"] = describe_problem(entry)
+        else:
+            outcome = moved[entry["source"]]
+            if outcome["status"] == "cancelled":
+                continue
+            result["status"] = "renamed" if outcome["status"] == "done" else "error"
+            for key in ("method", "error"):
+                if outcome.get(key):
+                    result[key] = outcome[key]
+        results.append(result)
+    return results
@@ -0,0 +1,111 @@
+import json
+import os
+from collections import namedtuple
+
+from renamizer import config
+from renamizer.cache import get_connection
+from renamizer.instrument import count
+
+ScannedFile = namedtuple("ScannedFile", "path size mtime_ns inode")
+
+# Changed directories written to the index per transaction
+COMMIT_EVERY = 200
+
+def _list_directory(path):
+    # One scandir pass: file entries with their stat data and subdirectory names
+    files, subdirs = [], []
+    with os.scandir(path) as entries:
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.name)
+                elif entry.is_file():
+                    st = entry.stat()
+                    files.append(ScannedFile(entry.path, st.st_size, st.st_mtime_ns, entry.inode() or None))
+            except OSError:
+                continue
+    files.sort()
+    subdirs.sort()
+    return files, subdirs
+
+def _save_directory(conn, path, mtime_ns, files, subdirs, previous_subdirs):
+    conn.execute("INSERT OR REPLACE INTO scan_dirs (path, mtime_ns, subdirs) VALUES (?, ?, ?)", (path, mtime_ns, json.dumps(subdirs)))
+    conn.execute("DELETE FROM scan_files WHERE dir = ?", (path,))
+    conn.executemany(
+        "INSERT OR REPLACE INTO scan_files (path, dir, size, mtime_ns, inode) VALUES (?, ?, ?, ?, ?)",
+        [(f.path, path, f.size, f.mtime_ns, f.inode) for f in files]
+    )
+    # Forget subtrees that no longer exist
+    for name in set(previous_subdirs) - set(subdirs):
+        gone = os.path.join(path, name)
+        like = gone.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + os.sep + "%"
+        conn.execute("DELETE FROM scan_dirs WHERE path = ? OR path LIKE ? ESCAPE '\\'", (gone, like))
+        conn.execute("DELETE FROM scan_files WHERE dir = ? OR dir LIKE ? ESCAPE '\\'", (gone, like))
+
+def _stat_indexed(files):
+    # Current stat data of files served from the index: writing to a file in place changes
+    # its size and mtime but not its folder's mtime. Files gone since are left out.
+    # Returns (files, index updates for the ones that changed).
+    current, changed = [], []
+    for file in files:
+        try:
+            st = os.stat(file.path)
+        except OSError:
+            continue
+        if (st.st_size, st.st_mtime_ns) != (file.size, file.mtime_ns):
+            file = file._replace(size=st.st_size, mtime_ns=st.st_mtime_ns)
+            changed.append((file.size, file.mtime_ns, file.path))
+        current.append(file)
+    return current, changed
+
+def scan(root, extensions=None):
+    # Yields ScannedFile entries under root as they are found, with current size and
+    # mtime. Directories whose mtime hasn't changed since the last scan are served from the
+    # index in cache.db without being listed again (their matching files are only
+    # stat'ed); only changed directories are read with os.scandir.
+    extensions = tuple(ext.lower() for ext in (extensions or config.VIDEO_EXTENSIONS))
+    # Changes are buffered and written in short transactions so the write lock isn't held
+    # while the caller consumes the files
+    conn = get_connection()
+    stack = [os.path.abspath(root)]
+    pending = []
+    changed_files = []
+
+    def save_pending():
+        with conn:
+            for directory in pending:
+                _save_directory(conn, *directory)
+            conn.executemany("UPDATE scan_files SET size = ?, mtime_ns = ? WHERE path = ?", changed_files)
+        pending.clear()
+        changed_files.clear()
+
+    try:
+        while stack:
+            path = stack.pop()
+            try:
+                mtime_ns = os.stat(path).st_mtime_ns
+            except OSError:
+                continue
+            cached = conn.execute("SELECT mtime_ns, subdirs FROM scan_dirs WHERE path = ?", (path,)).fetchone()
+            if cached and cached[0] == mtime_ns:
+                count("scan_index.hit")
+                subdirs = json.loads(cached[1])
+                files, changed = _stat_indexed([ScannedFile(*row) for row in conn.execute(
+                    "SELECT path, size, mtime_ns, inode FROM scan_files WHERE dir = ? ORDER BY path", (path,)
+                ) if row[0].lower().endswith(extensions)])
+                changed_files.extend(changed)
+            else:
+                count("scan_index.miss")
+                try:
+                    files, subdirs = _list_directory(path)
+                except OSError:
+                    continue
+                pending.append((path, mtime_ns, files, subdirs, json.loads(cached[1]) if cached else []))
+                if len(pending) >= COMMIT_EVERY:
+                    save_pending()
+            for file in files:
+                if file.path.lower().endswith(extensions):
+                    yield file
+            stack.extend(os.path.join(path, name) for name in reversed(subdirs))
+    finally:
+        save_pending()
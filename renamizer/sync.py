@@ -0,0 +1,194 @@
+import gzip
+import json
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+import requests
+
+from renamizer import config
+from renamizer.cache import connect
+from renamizer.metadata import SHOW_COLUMNS, SHOW_PLACEHOLDERS, api, show_row
+
+# Rows per transaction while importing
+BULK_ROWS = 5000
+# TVMaze /updates/shows windows, and how far back TMDB /tv/changes goes
+TVMAZE_UPDATE_WINDOWS = (("day", 1), ("week", 7), ("month", 30))
+TMDB_CHANGES_DAYS = 14
+
+# Upsert of full show data. Akas fetched earlier for a show are kept (and its Spanish
+# name with them) since neither bulk source includes them.
+UPSERT_SHOW_SQL = f"""INSERT INTO shows ({SHOW_COLUMNS}) VALUES ({SHOW_PLACEHOLDERS})
+    ON CONFLICT (source, id) DO UPDATE SET
+        name = CASE WHEN excluded.akas IS NULL AND shows.akas IS NOT NULL THEN shows.name ELSE excluded.name END,
+        original_name = excluded.original_name,
+        year = excluded.year,
+        status = excluded.status,
+        updated = excluded.updated,
+        akas = coalesce(excluded.akas, shows.akas),
+        popularity = excluded.popularity,
+        last_updated = excluded.last_updated,
+        payload = excluded.payload,
+        tvdb_id = coalesce(excluded.tvdb_id, shows.tvdb_id),
+        imdb_id = coalesce(excluded.imdb_id, shows.imdb_id)"""
+
+# Id export entries only carry the original name and popularity: new shows are stored as
+# stubs without last_updated (always expired, so searches still ask the API), known ones
+# only get their popularity updated
+UPSERT_STUB_SQL = """INSERT INTO shows (id, source, name, original_name, popularity) VALUES (?, 'tmdb', ?, ?, ?)
+    ON CONFLICT (source, id) DO UPDATE SET popularity = excluded.popularity"""
+
+def last_sync(conn, source):
+    row = conn.execute("SELECT synced_at FROM sync_state WHERE source = ?", (source,)).fetchone()
+    return datetime.fromisoformat(row[0]) if row else None
+
+def _mark_synced(conn, source, now):
+    conn.execute("INSERT OR REPLACE INTO sync_state (source, synced_at) VALUES (?, ?)", (source, now))
+
+def _fetch_shows(source, show_ids):
+    # Current data of the given shows, fetched concurrently; shows that are gone are skipped
+    def fetch(show_id):
+        try:
+            if source == "tvmaze":
+                return api.tvmaze(f"/shows/{show_id}")
+            return api.tmdb(f"/tv/{show_id}", language="es-ES", append_to_response="external_ids")
+        except requests.HTTPError as e:
+            if e.response is not None and e.response.status_code == 404:
+                return None
+            raise
+
+    if not show_ids:
+        return []
+    with ThreadPoolExecutor(max_workers=min(config.SYNC_WORKERS, len(show_ids))) as executor:
+        return [show for show in executor.map(fetch, show_ids) if show]
+
+def _refresh(conn, source, shows, now):
+    # Stores refreshed shows, expires their cached episode lists and marks every other
+    # synced show as current
+    conn.executemany(UPSERT_SHOW_SQL, [show_row(source, show, now) for show in shows])
+    conn.executemany(
+        "UPDATE episode_lists SET fetched_at = '' WHERE source = ? AND show_id = ?", [(source, show["id"]) for show in shows]
+    )
+    conn.execute("UPDATE shows SET last_updated = ? WHERE source = ? AND last_updated IS NOT NULL", (now, source))
+
+def import_tvmaze_index(conn, now):
+    # Walks the TVMaze show index (/shows?page=N, 250 shows per page, ordered by id) into
+    # the cache, one transaction per page so the app can write between them. The sync is
+    # only marked done at the end. Returns the number of shows imported.
+    imported = 0
+    page = 0
+    while True:
+        try:
+            shows = api.get_json(f"{api.tvmaze_url}/shows", {"page": page}, revalidate=False)
+        except requests.HTTPError as e:
+            if e.response is not None and e.response.status_code == 404:
+                break
+            raise
+        with conn:
+            conn.executemany(UPSERT_SHOW_SQL, [show_row("tvmaze", show, now) for show in shows])
+        imported += len(shows)
+        page += 1
+    with conn:
+        _mark_synced(conn, "tvmaze", now)
+    return imported
+
+def sync_tvmaze(conn, full=False):
+    # Full index import the first time (or after a month without syncing); afterwards only
+    # the shows listed in /updates/shows as newer than the cached copy are fetched again
+    now = datetime.now()
+    synced = last_sync(conn, "tvmaze")
+    elapsed = now - synced if synced else None
+    if full or elapsed is None or elapsed > timedelta(days=TVMAZE_UPDATE_WINDOWS[-1][1]):
+        return {"mode": "full", "imported": import_tvmaze_index(conn, now.isoformat())}
+    window = next(name for name, days in TVMAZE_UPDATE_WINDOWS if elapsed <= timedelta(days=days))
+    updates = api.get_json(f"{api.tvmaze_url}/updates/shows", {"since": window}, revalidate=False)
+    known = dict(conn.execute("SELECT id, updated FROM shows WHERE source = 'tvmaze'"))
+    changed = [int(show_id) for show_id, updated in updates.items() if (known.get(int(show_id)) or 0) < updated]
+    shows = _fetch_shows("tvmaze", changed)
+    with conn:
+        _refresh(conn, "tvmaze", shows, now.isoformat())
+        _mark_synced(conn, "tvmaze", now.isoformat())
+    return {"mode": "updates", "window": window, "refreshed": len(shows)}
+
+def _export_lines(path=None, date=None):
+    # Lines of a TMDB id export, from a local .json.gz file or streamed from files.tmdb.org
+    if path:
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            yield from f
+        return
+    # Exports are published during the morning (UTC); yesterday's is always available
+    date = date or datetime.now(timezone.utc).date() - timedelta(days=1)
+    with api.session.get(config.TMDB_EXPORT_URL.format(date=date), stream=True, timeout=api.timeout) as response:
+        response.raise_for_status()
+        with gzip.open(response.raw, "rt", encoding="utf-8") as f:
+            yield from f
+
+def import_tmdb_export(conn, path=None, date=None):
+    # Streams a TMDB TV id export into the cache, one transaction per BULK_ROWS entries so
+    # the download never holds the write lock. Returns the number of entries read.
+    imported = 0
+    rows = []
+    for line in _export_lines(path, date):
+        entry = json.loads(line)
+        if entry.get("adult"):
+            continue
+        name = entry.get("original_name", "")
+        rows.append((entry["id"], name, name, entry.get("popularity") or 0))
+        if len(rows) >= BULK_ROWS:
+            with conn:
+                conn.executemany(UPSERT_STUB_SQL, rows)
+            imported += len(rows)
+            rows = []
+    with conn:
+        conn.executemany(UPSERT_STUB_SQL, rows)
+    imported += len(rows)
+    return imported
+
+def _tmdb_changes(since, now):
+    # Ids of TV shows changed on TMDB since the given time (at most TMDB_CHANGES_DAYS ago)
+    params = {"start_date": since.date().isoformat(), "end_date": now.date().isoformat(), "page": 1}
+    ids = set()
+    while True:
+        data = api.tmdb("/tv/changes", **params)
+        ids.update(entry["id"] for entry in data.get("results", []))
+        if params["page"] >= data.get("total_pages", 1):
+            return ids
+        params["page"] += 1
+
+def sync_tmdb(conn, full=False, export=None):
+    # Id export import the first time, when asked or when `export` (a local file) is given;
+    # afterwards the fully cached shows listed in /tv/changes are fetched again
+    now = datetime.now()
+    synced = last_sync(conn, "tmdb")
+    result = {}
+    if full or export or synced is None or now - synced > timedelta(days=TMDB_CHANGES_DAYS):
+        result["imported"] = import_tmdb_export(conn, export)
+        if synced is None or now - synced > timedelta(days=TMDB_CHANGES_DAYS):
+            # Without a usable change feed cached shows can't be vouched for
+            with conn:
+                _mark_synced(conn, "tmdb", now.isoformat())
+            return dict(result, mode="full")
+    changes = _tmdb_changes(synced, now)
+    cached = {row[0] for row in conn.execute("SELECT id FROM shows WHERE source = 'tmdb' AND last_updated IS NOT NULL")}
+    shows = _fetch_shows("tmdb", sorted(changes & cached))
+    with conn:
+        _refresh(conn, "tmdb", shows, now.isoformat())
+        _mark_synced(conn, "tmdb", now.isoformat())
+    return dict(result, mode="updates", refreshed=len(shows))
+
+def sync(sources=("tvmaze", "tmdb"), full=False, tmdb_export=None, db_file=None):
+    # Bulk cache warm-up/refresh on its own connection, meant to run nightly from the CLI.
+    # Returns {source: summary}; a failing source doesn't stop the others.
+    conn = connect(db_file)
+    report = {}
+    try:
+        for source in sources:
+            try:
+                if source == "tvmaze":
+                    report[source] = sync_tvmaze(conn, full)
+                else:
+                    report[source] = sync_tmdb(conn, full, tmdb_export)
+            except (requests.RequestException, OSError, ValueError) as e:
+                report[source] = {"error": str(e)}
+    finally:
+        conn.close()
+    return report
@@ -0,0 +1,329 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import sqlite3
+import struct
+import sys
+import time
+
+import requests
+
+from renamizer import config
+from renamizer.instrument import count, timed
+from renamizer.matcher import match_files, normalize, show_hints
+from renamizer.metadata import get_episodes, search_shows
+from renamizer.mover import new_batch_id
+from renamizer.naming import get_template
+from renamizer.plan import build_plan, execute_plan
+from renamizer.scanner import scan
+
+# inotify(7) event flags
+IN_MODIFY = 0x2
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+IN_ISDIR = 0x40000000
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+# struct inotify_event header: wd, mask, cookie, len (the name follows)
+EVENT = struct.Struct("iIII")
+# Failures that end one show's batch, not the daemon: its files are reported as errors
+# and retried after config.WATCH_RETRY_SECONDS
+BATCH_ERRORS = (requests.RequestException, LookupError, sqlite3.Error, OSError)
+
+def is_excluded(path, exclude):
+    return any(path == folder or path.startswith(folder + os.sep) for folder in exclude)
+
+def scan_roots(roots, exclude):
+    # Video files under roots, through the scan index (unchanged directories aren't listed)
+    return {file.path: file for root in roots for file in scan(root) if not is_excluded(file.path, exclude)}
+
+class InotifyWatcher:
+    # Changed files under roots from Linux inotify, with one watch per directory.
+    # Directories created later are watched and listed, for files written before the watch.
+    def __init__(self, roots, exclude=()):
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 falló")
+        self.roots = roots
+        self.exclude = exclude
+        self.dirs = {}
+        try:
+            for root in roots:
+                self.add_tree(root)
+        except OSError:
+            self.close()
+            raise
+
+    def add_tree(self, top, found=None):
+        # Watches top and its subfolders; files already in them go to found when given
+        for path, subdirs, files in os.walk(top):
+            subdirs[:] = [name for name in subdirs if not is_excluded(os.path.join(path, name), self.exclude)]
+            wd = self._add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+            if wd < 0:
+                # ENOSPC: fs.inotify.max_user_watches reached
+                raise OSError(ctypes.get_errno(), f"No se puede vigilar {path}")
+            self.dirs[wd] = path
+            if found is not None:
+                found.update(os.path.join(path, name) for name in files)
+
+    def changes(self, timeout):
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return set()
+        data = b""
+        while True:
+            try:
+                chunk = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            if not chunk:
+                break
+            data += chunk
+        changed = set()
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT.unpack_from(data, offset)
+            name = data[offset + EVENT.size:offset + EVENT.size + length].rstrip(b"\0")
+            offset += EVENT.size + length
+            if mask & IN_Q_OVERFLOW:
+                # Events were lost: fall back to one scan of the roots
+                changed.update(scan_roots(self.roots, self.exclude))
+                continue
+            if mask & IN_IGNORED:
+                self.dirs.pop(wd, None)
+                continue
+            directory = self.dirs.get(wd)
+            if directory is None or not name:
+                continue
+            path = os.path.join(directory, os.fsdecode(name))
+            if is_excluded(path, self.exclude):
+                continue
+            if not mask & IN_ISDIR:
+                changed.add(path)
+            elif mask & (IN_CREATE | IN_MOVED_TO):
+                try:
+                    self.add_tree(path, changed)
+                except OSError as e:
+                    print(f"Aviso: {e}", file=sys.stderr)
+        return changed
+
+    def close(self):
+        os.close(self.fd)
+
+class PollingWatcher:
+    # Fallback without inotify: the roots are scanned every config.WATCH_POLL_SECONDS and
+    # new files or files whose size or mtime changed since the last pass are reported.
+    # The scan index only lists directories whose mtime changed.
+    def __init__(self, roots, exclude=(), interval=None):
+        self.roots = roots
+        self.exclude = exclude
+        self.interval = interval if interval is not None else config.WATCH_POLL_SECONDS
+        self.known = {path: (file.size, file.mtime_ns) for path, file in scan_roots(roots, exclude).items()}
+        self.next_poll = time.monotonic() + self.interval
+
+    def changes(self, timeout):
+        wait = self.next_poll - time.monotonic()
+        if wait > timeout:
+            time.sleep(max(timeout, 0))
+            return set()
+        time.sleep(max(wait, 0))
+        self.next_poll = time.monotonic() + self.interval
+        files = {path: (file.size, file.mtime_ns) for path, file in scan_roots(self.roots, self.exclude).items()}
+        changed = {path for path, signature in files.items() if self.known.get(path) != signature}
+        self.known = files
+        return changed
+
+    def close(self):
+        pass
+
+def make_watcher(roots, exclude=(), poll=False):
+    # inotify on Linux, polling elsewhere or when inotify can't be set up (e.g. watch limit reached)
+    if not poll and sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(roots, exclude)
+        except (OSError, AttributeError) as e:
+            print(f"inotify no disponible ({e}); se revisarán las carpetas cada {config.WATCH_POLL_SECONDS:g} s", file=sys.stderr)
+    return PollingWatcher(roots, exclude)
+
+def file_signature(path):
+    st = os.stat(path)
+    return st.st_size, st.st_mtime_ns
+
+class Settling:
+    # Files waiting to stop changing: path -> (size and mtime, time of the last change).
+    # A file is ready once its size and mtime stayed the same for `seconds`.
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.files = {}
+
+    def touch(self, path):
+        try:
+            self.files[path] = (file_signature(path), time.monotonic())
+        except OSError:
+            self.files.pop(path, None)
+
+    def next_due(self):
+        return min((since + self.seconds for _, since in self.files.values()), default=None)
+
+    def ready(self):
+        now = time.monotonic()
+        ready = []
+        for path, (signature, since) in list(self.files.items()):
+            if now - since < self.seconds:
+                continue
+            try:
+                current = file_signature(path)
+            except OSError:
+                del self.files[path]
+                continue
+            if current != signature:
+                self.files[path] = (current, now)
+            else:
+                del self.files[path]
+                ready.append(path)
+        return sorted(ready)
+
+def find_show(name, year, source, errors=None):
+    # Show entry (id, name, year, data, source) whose name, original name or an alias is
+    # exactly `name` once normalized (and first aired in `year`, when known), or None
+    for show in search_shows(name, errors):
+        if source not in show[3]["sources"] or (year and str(show[2]) != str(year)):
+            continue
+        names = [show[1], show[3].get("name"), show[3].get("original_name")]
+        names.extend(aka.get("name") for aka in show[3].get("akas") or [])
+        if name in {normalize(value) for value in names if value}:
+            return (show[3]["sources"][source], show[1], show[2], show[3], source)
+    return None
+
+class WatchDaemon:
+    # Moves the video files that appear under roots into output_dir once they stop
+    # changing: the show comes from the filename or its folder (exact name match in the
+    # search results, usually served by the cache), the episode from match_files and the
+    # target from the naming template; files are moved (or linked, see placement) with
+    # execute_plan, one batch per show. on_result(result) gets one dict per processed file, like the CLI report.
+    # Files that couldn't be renamed are retried when they change or after
+    # config.WATCH_RETRY_SECONDS; files already in the library ("skipped") and plan
+    # conflicts (see plan.PROBLEMS) only when they change.
+    def __init__(self, roots, output_dir, source="tvmaze", template=None, include_title=True, poll=False,
+                 settle=None, on_result=None, placement=None):
+        self.roots = [os.path.abspath(root) for root in roots]
+        self.output_dir = os.path.abspath(output_dir)
+        # The library may live inside a watched folder
+        self.exclude = [self.output_dir]
+        # Files dropped straight into a watched folder don't name the show with their folder
+        self.root_names = {normalize(os.path.basename(root)) for root in self.roots}
+        self.source = source
+        self.template = get_template(template)
+        self.include_title = include_title
+        self.poll = poll
+        self.settling = Settling(settle if settle is not None else config.WATCH_SETTLE_SECONDS)
+        self.on_result = on_result
+        self.placement = placement
+        self.extensions = tuple(ext.lower() for ext in config.VIDEO_EXTENSIONS)
+        # path -> (size and mtime, retry time or None to wait for a change) of files left
+        # where they were
+        self.held = {}
+        self.summary = {}
+
+    def run(self, stop=None):
+        # Runs until stop (a threading.Event) is set or KeyboardInterrupt; files already in
+        # the folders are processed first
+        watcher = make_watcher(self.roots, self.exclude, self.poll)
+        try:
+            for path in scan_roots(self.roots, self.exclude):
+                self.settling.touch(path)
+            while not (stop and stop.is_set()):
+                due = self.settling.next_due()
+                timeout = 1.0 if due is None else min(max(due - time.monotonic(), 0), 1.0)
+                for path in watcher.changes(timeout):
+                    if path.lower().endswith(self.extensions):
+                        self.held.pop(path, None)
+                        self.settling.touch(path)
+                self.release_held()
+                ready = self.settling.ready()
+                if ready:
+                    self.process(ready)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            watcher.close()
+        return self.summary
+
+    def release_held(self):
+        now = time.monotonic()
+        for path, (_, retry_at) in list(self.held.items()):
+            if retry_at is not None and now >= retry_at:
+                del self.held[path]
+                self.settling.touch(path)
+
+    def finish(self, result, retry=True):
+        # retry=False holds the file until it changes (nothing else would make it go through)
+        status = result["status"]
+        self.summary[status] = self.summary.get(status, 0) + 1
+        count(f"watch.{status}")
+        if status != "renamed":
+            retry_at = time.monotonic() + config.WATCH_RETRY_SECONDS if retry and status != "skipped" else None
+            try:
+                self.held[result["source"]] = (file_signature(result["source"]), retry_at)
+            except OSError:
+                pass
+        if self.on_result:
+            self.on_result(result)
+
+    @timed("watch.process")
+    def process(self, paths):
+        groups = {}
+        for path in paths:
+            hints = [hint for hint in show_hints(path) if hint[0] not in self.root_names]
+            errors = []
+            show = None
+            try:
+                for name, year in hints:
+                    show = find_show(name, year, self.source, errors)
+                    if show:
+                        break
+            except BATCH_ERRORS as e:
+                errors.append(str(e))
+            if show is None:
+                result = {"source": path, "status": "error" if errors else "no_show", "queries": [name for name, _ in hints]}
+                if errors:
+                    result["error"] = "; ".join(errors)
+                self.finish(result)
+                continue
+            groups.setdefault(show[0], (show, []))[1].append(path)
+        for show, files in groups.values():
+            self.rename(show, files)
+
+    def rename(self, show, files):
+        described = {"id": show[0], "name": show[1], "year": show[2], "source": show[4]}
+        results, conflicts = [], set()
+        try:
+            episodes = get_episodes(show[0], show[4])
+            matches, unmatched, ambiguous = match_files(files, episodes)
+            pairs = [(match["episodes"], match["file"]) for match in matches]
+            if pairs:
+                plan = build_plan(show[1], show[2], pairs, self.output_dir, self.include_title, self.template)
+                results = execute_plan(plan, batch=new_batch_id(), placement=self.placement)
+                # execute_plan checks the plan again: entries left with a problem are conflicts
+                conflicts = {entry["source"] for entry in plan if entry["problem"]}
+        except BATCH_ERRORS as e:
+            # Files execute_plan already moved are gone from their folder and aren't held
+            for file in files:
+                self.finish({"source": file, "show": described, "status": "error", "error": str(e)})
+            return
+        for result in results:
+            self.finish(dict(result, show=described), retry=result["source"] not in conflicts)
+        for file in unmatched:
+            self.finish({"source": file, "show": described, "status": "unmatched"})
+        for entry in ambiguous:
+            self.finish({
+                "source": entry["file"],
+                "show": described,
+                "status": "ambiguous",
+                "reason": entry["reason"],
+                "candidates": [{"season": ep[0], "episode": ep[1], "title": ep[2]} for ep in entry["candidates"]],
+            })
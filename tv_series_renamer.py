@@ -1,237 +1,297 @@
+import time
+
+# Start of the import phase, for --startup-benchmark
+STARTED = time.perf_counter()
+
 import tkinter as tk
 from tkinter import ttk, messagebox, filedialog
-import requests
-import sqlite3
 import os
-import subprocess
-import json
-from datetime import datetime, timedelta
+import queue
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import platform
 from tkinter.font import Font
-from dotenv import load_dotenv
 from tkinter import PhotoImage
-
-# Ensure Windows-only execution
-if platform.system() != "Windows":
-    raise SystemExit("Esta aplicación está diseñada solo para Windows.")
-
-# Load environment variables from .env file
-load_dotenv()
-
-# API setup
-TMDB_API_KEY = os.getenv("TMDB_API_KEY")
-TMDB_TOKEN = os.getenv("TMDB_TOKEN")
-TVMAZE_API_URL = "https://api.tvmaze.com"
-TMDB_API_URL = "https://api.themoviedb.org/3"
-
-# SQLite database setup
-LOCALAPPDATA = os.getenv("LOCALAPPDATA")
-if LOCALAPPDATA is None:
-    raise ValueError("LOCALAPPDATA environment variable is not set")
-DB_FILE = os.path.join(LOCALAPPDATA, "TVSeriesRenamer", "cache.db")
-os.makedirs(os.path.dirname(DB_FILE), exist_ok=True)
-conn = sqlite3.connect(DB_FILE)
-cursor = conn.cursor()
-cursor.execute("""
-    CREATE TABLE IF NOT EXISTS shows (
-        id INTEGER PRIMARY KEY,
-        source TEXT,
-        name TEXT,
-        year INTEGER,
-        data TEXT,
-        last_updated TEXT
-    )
-""")
-cursor.execute("""
-    CREATE TABLE IF NOT EXISTS episodes (
-        show_id INTEGER,
-        source TEXT,
-        season INTEGER,
-        episode INTEGER,
-        title TEXT,
-        air_date TEXT,
-        data TEXT
-    )
-""")
-conn.commit()
-
-# FFprobe path
-FFPROBE_PATH = os.path.join(os.path.dirname(__file__), "ffprobe.exe")
-
-# Special characters replacement for Windows (Plex-compatible)
-SPECIAL_CHARS = {
-    '<': '', '>': '', ':': '', '"': '', '/': '', '\\': '', '|': '', '?': '', '*': ''
-}
-
-def is_cache_expired(last_updated):
-    if not last_updated:
-        return True
-    last_updated_dt = datetime.fromisoformat(last_updated)
-    return (datetime.now() - last_updated_dt) > timedelta(days=7)
-
-def search_shows(query):
-    # TVMaze search
-    cursor.execute("SELECT id, source, name, year, data, last_updated FROM shows WHERE source = ? AND name LIKE ?", ("tvmaze", f"%{query}%",))
-    cached_tvmaze = cursor.fetchall()
-    tvmaze_result = []
-    if cached_tvmaze and not is_cache_expired(cached_tvmaze[0][5]):
-        for row in cached_tvmaze:
-            show_data = json.loads(row[4])
-            display_name = show_data.get("name", "")
-            if "akas" in show_data:
-                for aka in show_data["akas"]:
-                    if aka.get("country", {}).get("code") == "ES":
-                        display_name = aka.get("name", display_name)
-                        break
-            tvmaze_result.append((row[0], display_name, row[3], show_data, "tvmaze"))
-    else:
-        try:
-            response = requests.get(f"{TVMAZE_API_URL}/search/shows?q={query}")
-            response.raise_for_status()
-            shows = response.json()
-            for show in shows:
-                show_data = show["show"]
-                if "akas" not in show_data:
-                    akas_resp = requests.get(f"{TVMAZE_API_URL}/shows/{show_data['id']}")
-                    if akas_resp.ok:
-                        show_data_full = akas_resp.json()
-                        if "akas" in show_data_full:
-                            show_data["akas"] = show_data_full["akas"]
-                year = show_data.get("premiered", "")[:4] if show_data.get("premiered") else None
-                display_name = show_data.get("name", "")
-                if "akas" in show_data:
-                    for aka in show_data["akas"]:
-                        if aka.get("country", {}).get("code") == "ES":
-                            display_name = aka.get("name", display_name)
-                            break
-                cursor.execute(
-                    "INSERT OR REPLACE INTO shows (id, source, name, year, data, last_updated) VALUES (?, ?, ?, ?, ?, ?)",
-                    (show_data["id"], "tvmaze", display_name, year, json.dumps(show_data), datetime.now().isoformat())
-                )
-                tvmaze_result.append((show_data["id"], display_name, year, show_data, "tvmaze"))
-            conn.commit()
-        except requests.RequestException as e:
-            messagebox.showerror("Error", f"La búsqueda en TVmaze falló: {e}")
-
-    # TMDB search
-    headers = {"Authorization": f"Bearer {TMDB_TOKEN}"}
-    tmdb_result = []
-    cursor.execute("SELECT id, source, name, year, data, last_updated FROM shows WHERE source = ? AND name LIKE ?", ("tmdb", f"%{query}%",))
-    cached_tmdb = cursor.fetchall()
-    if cached_tmdb and not is_cache_expired(cached_tmdb[0][5]):
-        for row in cached_tmdb:
-            show_data = json.loads(row[4])
-            display_name = show_data.get("name", "")
-            tmdb_result.append((row[0], display_name, show_data.get("first_air_date", "")[:4], show_data, "tmdb"))
-    else:
-        try:
-            response = requests.get(f"{TMDB_API_URL}/search/tv?api_key={TMDB_API_KEY}&query={query}", headers=headers)
-            response.raise_for_status()
-            shows = response.json().get("results", [])
-            for show in shows:
-                display_name = show.get("name", "")
-                year = show.get("first_air_date", "")[:4] if show.get("first_air_date") else None
-                cursor.execute(
-                    "INSERT OR REPLACE INTO shows (id, source, name, year, data, last_updated) VALUES (?, ?, ?, ?, ?, ?)",
-                    (show["id"], "tmdb", display_name, year, json.dumps(show), datetime.now().isoformat())
-                )
-                tmdb_result.append((show["id"], display_name, year, show, "tmdb"))
-            conn.commit()
-        except requests.RequestException as e:
-            messagebox.showerror("Error", f"La búsqueda en TMDB falló: {e}")
-
-    return tvmaze_result + tmdb_result
-
-def get_episodes(show_id, source):
-    cursor.execute("SELECT season, episode, title, air_date, data FROM episodes WHERE show_id = ? AND source = ?", (show_id, source))
-    cached = cursor.fetchall()
-    if cached and not is_cache_expired(cached[0][3]):
-        return [(row[0], row[1], row[2], row[3], json.loads(row[4])) for row in cached]
+from renamizer import config
+from renamizer.naming import PRESETS, get_template
+
+# The engine modules (requests, SQLite, ffprobe...) are imported where they are first
+# used, so the window appears without them; preload_engine() warms them up afterwards
+ENGINE_MODULES = ("renamizer.metadata", "renamizer.plan", "renamizer.mover", "renamizer.matcher", "renamizer.scanner")
+
+# Window icon size; the 1024 px logo is only decoded once to build it
+ICON_SIZE = 64
+# Time to first paint that --startup-benchmark checks against
+STARTUP_TARGET_MS = 500
+
+def preload_engine():
+    # Runs on a background thread once the window is up; imports are thread-safe
+    import importlib
+    for name in ENGINE_MODULES:
+        importlib.import_module(name)
+
+def window_icon(master):
+    # Small copy of logo.png cached next to cache.db, rebuilt when the logo changes
+    source = os.path.join(os.path.dirname(os.path.abspath(__file__)), "logo.png")
+    cached = os.path.join(os.path.dirname(config.DB_FILE), f"icon-{ICON_SIZE}.png")
     try:
-        if source == "tvmaze":
-            response = requests.get(f"{TVMAZE_API_URL}/shows/{show_id}/episodes")
-            response.raise_for_status()
-            episodes = response.json()
-        else:  # tmdb
-            headers = {"Authorization": f"Bearer {TMDB_TOKEN}"}
-            response = requests.get(
-                f"{TMDB_API_URL}/tv/{show_id}?api_key={TMDB_API_KEY}&language=es-ES",
-                headers=headers
-            )
-            response.raise_for_status()
-            seasons = response.json().get("seasons", [])
-            episodes = []
-            for season in seasons:
-                season_number = season.get("season_number")
-                if season_number is not None:
-                    season_response = requests.get(
-                        f"{TMDB_API_URL}/tv/{show_id}/season/{season_number}?api_key={TMDB_API_KEY}&language=es-ES",
-                        headers=headers
-                    )
-                    season_response.raise_for_status()
-                    episodes.extend(season_response.json().get("episodes", []))
-        
-        for ep in episodes:
-            cursor.execute(
-                "INSERT OR REPLACE INTO episodes (show_id, source, season, episode, title, air_date, data) VALUES (?, ?, ?, ?, ?, ?, ?)",
-                (show_id, source, ep["season"] if source == "tvmaze" else ep["season_number"], 
-                 ep["number"] if source == "tvmaze" else ep["episode_number"], 
-                 ep["name"], 
-                 ep.get("airdate", "") if source == "tvmaze" else ep.get("air_date", ""), 
-                 json.dumps(ep))
-            )
-        conn.commit()
-        return [(ep["season"] if source == "tvmaze" else ep["season_number"], 
-                ep["number"] if source == "tvmaze" else ep["episode_number"], 
-                ep["name"], 
-                ep.get("airdate", "") if source == "tvmaze" else ep.get("air_date", ""), 
-                ep) for ep in episodes]
-    except requests.RequestException as e:
-        messagebox.showerror("Error", f"No se pudieron obtener los episodios de {source}: {e}")
-        return []
-
-def get_media_info(file_path):
+        if os.path.getmtime(cached) >= os.path.getmtime(source):
+            return PhotoImage(master=master, file=cached)
+    except (OSError, tk.TclError):
+        pass
+    logo = PhotoImage(master=master, file=source)
+    icon = logo.subsample(max(1, logo.width() // ICON_SIZE))
     try:
-        result = subprocess.run(
-            [FFPROBE_PATH, "-v", "error", "-show_streams", "-print_format", "json", file_path],
-            capture_output=True, text=True
-        )
-        data = json.loads(result.stdout)
-        video_stream = next((s for s in data["streams"] if s["codec_type"] == "video"), None)
-        audio_stream = next((s for s in data["streams"] if s["codec_type"] == "audio"), None)
-        return {
-            "resolution": f"{video_stream['width']}x{video_stream['height']}" if video_stream else "",
-            "video_codec": video_stream["codec_name"].upper() if video_stream else "",
-            "audio_codec": audio_stream["codec_name"].upper() if audio_stream else "",
-            "audio_channels": audio_stream.get("channels", "") if audio_stream else ""
-        }
-    except (subprocess.SubprocessError, KeyError):
-        return {}
-
-def rename_file(filename, show_name, season, episode, title, year, media_info, output_dir, include_title):
-    season_str = f"s{season:02d}"
-    episode_str = f"e{episode:02d}"
-    filename_base = f"{show_name} - {season_str}{episode_str}"
-    if title and include_title:
-        filename_base += f" - {title}"
-    for char, replacement in SPECIAL_CHARS.items():
-        filename_base = filename_base.replace(char, replacement)
-    ext = os.path.splitext(filename)[1] or ".mp4"
-    season_folder = f"Temporada {season:02d}"
-    show_folder = f"{show_name} ({year})" if year else show_name
-    for char, replacement in SPECIAL_CHARS.items():
-        show_folder = show_folder.replace(char, replacement)
-    output_path = os.path.join(output_dir, "Series de TV", show_folder, season_folder)
-    os.makedirs(output_path, exist_ok=True)
-    new_filename = f"{filename_base}{ext}"
-    return os.path.join(output_path, new_filename)
+        os.makedirs(os.path.dirname(cached), exist_ok=True)
+        icon.write(cached, format="png")
+    except (OSError, tk.TclError) as e:
+        print(f"No se pudo guardar el icono reducido: {e}")
+    return icon
+
+def episode_label(values):
+    # values is (season, episode, title) or, for multi-episode files, (season, episode, title, last_episode)
+    if len(values) > 3:
+        return f"T{values[0]}E{values[1]}-E{values[3]} - {values[2]}"
+    return f"T{values[0]}E{values[1]} - {values[2]}"
+
+def show_label(show):
+    # Providers a merged search result was found in, e.g. "Breaking Bad (2008) [TVMAZE+TMDB]"
+    sources = "+".join(source.upper() for source in show[3].get("sources", {show[4]: show[0]}))
+    return f"{show[1]} ({show[2]}) [{sources}]"
+
+def episode_rows(values):
+    if len(values) > 3:
+        return [values[:3], (values[0], values[3], "")]
+    return [values]
+
+# Scanned files handed to the file list per update
+SCAN_CHUNK = 200
+
+class Task:
+    # Handle passed to background work: check `cancelled` between steps and report progress
+    def __init__(self, name, results):
+        self.name = name
+        self.cancelled = threading.Event()
+        self._results = results
+
+    def progress(self, done, total):
+        self._results.put((self, "progress", (done, total)))
+
+    def emit(self, items):
+        # Partial results for streaming work (delivered to on_items)
+        self._results.put((self, "items", items))
+
+class BackgroundTasks:
+    # Runs work on a thread pool and hands results back to the Tk thread, polling with after().
+    # Submitting a task under a name that is still running supersedes it: the old task is
+    # cancelled and whatever it returns later is dropped. Results of tasks cancelled with
+    # cancel() only reach on_cancelled.
+    POLL_MS = 50
+
+    def __init__(self, root, workers=4):
+        self.root = root
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.results = queue.Queue()
+        self.current = {}
+        self.callbacks = {}
+        self.root.after(self.POLL_MS, self._poll)
+
+    def submit(self, name, func, on_done=None, on_error=None, on_progress=None, on_cancelled=None, on_items=None):
+        previous = self.current.get(name)
+        if previous:
+            previous.cancelled.set()
+        task = Task(name, self.results)
+        self.current[name] = task
+        self.callbacks[task] = {"done": on_done, "error": on_error, "progress": on_progress, "cancelled": on_cancelled,
+                                "items": on_items}
+
+        def run():
+            try:
+                self.results.put((task, "done", func(task)))
+            except Exception as e:
+                self.results.put((task, "error", e))
+
+        self.executor.submit(run)
+        return task
+
+    def cancel(self, name=None):
+        for task_name, task in self.current.items():
+            if name is None or task_name == name:
+                task.cancelled.set()
+
+    def shutdown(self):
+        self.cancel()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def _poll(self):
+        # Rescheduled before dispatching, and a callback that raises is reported through Tk
+        # without stopping the others: results must keep flowing after one bad callback
+        self.root.after(self.POLL_MS, self._poll)
+        while True:
+            try:
+                task, kind, value = self.results.get_nowait()
+            except queue.Empty:
+                break
+            if self.current.get(task.name) is not task:
+                self.callbacks.pop(task, None)
+                continue
+            callbacks = self.callbacks[task]
+            if kind == "done" and task.cancelled.is_set():
+                kind = "cancelled"
+            if kind not in ("progress", "items"):
+                del self.current[task.name]
+                del self.callbacks[task]
+            if callbacks[kind]:
+                try:
+                    callbacks[kind](value)
+                except Exception:
+                    self.root.report_callback_exception(*sys.exc_info())
+
+class VirtualList:
+    # Treeview that only materializes the rows that fit on screen, so lists with thousands
+    # of entries open instantly. `rows` is the model (a list shared with the caller),
+    # `display(row)` gives the column values of a row and an optional filter picks the rows
+    # shown. The selection is kept by model index, so it survives scrolling and appends.
+    WHEEL_ROWS = 3
+
+    def __init__(self, parent, columns, display, horizontal=False):
+        container = ttk.Frame(parent)
+        container.pack(fill=tk.BOTH, expand=True)
+        self.scroll_y = ttk.Scrollbar(container, command=self.yview)
+        self.scroll_y.pack(side=tk.RIGHT, fill=tk.Y)
+        options = {}
+        if horizontal:
+            scroll_x = ttk.Scrollbar(container, orient=tk.HORIZONTAL)
+            scroll_x.pack(side=tk.BOTTOM, fill=tk.X)
+            options["xscrollcommand"] = scroll_x.set
+        self.tree = ttk.Treeview(container, columns=columns, show="headings", **options)
+        self.tree.pack(fill=tk.BOTH, expand=True, padx=0, pady=0)
+        if horizontal:
+            scroll_x.config(command=self.tree.xview)
+        self.display = display
+        self.rows = []
+        self.predicate = None
+        self.visible = None  # model indices passing the filter, None when unfiltered
+        self.selected = set()
+        self.top = 0
+        self.items = []  # materialized Treeview items, top to bottom
+        self.shown = []  # model index of each materialized item
+        self.header_height = None
+        self.tree.bind("<Configure>", lambda event: self.refresh())
+        self.tree.bind("<<TreeviewSelect>>", self.on_select)
+        self.tree.bind("<Button-1>", self.on_click, add=True)
+        self.tree.bind("<MouseWheel>", lambda event: self.scroll(-self.WHEEL_ROWS if event.delta > 0 else self.WHEEL_ROWS))
+        self.tree.bind("<Button-4>", lambda event: self.scroll(-self.WHEEL_ROWS))
+        self.tree.bind("<Button-5>", lambda event: self.scroll(self.WHEEL_ROWS))
+        self.tree.bind("<Prior>", lambda event: self.scroll(-self.page_size()))
+        self.tree.bind("<Next>", lambda event: self.scroll(self.page_size()))
+        self.tree.bind("<Up>", lambda event: self.on_arrow(-1))
+        self.tree.bind("<Down>", lambda event: self.on_arrow(1))
+
+    def count(self):
+        return len(self.rows) if self.visible is None else len(self.visible)
+
+    def index(self, position):
+        return position if self.visible is None else self.visible[position]
+
+    def page_size(self):
+        row_height = int(ttk.Style().lookup("Treeview", "rowheight") or 20)
+        if self.header_height is None and self.items:
+            bbox = self.tree.bbox(self.items[0])
+            if bbox:
+                self.header_height = bbox[1]
+        return max(1, (self.tree.winfo_height() - (self.header_height or row_height)) // row_height)
+
+    def set_rows(self, rows):
+        # Replaces the model and clears the filter; the list is used as is and grows with append()
+        self.rows = rows
+        self.selected = set()
+        self.set_filter(None)
+
+    def set_filter(self, predicate):
+        self.predicate = predicate
+        self.visible = None if predicate is None else [i for i, row in enumerate(self.rows) if predicate(row)]
+        self.top = 0
+        self.refresh()
+
+    def append(self, rows):
+        start = len(self.rows)
+        self.rows.extend(rows)
+        if self.predicate is not None:
+            self.visible.extend(i for i in range(start, len(self.rows)) if self.predicate(self.rows[i]))
+        self.refresh()
+
+    def selection(self):
+        return [self.rows[index] for index in sorted(self.selected)]
+
+    def refresh(self):
+        # Shows the page starting at self.top, reusing the materialized items
+        count = self.count()
+        page = self.page_size()
+        self.top = max(0, min(self.top, count - page))
+        wanted = [self.index(position) for position in range(self.top, min(count, self.top + page))]
+        while len(self.items) < len(wanted):
+            self.items.append(self.tree.insert("", tk.END))
+        while len(self.items) > len(wanted):
+            self.tree.delete(self.items.pop())
+        for item, index in zip(self.items, wanted):
+            self.tree.item(item, values=self.display(self.rows[index]))
+        self.shown = wanted
+        self.tree.selection_set([item for item, index in zip(self.items, wanted) if index in self.selected])
+        if count:
+            self.scroll_y.set(self.top / count, (self.top + len(wanted)) / count)
+        else:
+            self.scroll_y.set(0, 1)
+
+    def scroll(self, rows):
+        self.top += rows
+        self.refresh()
+        return "break"
+
+    def yview(self, *args):
+        # Scrollbar commands: ("moveto", fraction) or ("scroll", n, "units"/"pages")
+        if args[0] == "moveto":
+            self.top = int(float(args[1]) * self.count())
+            self.refresh()
+        elif args[0] == "scroll":
+            self.scroll(int(args[1]) * (self.page_size() if args[2] == "pages" else 1))
+
+    def on_click(self, event):
+        # A plain click replaces the selection, including rows scrolled out of view
+        if not event.state & 0x0005:  # Shift or Control
+            self.selected = set()
+
+    def on_select(self, event=None):
+        chosen = set(self.tree.selection())
+        for item, index in zip(self.items, self.shown):
+            if item in chosen:
+                self.selected.add(index)
+            else:
+                self.selected.discard(index)
+
+    def on_arrow(self, step):
+        # Arrow keys past the first or last materialized row scroll the list
+        focus = self.tree.focus()
+        if focus not in self.items:
+            return None
+        position = self.items.index(focus)
+        if not (step < 0 and position == 0 or step > 0 and position == len(self.items) - 1):
+            return None
+        if not 0 <= self.top + step <= self.count() - len(self.items):
+            return "break"
+        self.top += step
+        self.selected = {self.index(self.top + position)}
+        self.refresh()
+        self.tree.focus(self.items[position])
+        return "break"
 
 class Renamizer(tk.Tk):
     def __init__(self):
         super().__init__()
         # Logo como icono de la ventana
         try:
-            self.logo_img = PhotoImage(file=os.path.join(os.path.dirname(__file__), "logo.png"))
+            self.logo_img = window_icon(self)
             self.iconphoto(False, self.logo_img)
         except Exception as e:
             print(f"No se pudo cargar el logo: {e}")
@@ -252,11 +312,17 @@ class Renamizer(tk.Tk):
         self.small_font = Font(family="Segoe UI", size=9)
         
         # Variables
-        self.selected_episodes = []
-        self.selected_files = []
+        self.selected_episode_set = set()
+        self.selected_file_set = set()
         self.shows = []
+        self.episodes = []
         self.output_dir = None
         self.include_episode_title = tk.BooleanVar(value=True)
+        self.naming_template = tk.StringVar(value=config.NAMING_TEMPLATE)
+        self.episode_source = tk.StringVar(value=config.EPISODE_SOURCE)
+        self.placement = tk.StringVar(value=config.PLACEMENT)
+        self.tasks = BackgroundTasks(self)
+        self.protocol("WM_DELETE_WINDOW", self.quit)
         
         # Configure style
         self.style = ttk.Style()
@@ -267,6 +333,8 @@ class Renamizer(tk.Tk):
         
         # Center window
         self.eval('tk::PlaceWindow . center')
+        self.after_idle(lambda: threading.Thread(target=preload_engine, daemon=True).start())
+        self.after(500, self.check_interrupted_moves)
 
     def configure_style(self):
         self.style.theme_use('clam')
@@ -368,26 +436,11 @@ class Renamizer(tk.Tk):
         episodes_frame = ttk.LabelFrame(top_frame, text=" Episodios ", style='TLabelframe')
         episodes_frame.pack(side=tk.LEFT, fill=tk.BOTH, expand=True, padx=(0, 6), ipadx=3, ipady=3)
 
-        # Episodes treeview with scrollbars
-        tree_container = ttk.Frame(episodes_frame)
-        tree_container.pack(fill=tk.BOTH, expand=True)
-
-        scroll_y = ttk.Scrollbar(tree_container)
-        scroll_x = ttk.Scrollbar(tree_container, orient=tk.HORIZONTAL)
-        scroll_y.pack(side=tk.RIGHT, fill=tk.Y)
-        scroll_x.pack(side=tk.BOTTOM, fill=tk.X)
-
-        self.episodes_tree = ttk.Treeview(
-            tree_container, 
-            columns=("Temporada", "Episodio", "Título"), 
-            show="headings",
-            yscrollcommand=scroll_y.set,
-            xscrollcommand=scroll_x.set
+        # Episodes list with scrollbars
+        self.episodes_view = VirtualList(
+            episodes_frame, ("Temporada", "Episodio", "Título"), lambda ep: (ep[0], ep[1], ep[2]), horizontal=True
         )
-        self.episodes_tree.pack(fill=tk.BOTH, expand=True, padx=0, pady=0)
-
-        scroll_y.config(command=self.episodes_tree.yview)
-        scroll_x.config(command=self.episodes_tree.xview)
+        self.episodes_tree = self.episodes_view.tree
 
         self.episodes_tree.heading("Temporada", text="Temporada")
         self.episodes_tree.heading("Episodio", text="Episodio")
@@ -405,6 +458,11 @@ class Renamizer(tk.Tk):
         ttk.Radiobutton(order_frame, text="Por emisión").pack(side=tk.LEFT, padx=2)
         ttk.Radiobutton(order_frame, text="DVD").pack(side=tk.LEFT, padx=2)
         ttk.Radiobutton(order_frame, text="Continuo").pack(side=tk.LEFT, padx=2)
+        self.season_filter = ttk.Combobox(order_frame, values=("Todas",), width=7, state="readonly")
+        self.season_filter.set("Todas")
+        self.season_filter.pack(side=tk.RIGHT, padx=2)
+        self.season_filter.bind("<<ComboboxSelected>>", self.filter_season)
+        ttk.Label(order_frame, text="Temporada:").pack(side=tk.RIGHT, padx=(0, 2))
 
         # Right panels container
         right_panels = ttk.Frame(top_frame)
@@ -420,20 +478,8 @@ class Renamizer(tk.Tk):
         ttk.Button(btn_frame, text="Añadir Episodios", command=self.add_selected_episodes).pack(side=tk.LEFT, fill=tk.X, expand=True, padx=1, ipadx=1, ipady=1)
         ttk.Button(btn_frame, text="Ordenar Episodios", command=self.sort_episodes).pack(side=tk.LEFT, fill=tk.X, expand=True, padx=1, ipadx=1, ipady=1)
 
-        tree_container = ttk.Frame(selected_episodes_frame)
-        tree_container.pack(fill=tk.BOTH, expand=True)
-
-        scroll_y = ttk.Scrollbar(tree_container)
-        scroll_y.pack(side=tk.RIGHT, fill=tk.Y)
-
-        self.selected_episodes_tree = ttk.Treeview(
-            tree_container, 
-            columns=("Episodio",), 
-            show="headings",
-            yscrollcommand=scroll_y.set
-        )
-        self.selected_episodes_tree.pack(fill=tk.BOTH, expand=True, padx=0, pady=0)
-        scroll_y.config(command=self.selected_episodes_tree.yview)
+        self.selected_episodes_view = VirtualList(selected_episodes_frame, ("Episodio",), lambda values: (episode_label(values),))
+        self.selected_episodes_tree = self.selected_episodes_view.tree
 
         self.selected_episodes_tree.heading("Episodio", text="Episodios Seleccionados")
         self.selected_episodes_tree.column("Episodio", width=180)
@@ -448,21 +494,10 @@ class Renamizer(tk.Tk):
         ttk.Button(btn_frame, text="Añadir Archivos", command=self.add_files).pack(side=tk.LEFT, fill=tk.X, expand=True, padx=1, ipadx=1, ipady=1)
         ttk.Button(btn_frame, text="Añadir Carpetas", command=self.add_dirs).pack(side=tk.LEFT, fill=tk.X, expand=True, padx=1, ipadx=1, ipady=1)
         ttk.Button(btn_frame, text="Ordenar Archivos", command=self.sort_files).pack(side=tk.LEFT, fill=tk.X, expand=True, padx=1, ipadx=1, ipady=1)
+        ttk.Button(btn_frame, text="Emparejar", command=self.auto_match).pack(side=tk.LEFT, fill=tk.X, expand=True, padx=1, ipadx=1, ipady=1)
 
-        tree_container = ttk.Frame(selected_files_frame)
-        tree_container.pack(fill=tk.BOTH, expand=True)
-
-        scroll_y = ttk.Scrollbar(tree_container)
-        scroll_y.pack(side=tk.RIGHT, fill=tk.Y)
-
-        self.selected_files_tree = ttk.Treeview(
-            tree_container, 
-            columns=("Archivo",), 
-            show="headings",
-            yscrollcommand=scroll_y.set
-        )
-        self.selected_files_tree.pack(fill=tk.BOTH, expand=True, padx=0, pady=0)
-        scroll_y.config(command=self.selected_files_tree.yview)
+        self.selected_files_view = VirtualList(selected_files_frame, ("Archivo",), lambda path: (os.path.basename(path),))
+        self.selected_files_tree = self.selected_files_view.tree
 
         self.selected_files_tree.heading("Archivo", text="Archivos Seleccionados")
         self.selected_files_tree.column("Archivo", width=180)
@@ -481,6 +516,16 @@ class Renamizer(tk.Tk):
         ttk.Button(output_frame, text="Seleccionar Directorio", command=self.select_output_dir, style='TButton').pack(side=tk.RIGHT, padx=1, ipadx=3, ipady=1)
         ttk.Button(output_frame, text="Renombrar Archivos", command=self.rename_files, style='Accent.TButton').pack(side=tk.RIGHT, padx=1, ipadx=3, ipady=1)
 
+        # Background task progress
+        progress_frame = ttk.Frame(bottom_frame)
+        progress_frame.pack(fill=tk.X, pady=(0, 2))
+
+        self.status_label = ttk.Label(progress_frame, text="", font=self.small_font, background="#f7fafd")
+        self.status_label.pack(side=tk.LEFT, padx=3)
+        ttk.Button(progress_frame, text="Cancelar", command=self.cancel_tasks).pack(side=tk.RIGHT, padx=1, ipadx=3, ipady=1)
+        self.progress_bar = ttk.Progressbar(progress_frame, mode="determinate", length=240)
+        self.progress_bar.pack(side=tk.RIGHT, padx=3)
+
         # --- AQUI VA EL LOGO ---
         logo_frame = ttk.Frame(bottom_frame)
         logo_frame.pack(side=tk.LEFT, anchor="sw", padx=(0, 6), pady=(0, 2))
@@ -513,12 +558,51 @@ class Renamizer(tk.Tk):
         ttk.Button(right_btn_frame, text="Limpiar Listas", command=self.clear_lists).pack(side=tk.RIGHT, padx=2, ipadx=3, ipady=1)
         ttk.Button(right_btn_frame, text="Eliminar Todo", command=self.clear_all).pack(side=tk.RIGHT, padx=2, ipadx=3, ipady=1)
 
+    def set_status(self, text="", done=0, total=0):
+        self.status_label.config(text=text)
+        if total:
+            self.progress_bar.stop()
+            self.progress_bar.config(mode="determinate", maximum=total, value=done)
+        elif text:
+            self.progress_bar.config(mode="indeterminate")
+            self.progress_bar.start(15)
+        else:
+            self.progress_bar.stop()
+            self.progress_bar.config(mode="determinate", value=0)
+
+    def cancel_tasks(self):
+        self.tasks.cancel()
+        self.set_status()
+
+    def quit(self):
+        self.tasks.shutdown()
+        super().quit()
+
     def search_shows(self):
+        from renamizer.metadata import search_shows as search_shows_task
         query = self.search_entry.get()
         self.shows_listbox.delete(0, tk.END)
-        self.shows = search_shows(query)
+        self.shows = []
+        errors = []
+        self.set_status("Buscando series...")
+        self.tasks.submit(
+            "search",
+            lambda task: search_shows_task(query, errors),
+            on_done=lambda shows: self.show_search_results(shows, errors),
+            on_error=lambda e: self.task_failed("Error", f"La búsqueda falló: {e}")
+        )
+
+    def show_search_results(self, shows, errors):
+        self.set_status()
+        self.shows = shows
         for show in self.shows:
-            self.shows_listbox.insert(tk.END, f"{show[1]} ({show[2]}) [{show[4].upper()}]")
+            self.shows_listbox.insert(tk.END, show_label(show))
+        if errors:
+            messagebox.showerror("Error", "\n".join(errors))
+
+    def task_failed(self, title, message):
+        self.set_status()
+        messagebox.showerror(title, message)
 
     def on_show_select(self, event):
         selection = self.shows_listbox.curselection()
@@ -526,51 +610,123 @@ class Renamizer(tk.Tk):
             return
         show_index = selection[0]
         show = self.shows[show_index]
-        self.episodes_tree.delete(*self.episodes_tree.get_children())
-        episodes = get_episodes(show[0], show[4])
-        for ep in episodes:
-            self.episodes_tree.insert("", tk.END, values=(ep[0], ep[1], ep[2]))
+        # Shows found on both providers load the preferred one's episodes (TMDB has Spanish titles)
+        sources = show[3].get("sources", {show[4]: show[0]})
+        source = self.episode_source.get() if self.episode_source.get() in sources else show[4]
+        show_id = sources.get(source, show[0])
+        from renamizer.metadata import get_episodes
+        self.show_episodes([])
+        self.set_status("Obteniendo episodios...")
+        # A newer selection supersedes an episode fetch that is still in flight
+        self.tasks.submit(
+            "episodes",
+            lambda task: get_episodes(show_id, source),
+            on_done=self.show_episodes,
+            on_error=lambda e: self.task_failed("Error", f"No se pudieron obtener los episodios de {source}: {e}")
+        )
+
+    @property
+    def selected_episodes(self):
+        return self.selected_episodes_view.rows
+
+    @property
+    def selected_files(self):
+        return self.selected_files_view.rows
+
+    def show_episodes(self, episodes):
+        self.set_status()
+        self.episodes = episodes
+        self.episodes_view.set_rows(episodes)
+        self.season_filter.config(values=["Todas"] + [str(season) for season in sorted({ep[0] for ep in episodes})])
+        self.season_filter.set("Todas")
+
+    def filter_season(self, event=None):
+        season = self.season_filter.get()
+        self.episodes_view.set_filter(None if season == "Todas" else lambda ep: str(ep[0]) == season)
 
     def add_episode(self, event):
-        selection = self.episodes_tree.selection()
-        for item in selection:
-            values = self.episodes_tree.item(item, "values")
-            if values not in self.selected_episodes:
-                self.selected_episodes.append(values)
-                self.selected_episodes_tree.insert("", tk.END, values=(f"T{values[0]}E{values[1]} - {values[2]}",))
+        self.episodes_view.on_select()
+        values = []
+        for ep in self.episodes_view.selection():
+            if (ep[0], ep[1]) not in self.selected_episode_set:
+                self.selected_episode_set.add((ep[0], ep[1]))
+                values.append((ep[0], ep[1], ep[2]))
+        self.selected_episodes_view.append(values)
 
     def add_selected_episodes(self):
         self.add_episode(None)
 
     def sort_episodes(self):
-        self.selected_episodes.sort(key=lambda x: (int(x[0]), int(x[1])))
-        self.selected_episodes_tree.delete(*self.selected_episodes_tree.get_children())
-        for values in self.selected_episodes:
-            self.selected_episodes_tree.insert("", tk.END, values=(f"T{values[0]}E{values[1]} - {values[2]}",))
+        self.selected_episodes_view.set_rows(sorted(self.selected_episodes, key=lambda x: (int(x[0]), int(x[1]))))
+
+    def add_file_paths(self, paths):
+        added = []
+        for path in paths:
+            path = os.path.normpath(path)
+            if path not in self.selected_file_set:
+                self.selected_file_set.add(path)
+                added.append(path)
+        self.selected_files_view.append(added)
 
     def add_files(self):
-        files = filedialog.askopenfilenames(filetypes=[("Archivos de Video", "*.mp4 *.mkv *.avi")])
-        for file in files:
-            if file not in self.selected_files:
-                self.selected_files.append(file)
-                self.selected_files_tree.insert("", tk.END, values=(os.path.basename(file),))
+        patterns = " ".join(f"*{ext}" for ext in config.VIDEO_EXTENSIONS)
+        files = filedialog.askopenfilenames(filetypes=[("Archivos de Video", patterns)])
+        self.add_file_paths(files)
 
     def add_dirs(self):
         dir_path = filedialog.askdirectory()
-        if dir_path:
-            for root, _, files in os.walk(dir_path):
-                for file in files:
-                    if file.lower().endswith(('.mp4', '.mkv', '.avi')):
-                        full_path = os.path.join(root, file)
-                        if full_path not in self.selected_files:
-                            self.selected_files.append(full_path)
-                            self.selected_files_tree.insert("", tk.END, values=(os.path.basename(full_path),))
+        if not dir_path:
+            return
+
+        def run(task):
+            from renamizer.scanner import scan
+            # Stream results in chunks so the list fills while the scan goes on
+            chunk = []
+            for file in scan(dir_path):
+                if task.cancelled.is_set():
+                    break
+                chunk.append(file.path)
+                if len(chunk) >= SCAN_CHUNK:
+                    task.emit(chunk)
+                    chunk = []
+            if chunk:
+                task.emit(chunk)
+
+        self.set_status("Buscando archivos de vídeo...")
+        self.tasks.submit(
+            "scan",
+            run,
+            on_items=self.add_file_paths,
+            on_done=lambda result: self.set_status(),
+            on_cancelled=lambda result: self.set_status(),
+            on_error=lambda e: self.task_failed("Error", f"No se pudo explorar {dir_path}: {e}")
+        )
 
     def sort_files(self):
-        self.selected_files.sort()
-        self.selected_files_tree.delete(*self.selected_files_tree.get_children())
-        for file in self.selected_files:
-            self.selected_files_tree.insert("", tk.END, values=(os.path.basename(file)))
+        self.selected_files_view.set_rows(sorted(self.selected_files))
+
+    def auto_match(self):
+        # Pair the selected files with the loaded episodes by what their names say
+        if not self.episodes:
+            messagebox.showerror("Error de selección", "Primero selecciona una serie y carga sus episodios.")
+            return
+        from renamizer.matcher import match_files
+        matches, unmatched, ambiguous = match_files(self.selected_files, self.episodes)
+        self.clear_lists()
+        episodes, files = [], []
+        for match in matches:
+            first, last = match["episodes"][0], match["episodes"][-1]
+            values = (first[0], first[1], first[2]) if first is last else (first[0], first[1], first[2], last[1])
+            episodes.append(values)
+            files.append(match["file"])
+            self.selected_episode_set.update((ep[0], ep[1]) for ep in match["episodes"])
+            self.selected_file_set.add(match["file"])
+        self.selected_episodes_view.set_rows(episodes)
+        self.selected_files_view.set_rows(files)
+        if unmatched or ambiguous:
+            lines = [f"Sin coincidencia: {os.path.basename(file)}" for file in unmatched]
+            lines += [f"Ambiguo: {os.path.basename(entry['file'])}" for entry in ambiguous]
+            messagebox.showwarning("Emparejado incompleto", "Estos archivos se han quitado de la lista:\n\n" + "\n".join(lines[:30]))
 
     def select_output_dir(self):
         output_dir = filedialog.askdirectory()
@@ -581,47 +737,137 @@ class Renamizer(tk.Tk):
             self.output_dir = None
             self.output_dir_label.config(text="Directorio de Salida: No seleccionado")
 
-    def rename_files(self):
+    def rename_request(self):
+        # Show, pairs and options of the current selection, or None after showing what's missing
         if not self.output_dir:
             messagebox.showerror("Error de directorio", "Por favor, selecciona un directorio de salida.")
-            return
+            return None
         if len(self.selected_episodes) != len(self.selected_files):
             messagebox.showerror("Error de coincidencia", "El número de episodios y archivos debe coincidir.")
+            return None
+        show_index = self.shows_listbox.curselection()
+        if not show_index:
+            messagebox.showerror("Error de selección", "No se ha seleccionado ninguna serie.")
+            return None
+        show = self.shows[show_index[0]]
+        pairs = [(episode_rows(values), file) for values, file in zip(self.selected_episodes, self.selected_files)]
+        try:
+            template = get_template(self.naming_template.get())
+        except ValueError as e:
+            messagebox.showerror("Error de plantilla", f"La plantilla de nombres no es válida: {e}")
+            return None
+        return show[1], show[2], pairs, self.output_dir, self.include_episode_title.get(), template
+
+    def rename_files(self):
+        if self.tasks.current.get("rename"):
+            messagebox.showerror("Renombrado en curso", "Espera a que termine el renombrado actual.")
+            return
+        request = self.rename_request()
+        if not request:
             return
-        for i, (episode, file) in enumerate(zip(self.selected_episodes, self.selected_files)):
-            show_index = self.shows_listbox.curselection()
-            if not show_index:
-                messagebox.showerror("Error de selección", "No se ha seleccionado ninguna serie.")
+        from renamizer.plan import build_plan
+        # The whole batch is planned and checked before any file is touched
+        self.set_status("Comprobando destinos...")
+        self.tasks.submit(
+            "rename",
+            lambda task: build_plan(*request),
+            on_done=self.confirm_plan,
+            on_cancelled=lambda plan: self.set_status(),
+            on_error=lambda e: self.task_failed("Error al renombrar", str(e))
+        )
+
+    def confirm_plan(self, plan):
+        from renamizer.mover import MoveStats
+        from renamizer.plan import describe_problem, execute_plan, plan_problems
+        self.set_status()
+        problems = plan_problems(plan)
+        if problems:
+            lines = [describe_problem(entry) for entry in problems[:20]]
+            if len(problems) > len(lines):
+                lines.append(f"... y {len(problems) - len(lines)} más")
+            if len(problems) == len(plan):
+                messagebox.showerror("No se puede renombrar", "\n".join(lines))
                 return
-            show = self.shows[show_index[0]]
-            show_name = show[1]
-            year = show[2]
-            media_info = get_media_info(file)
-            new_path = rename_file(
-                os.path.basename(file),
-                show_name,
-                int(episode[0]),
-                int(episode[1]),
-                episode[2],
-                year,
-                media_info,
-                self.output_dir,
-                self.include_episode_title.get()
-            )
-            try:
-                os.rename(file, new_path)
-            except OSError as e:
-                messagebox.showerror("Error al renombrar", f"No se pudo renombrar {file}: {e}")
-        messagebox.showinfo(
-            "¡Éxito!",
-            "¡Archivos renombrados con éxito!\n\nVuelve a escanear tu biblioteca de Plex para actualizar."
+            if not messagebox.askyesno(
+                "Conflictos de destino",
+                f"{len(problems)} archivos no se pueden renombrar:\n\n" + "\n".join(lines) + "\n\n¿Renombrar el resto?"
+            ):
+                return
+        plan = [entry for entry in plan if not entry["problem"]]
+        stats = MoveStats()
+        placement = self.placement.get()
+
+        def run(task):
+            results = execute_plan(plan, task.cancelled, task.progress, stats=stats, placement=placement)
+            errors = [f"No se pudo renombrar {r['source']}: {r['error']}" for r in results if r["status"] == "error"]
+            return len(results), errors, task.cancelled.is_set()
+
+        self.set_status("Renombrando archivos...", 0, len(plan))
+        self.submit_moves(run, stats)
+
+    def submit_moves(self, run, stats):
+        # Runs a rename, resume or rollback as the "rename" task, showing copy throughput
+        def show_progress(progress):
+            detail = stats.describe()
+            self.set_status(f"Renombrando archivos... {progress[0]}/{progress[1]}" + (f" ({detail})" if detail else ""), *progress)
+
+        self.tasks.submit(
+            "rename",
+            run,
+            on_done=self.rename_finished,
+            on_cancelled=self.rename_finished,
+            on_error=lambda e: self.task_failed("Error al renombrar", str(e)),
+            on_progress=show_progress
+        )
+
+    def check_interrupted_moves(self):
+        # Offers to finish or undo a batch that stopped halfway (crash, power cut...).
+        # The journal is read on a worker thread so opening cache.db doesn't block the window.
+        from renamizer.mover import interrupted_batches
+        self.tasks.submit("interrupted", lambda task: interrupted_batches(), on_done=self.offer_interrupted)
+
+    def offer_interrupted(self, interrupted):
+        from renamizer.mover import MoveStats, resume_batch, rollback_batch
+        if not interrupted:
+            return
+        batch, pending = interrupted[-1]
+        answer = messagebox.askyesnocancel(
+            "Renombrado interrumpido",
+            f"Un renombrado anterior se interrumpió con {pending} archivos pendientes.\n\n"
+            "Sí: terminarlo\nNo: deshacerlo y devolver los archivos a su sitio\nCancelar: dejarlo como está"
         )
+        if answer is None:
+            return
+        action = resume_batch if answer else rollback_batch
+        stats = MoveStats()
+
+        def run(task):
+            results = action(batch, task.cancelled, task.progress, stats)
+            errors = [f"No se pudo mover {source}: {r['error']}" for source, r in results.items() if r["status"] == "error"]
+            return sum(r["status"] != "cancelled" for r in results.values()), errors, task.cancelled.is_set()
+
+        self.set_status("Renombrando archivos...")
+        self.submit_moves(run, stats)
+
+    def rename_finished(self, result):
+        done, errors, cancelled = result
+        self.set_status()
+        if errors:
+            messagebox.showerror("Error al renombrar", "\n".join(errors))
+        if cancelled:
+            messagebox.showinfo("Renombrado cancelado", f"Renombrado cancelado tras procesar {done} archivos.")
+        else:
+            messagebox.showinfo(
+                "¡Éxito!",
+                "¡Archivos renombrados con éxito!\n\nVuelve a escanear tu biblioteca de Plex para actualizar."
+            )
         self.clear_lists()
 
     def open_preferences(self):
+        from renamizer.mover import PLACEMENTS
         pref_window = tk.Toplevel(self)
         pref_window.title("Configuración")
-        pref_window.geometry("400x200")
+        pref_window.geometry("580x420")
         pref_window.configure(bg="#f7fafd")
 
         content_frame = ttk.Frame(pref_window)
@@ -630,6 +876,17 @@ class Renamizer(tk.Tk):
         ttk.Label(content_frame, text="Incluir Título del Episodio en el Nombre:", font=self.normal_font).pack(pady=14)
         ttk.Checkbutton(content_frame, text="Habilitar", variable=self.include_episode_title, style='TCheckbutton').pack(pady=8)
 
+        ttk.Label(content_frame, text="Plantilla de Nombres (preajuste o patrón propio):", font=self.normal_font).pack(pady=(8, 4))
+        ttk.Combobox(content_frame, textvariable=self.naming_template, values=list(PRESETS), font=self.normal_font).pack(fill=tk.X)
+
+        ttk.Label(content_frame, text="Colocación (move mueve; hardlink, reflink, symlink y copy dejan el original):", font=self.normal_font).pack(pady=(8, 4))
+        ttk.Combobox(content_frame, textvariable=self.placement, values=list(PLACEMENTS), state="readonly", font=self.normal_font).pack(fill=tk.X)
+
+        ttk.Label(content_frame, text="Episodios de (series en TVMaze y TMDB; tmdb tiene títulos en español):", font=self.normal_font).pack(pady=(8, 4))
+        source_box = ttk.Combobox(content_frame, textvariable=self.episode_source, values=("tvmaze", "tmdb"), state="readonly", font=self.normal_font)
+        source_box.pack(fill=tk.X)
+        source_box.bind("<<ComboboxSelected>>", lambda event: self.on_show_select(None))
+
         btn_frame = ttk.Frame(content_frame)
         btn_frame.pack(fill=tk.X, pady=18)
 
@@ -642,15 +899,11 @@ class Renamizer(tk.Tk):
         show_index = selection[0]
         show = self.shows[show_index]
         show_data = show[3]
-        display_name = show_data.get("name", "")
-        if "akas" in show_data and show[4] == "tvmaze":
-            for aka in show_data["akas"]:
-                if aka.get("country", {}).get("code") == "ES":
-                    display_name = aka.get("name", display_name)
-                    break
-        self.shows_listbox.delete(show_index)
-        self.shows_listbox.insert(show_index, f"{display_name} ({show[2]}) [{show[4].upper()}]")
+        from renamizer.metadata import spanish_name
+        display_name = spanish_name(show_data) if show[4] == "tvmaze" else show_data.get("name", "")
         self.shows[show_index] = (show[0], display_name, show[2], show_data, show[4])
+        self.shows_listbox.delete(show_index)
+        self.shows_listbox.insert(show_index, show_label(self.shows[show_index]))
 
     def get_episodes_btn(self):
         self.on_show_select(None)
@@ -666,9 +919,35 @@ class Renamizer(tk.Tk):
         webbrowser.open("https://github.com/Fralopala2/Renamizer")
 
     def export(self):
-        messagebox.showinfo(
-            "Exportar",
-            "La funcionalidad de exportación no está implementada aún.\n\n¡Próximamente podrás exportar tus listas y configuraciones!"
+        # Saves the rename plan (targets and conflicts) to review it before renaming
+        request = self.rename_request()
+        if not request:
+            return
+        path = filedialog.asksaveasfilename(
+            title="Exportar plan de renombrado",
+            defaultextension=".json",
+            filetypes=[("JSON", "*.json"), ("CSV", "*.csv")]
+        )
+        if not path:
+            return
+
+        def run(task):
+            from renamizer.plan import build_plan, plan_problems, write_plan
+            plan = build_plan(*request)
+            write_plan(plan, path)
+            return len(plan), len(plan_problems(plan))
+
+        def exported(result):
+            self.set_status()
+            messagebox.showinfo("Exportar", f"Plan guardado en {path}\n\n{result[0]} archivos, {result[1]} con conflictos.")
+
+        self.set_status("Calculando plan...")
+        self.tasks.submit(
+            "plan",
+            run,
+            on_done=exported,
+            on_cancelled=lambda result: self.set_status(),
+            on_error=lambda e: self.task_failed("Error al exportar", str(e))
         )
 
     def force_refresh(self):
@@ -677,27 +956,52 @@ class Renamizer(tk.Tk):
             return
         show_index = selection[0]
         show = self.shows[show_index]
-        cursor.execute("DELETE FROM shows WHERE id = ? AND source = ?", (show[0], show[4]))
-        cursor.execute("DELETE FROM episodes WHERE show_id = ? AND source = ?", (show[0], show[4]))
-        conn.commit()
+        from renamizer.metadata import forget_show
+        for source, show_id in show[3].get("sources", {show[4]: show[0]}).items():
+            forget_show(show_id, source)
         messagebox.showinfo(
             "Caché limpiado",
             "Caché limpiado para la serie seleccionada.\n\nPor favor, realiza una nueva búsqueda para actualizar los datos."
         )
 
     def clear_lists(self):
-        self.selected_episodes_tree.delete(*self.selected_episodes_tree.get_children())
-        self.selected_files_tree.delete(*self.selected_files_tree.get_children())
-        self.selected_episodes = []
-        self.selected_files = []
+        self.selected_episodes_view.set_rows([])
+        self.selected_files_view.set_rows([])
+        self.selected_episode_set = set()
+        self.selected_file_set = set()
 
     def clear_all(self):
         self.clear_lists()
         self.shows_listbox.delete(0, tk.END)
-        self.episodes_tree.delete(*self.episodes_tree.get_children())
+        self.show_episodes([])
         self.output_dir = None
         self.output_dir_label.config(text="Directorio de Salida: No seleccionado")
 
+def startup_benchmark(app, imported_at):
+    # Prints the import time and the time to first paint (window mapped and drawn) and
+    # exits with 1 when it is over STARTUP_TARGET_MS. Run "python -X importtime" on top
+    # of it to see which imports take the time.
+    imported = (imported_at - STARTED) * 1000
+
+    def painted(event=None):
+        app.unbind("<Map>")
+        app.update_idletasks()
+        elapsed = (time.perf_counter() - STARTED) * 1000
+        print(f"Importaciones: {imported:.0f} ms\nPrimera pintura: {elapsed:.0f} ms (objetivo: {STARTUP_TARGET_MS} ms)")
+        app.exit_code = 0 if elapsed <= STARTUP_TARGET_MS else 1
+        app.after_idle(app.quit)
+
+    app.bind("<Map>", lambda event: event.widget is app and painted())
+
 if __name__ == "__main__":
+    benchmark = "--startup-benchmark" in sys.argv[1:]
+    # Ensure Windows-only execution (the headless engine runs anywhere: python -m renamizer)
+    if platform.system() != "Windows" and not benchmark:
+        raise SystemExit("Esta aplicación está diseñada solo para Windows.")
+    imported_at = time.perf_counter()
     app = Renamizer()
-    app.mainloop()
\ No newline at end of file
+    app.exit_code = 0
+    if benchmark:
+        startup_benchmark(app, imported_at)
+    app.mainloop()
+    raise SystemExit(app.exit_code)
\ No newline at end of file